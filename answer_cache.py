@@ -0,0 +1,115 @@
+import threading
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+import numpy as np
+from config import Config
+
+# 여러 과목 통합 검색 답변의 캐시 키
+ALL_SUBJECTS_KEY = "__all_subjects__"
+
+
+class _Bucket:
+    """한 과목(또는 통합 검색)의 캐시: 질문 벡터 행렬과 (만료 시각, 질문, 답변, 참조 문서) 목록"""
+
+    def __init__(self, revision):
+        self.revision = revision
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.entries: List[Tuple[float, str, str, list]] = []
+
+    def drop(self, keep: np.ndarray):
+        self.vectors = self.vectors[keep]
+        self.entries = [e for e, k in zip(self.entries, keep) if k]
+
+
+class SemanticAnswerCache:
+    """비슷한 질문(질문 임베딩 코사인 유사도 ≥ 기준)에 이전 답변과 참조 문서를 돌려주는 과목별 캐시
+
+    - 항목은 TTL이 지나면 만료되고, 과목당 최대 개수를 넘으면 오래된 것부터 지움
+    - 조회할 때 넘긴 색인 revision이 저장 당시와 다르면 (자료 추가/삭제) 그 과목 캐시를 통째로 비움
+    - 과목당 항목이 많지 않으므로 numpy 행렬 곱으로 전수 비교
+    """
+
+    def __init__(self, ttl: float = None, min_similarity: float = None, max_entries: int = None):
+        self.ttl = Config.ANSWER_CACHE_TTL_SECONDS if ttl is None else ttl
+        self.min_similarity = Config.ANSWER_CACHE_MIN_SIMILARITY if min_similarity is None else min_similarity
+        self.max_entries = max_entries or Config.ANSWER_CACHE_MAX_ENTRIES
+        self.buckets: Dict[Hashable, _Bucket] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        return v / max(float(np.linalg.norm(v)), 1e-12)
+
+    def _bucket(self, key: Hashable, revision) -> _Bucket:
+        bucket = self.buckets.get(key)
+        if bucket is None or bucket.revision != revision:
+            if bucket is not None and bucket.entries:
+                self.invalidations += 1
+            bucket = self.buckets[key] = _Bucket(revision)
+        return bucket
+
+    def lookup(self, key: Hashable, revision, vector) -> Optional[Tuple[str, list]]:
+        """가장 비슷한 유효 항목의 (답변, 참조 문서). 기준 미달이면 None"""
+        query = self._normalize(vector)
+        with self._lock:
+            bucket = self._bucket(key, revision)
+            if bucket.entries:
+                now = time.time()
+                alive = np.array([e[0] > now for e in bucket.entries])
+                if not alive.all():
+                    bucket.drop(alive)
+            if bucket.entries:
+                sims = bucket.vectors @ query
+                best = int(np.argmax(sims))
+                if sims[best] >= self.min_similarity:
+                    self.hits += 1
+                    _, _, answer, sources = bucket.entries[best]
+                    return answer, list(sources)
+            self.misses += 1
+            return None
+
+    def store(self, key: Hashable, revision, vector, question: str, answer: str, sources: list):
+        query = self._normalize(vector)
+        with self._lock:
+            bucket = self._bucket(key, revision)
+            if bucket.entries and bucket.vectors.shape[1] != query.shape[0]:
+                bucket = self.buckets[key] = _Bucket(revision)  # 임베딩 모델이 바뀐 경우
+            vectors = query[None, :] if not bucket.entries else np.vstack([bucket.vectors, query])
+            bucket.vectors = vectors[-self.max_entries:]
+            bucket.entries = (bucket.entries + [(time.time() + self.ttl, question, answer, list(sources))])[-self.max_entries:]
+
+    def clear(self, key: Hashable = None):
+        with self._lock:
+            if key is None:
+                self.buckets.clear()
+            else:
+                self.buckets.pop(key, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "invalidations": self.invalidations,
+                "entries": {str(k): len(b.entries) for k, b in self.buckets.items() if b.entries},
+            }
+
+
+# 여러 세션(학생)이 같은 캐시를 쓰도록 프로세스당 하나
+_shared_cache: Optional[SemanticAnswerCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_lock:
+            if _shared_cache is None:
+                _shared_cache = SemanticAnswerCache()
+    return _shared_cache
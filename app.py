@@ -1,15 +1,11 @@
 import streamlit as st
 import os
+import sys
 import base64
 from config import Config
-from pdf_processor import PDFProcessor
-from vector_store import MultiSubjectVectorStoreManager
-from chatbot import MultiSubjectChatbot
-from quiz_generator import MultiSubjectQuizGen, Quiz, generate_quiz_from_link
-from utils.web_tools import web_search, fetch_link_content, save_web_results_to_vectorstore
+from subject_catalog import content_hash, list_subjects, subject_info
 from collections import Counter, defaultdict
-import matplotlib.pyplot as plt
-import platform
+from contextlib import closing
 
 # =========================
 # Streamlit 메인 학습 앱
@@ -17,11 +13,7 @@ import platform
 Config.validate()
 
 # 세션 상태 초기화
-if "vs_manager" not in st.session_state:
-    st.session_state.vs_manager = MultiSubjectVectorStoreManager()
-    st.session_state.pdf = PDFProcessor()
-    st.session_state.bot = MultiSubjectChatbot(st.session_state.vs_manager)
-    st.session_state.qg = MultiSubjectQuizGen(st.session_state.vs_manager)
+if "current_subject" not in st.session_state:
     st.session_state.current_subject = ""
     st.session_state.wrong_answers = []
     st.session_state.chat_history = {}
@@ -31,6 +23,33 @@ if "vs_manager" not in st.session_state:
     st.session_state.quiz_completed = False
     st.session_state.quiz_history = {}  # ✅ 과목별 생성된 퀴즈 수 추적
 
+# 과목 색인 관리자/PDF 처리기/챗봇/퀴즈 생성기는 처음 필요할 때 생성 (LangChain·FAISS·LLM 클라이언트 import를
+# 첫 화면에서 뺌. 과목 목록과 문서 수는 subject_catalog로 디스크에서 바로 읽음)
+def get_vs_manager():
+    if "vs_manager" not in st.session_state:
+        # ✅ 임베딩 모델과 과목 색인은 프로세스 전체가 공유 (세션마다 새로 만들지 않음)
+        from vector_store import get_shared_manager
+        st.session_state.vs_manager = get_shared_manager()
+    return st.session_state.vs_manager
+
+def get_pdf_processor():
+    if "pdf" not in st.session_state:
+        from pdf_processor import PDFProcessor
+        st.session_state.pdf = PDFProcessor()
+    return st.session_state.pdf
+
+def get_bot():
+    if "bot" not in st.session_state:
+        from chatbot import MultiSubjectChatbot
+        st.session_state.bot = MultiSubjectChatbot(get_vs_manager())
+    return st.session_state.bot
+
+def get_quiz_gen():
+    if "qg" not in st.session_state:
+        from quiz_generator import MultiSubjectQuizGen
+        st.session_state.qg = MultiSubjectQuizGen(get_vs_manager())
+    return st.session_state.qg
+
 # 새로운 동영상 파일 경로
 CHARACTER_VIDEO_PATH = Config.CHARACTER_VIDEO_PATH
 CHARACTER_VIDEO_WIDTH = 150
@@ -45,6 +64,8 @@ def play_character_video_html():
         st.write("캐릭터 영상(character.mp4)이 없습니다.")
 
 def add_to_wrong_answers(quiz, user_answer):
+    from quiz_generator import Quiz
+
     if isinstance(quiz, Quiz):
         wrong_item = {
             "subject": "링크퀴즈" if "링크" in quiz.subject else quiz.subject,  # ✅ 링크퀴즈는 명칭 통일
@@ -72,7 +93,7 @@ st.set_page_config(page_title=Config.APP_TITLE, page_icon="📚", layout="wide")
 
 # 사이드바 과목 선택
 st.sidebar.title("📚 학습 메뉴")
-subjects = [s for s in st.session_state.vs_manager.get_subjects() if s.strip()]
+subjects = [s for s in list_subjects() if s.strip()]
 
 if not subjects:
     st.warning("⚠ 현재 등록된 과목이 없습니다. PDF를 먼저 업로드하세요.")
@@ -132,8 +153,25 @@ if page == "📁 PDF 업로드":
         if subjects:
             st.markdown("**기존 과목 목록:**")
             for subject in subjects:
-                info = st.session_state.vs_manager.get_subject_info(subject)
+                info = subject_info(subject)
                 st.write(f"• {subject} ({info.get('문서 수', 0)}개 문서)")
+            with st.expander("🗑️ 파일 삭제"):
+                # 과목을 고른 뒤에만 색인 관리자를 불러옴 (접힌 expander도 매 화면 실행되므로)
+                remove_subject = st.selectbox("과목 선택", subjects, index=None, placeholder="과목을 선택하세요",
+                                              key="remove_subject")
+                files = get_vs_manager().get_subject_files(remove_subject) if remove_subject else []
+                if files:
+                    labels = {f"{', '.join(f['names']) or f['name']} ({f['chunks']}개 청크)": f for f in files}
+                    label = st.selectbox("삭제할 파일", list(labels), key="remove_file")
+                    if st.button("선택한 파일 삭제"):
+                        target = labels[label]
+                        # ✅ 해당 파일의 청크만 색인에서 제거 (과목 전체 재색인 없음)
+                        result = get_vs_manager().remove_file(remove_subject, target["name"], target["hash"])
+                        st.success(f"'{target['name']}' 삭제 완료 (청크 {result['removed']}개 제거, "
+                                   f"다른 파일과 공유한 {result['shared']}개 유지)")
+                        st.rerun()
+                else:
+                    st.caption("등록된 파일 정보가 없습니다.")
     with col2:
         st.subheader("PDF 업로드")
         upload_subjects = subjects.copy()
@@ -143,17 +181,49 @@ if page == "📁 PDF 업로드":
         uploaded_files = st.file_uploader("PDF 파일 선택", type="pdf", accept_multiple_files=True)
         if uploaded_files and target_subject and st.button("업로드 및 처리"):
             upload_success = False
+            pdf = get_pdf_processor()
+            valid_files, ingest_items, chunk_stats = [], [], []
             for uploaded_file in uploaded_files:
-                with st.spinner(f"'{target_subject}' 과목에 {uploaded_file.name} 처리 중..."):
-                    chunks = st.session_state.pdf.process(uploaded_file)
-                    if chunks:
-                        st.session_state.vs_manager.create_or_update_subject(target_subject, chunks, file_name=uploaded_file.name)
-                        st.success(f"'{uploaded_file.name}' 파일이 성공적으로 추가되었습니다!")
+                stats = {}
+                batches = pdf.iter_batches(uploaded_file, stats=stats)
+                if batches is None:
+                    st.error(f"{uploaded_file.name} 처리에 실패했습니다.")
+                    continue
+                valid_files.append(uploaded_file)
+                chunk_stats.append(stats)
+                ingest_items.append((uploaded_file.name, content_hash(uploaded_file.getvalue()), batches))
+            if ingest_items:
+                with st.spinner(f"'{target_subject}' 과목에 {len(ingest_items)}개 파일 처리 중..."):
+                    # ✅ 여러 파일을 큰 배치로 임베딩하고 색인은 한 번만 저장
+                    results = get_vs_manager().ingest_files(target_subject, ingest_items)
+                # ✅ 전처리 리포트는 rerun 뒤에도 보이도록 세션에 보관 (중복 파일처럼 분할하지 않은 파일은 제외)
+                st.session_state.upload_report = [
+                    {"파일": f.name, "청크": c["chunks"], "제거한 글자": c["chars_saved"], "줄어든 청크": c["chunks_saved"],
+                     "반복 줄": len(c["boilerplate_lines"]), "잘린 청크": c["truncated_chunks"], "잘린 토큰": c["truncated_tokens"]}
+                    for f, c in zip(valid_files, chunk_stats) if c.get("chunks")
+                ]
+                st.session_state.upload_warnings = [
+                    f"'{f.name}': 청크 {c['truncated_chunks']}개가 임베딩 모델의 최대 길이({c['max_tokens']} 토큰)를 넘어 "
+                    f"{c['truncated_tokens']} 토큰이 잘렸습니다. (CHUNK_MODE=tokens 권장)"
+                    for f, c in zip(valid_files, chunk_stats) if c.get("truncated_chunks")
+                ]
+                for uploaded_file, stats in zip(valid_files, results):
+                    if stats["duplicate_file"]:
+                        st.info(f"'{uploaded_file.name}'은(는) 이미 등록된 파일과 동일합니다. ({stats['reused']}개 청크 재사용)")
+                        upload_success = True
+                    elif stats["added"] or stats["reused"]:
+                        st.success(f"'{uploaded_file.name}' 파일이 성공적으로 추가되었습니다! "
+                                   f"(새 청크 {stats['added']}개, 재사용 {stats['reused']}개)")
                         upload_success = True
                     else:
                         st.error(f"{uploaded_file.name} 처리에 실패했습니다.")
             if upload_success:
                 st.rerun()
+        for warning in st.session_state.get("upload_warnings", []):
+            st.warning(warning)
+        if st.session_state.get("upload_report"):
+            with st.expander("🧹 최근 업로드 전처리 리포트 (반복 머리말/꼬리말 제거, 토큰 초과)"):
+                st.dataframe(st.session_state.upload_report, hide_index=True)
 
 # ==============================
 # 💬 챗봇
@@ -165,6 +235,7 @@ elif page == "💬 챗봇":
     else:
         subject = st.session_state.current_subject
         st.info(f"현재 과목: **{subject}**")
+        search_all = st.toggle("🔎 모든 과목 자료에서 검색", key="chat_search_all")
         if subject not in st.session_state.chat_history:
             st.session_state.chat_history[subject] = []
         for chat in st.session_state.chat_history[subject]:
@@ -179,13 +250,26 @@ elif page == "💬 챗봇":
                 col1, col2 = st.columns([0.2, 0.8], gap="small")
                 with col1: play_character_video_html()
                 with col2:
-                    with st.spinner("AI 답변 생성 중..."):
-                        answer, sources = st.session_state.bot.ask(subject, question)
-                        st.write(answer)
-                        if sources:
-                            with st.expander("📚 참조 문서"):
-                                for i, source in enumerate(sources):
-                                    st.write(f"{i+1}. {source.metadata.get('source', '알 수 없음')}")
+                    # ✅ 참조 문서를 먼저 보여주고 답변은 토큰이 도착하는 대로 이어서 표시
+                    answer_box = st.empty()
+                    sources_box = st.container()
+                    with st.spinner("관련 자료 검색 중..."):
+                        stream = get_bot().ask_stream(subject, question, search_all=search_all)
+                        _, sources = next(stream)
+                    if sources:
+                        with sources_box.expander("📚 참조 문서"):
+                            for i, source in enumerate(sources):
+                                origin = f"[{source.metadata['subject']}] " if "subject" in source.metadata else ""
+                                page_no = f" (p.{source.metadata['page']})" if "page" in source.metadata else ""
+                                st.write(f"{i+1}. {origin}{source.metadata.get('source', '알 수 없음')}{page_no}")
+                    answer = ""
+                    answer_box.markdown("▌")
+                    # 화면을 떠나 스크립트가 중단돼도 스트림을 닫아 LLM 동시 요청 자리를 바로 반납
+                    with closing(stream):
+                        for _, token in stream:
+                            answer += token
+                            answer_box.markdown(answer + "▌")
+                    answer_box.markdown(answer)
             st.session_state.chat_history[subject].append({"question": question, "answer": answer})
 
 # ==============================
@@ -206,7 +290,21 @@ elif page == "📝 퀴즈 생성":
 
         if st.button("🎲 퀴즈 생성"):
             with st.spinner("퀴즈 생성 중..."):
-                quizzes = st.session_state.qg.generate(subject, num_questions, difficulty, topic, quiz_type="혼합")
+                from quiz_generator import QuizGenerationError
+                from utils.async_runner import run_async
+                # ✅ LLM 호출은 공유 이벤트 루프에서 비동기로 실행 (여러 학생의 요청이 한 루프에서 동시에 진행)
+                try:
+                    batch = run_async(get_quiz_gen().agenerate(subject, num_questions, difficulty, topic,
+                                                               quiz_type="혼합"))
+                    quizzes = batch.quizzes
+                    for warning in batch.warnings:
+                        st.warning(warning)
+                except QuizGenerationError as e:
+                    quizzes = []
+                    st.error(str(e))
+                    if e.raw:
+                        st.write("🔎 **LLM RAW 응답 (디버그용)**:")
+                        st.code(e.raw)
                 if quizzes:
                     # ✅ 퀴즈 히스토리에 기록
                     if subject not in st.session_state.quiz_history:
@@ -389,6 +487,9 @@ elif page == "❌ 오답 노트":
 # 🌐 웹 검색 & 링크 퀴즈
 # ==============================
 elif page == "🌐 웹 검색 & 링크 퀴즈":
+    from utils.web_tools import web_search, fetch_link_content, save_web_results_to_vectorstore
+    from quiz_generator import generate_quiz_from_link
+
     st.header("🌐 웹 검색 & 링크 퀴즈")
 
     tab1, tab2 = st.tabs(["🔍 웹 검색", "🔗 링크 기반 퀴즈"])
@@ -405,7 +506,7 @@ elif page == "🌐 웹 검색 & 링크 퀴즈":
                         st.divider()
                     if st.button("이 검색 결과를 벡터스토어에 저장"):
                         save_web_results_to_vectorstore(
-                            st.session_state.vs_manager,
+                            get_vs_manager(),
                             st.session_state.current_subject or "웹 검색 자료",
                             query
                         )
@@ -454,6 +555,10 @@ elif page == "📊 종합 리포트":
     if not st.session_state.wrong_answers:
         st.info("아직 오답 기록이 없습니다.")
     else:
+        # matplotlib은 리포트 페이지에서만 사용하므로 여기서 import
+        import platform
+        import matplotlib.pyplot as plt
+
         # ✅ 폰트 설정
         if platform.system() == 'Windows':
             plt.rc('font', family='Malgun Gothic')
@@ -514,8 +619,37 @@ elif page == "📊 종합 리포트":
 st.sidebar.markdown("---")
 st.sidebar.markdown("### 📊 학습 현황")
 if st.session_state.current_subject:
-    info = st.session_state.vs_manager.get_subject_info(st.session_state.current_subject)
+    info = subject_info(st.session_state.current_subject)
     st.sidebar.write(f"현재 과목: {st.session_state.current_subject}")
     st.sidebar.write(f"문서 수: {info.get('문서 수', 0)}")
 wrong_count = len(st.session_state.wrong_answers)
-st.sidebar.write(f"오답 문제: {wrong_count}개")
\ No newline at end of file
+st.sidebar.write(f"오답 문제: {wrong_count}개")
+# 사이드바 통계는 매 화면 실행되므로 가벼운 모듈만 import (색인 관리자는 이미 불러온 경우에만 조회)
+with st.sidebar.expander("🧠 색인 캐시 상태"):
+    if "vector_store" in sys.modules:
+        cache_stats = get_vs_manager().get_cache_stats()
+        st.write(f"상주 과목: {', '.join(cache_stats['resident']) or '없음'}")
+        st.write(f"메모리: {cache_stats['resident_mb']} / {cache_stats['max_mb']} MB")
+        st.write(f"로드 {cache_stats['loads']}회 ({cache_stats['load_seconds']:.2f}초), 축출 {cache_stats['evictions']}회")
+    else:
+        st.write("아직 불러온 과목 색인이 없습니다.")
+with st.sidebar.expander("📦 프롬프트 context 압축"):
+    from context_packer import get_context_packer
+    packing = get_context_packer(st.session_state.get("vs_manager")).stats()
+    st.write(f"요청 {packing['requests']}회, 절약한 토큰 {packing['tokens_saved']:,}개 ({packing['saved_ratio']:.0%})")
+    st.write(f"중복 청크 제거 {packing['duplicates_removed']}개, 잘라낸 겹침 {packing['chars_trimmed']:,}자")
+with st.sidebar.expander("🔌 LLM 게이트웨이"):
+    from llm_gateway import get_gateway
+    gateway_stats = get_gateway().stats()
+    if gateway_stats:
+        st.dataframe(gateway_stats, hide_index=True)
+    else:
+        st.write("아직 LLM 요청이 없습니다.")
+if Config.ANSWER_CACHE_ENABLED:
+    with st.sidebar.expander("⚡ 답변 캐시 상태"):
+        from answer_cache import ALL_SUBJECTS_KEY, get_answer_cache
+        answer_stats = get_answer_cache().stats()
+        st.write(f"적중 {answer_stats['hits']}회 / 미스 {answer_stats['misses']}회 (적중률 {answer_stats['hit_rate']:.0%})")
+        st.write(f"자료 변경으로 비운 횟수: {answer_stats['invalidations']}회")
+        for key, count in answer_stats["entries"].items():
+            st.write(f"- {'전체 과목' if key == ALL_SUBJECTS_KEY else key}: {count}개")
@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+import time
+
+# ===========================
+# 청크 분할 방식 비교 (글자 수 기준 vs 임베딩 토큰 기준)
+#   python benchmarks/chunk_bench.py 강의1.pdf 강의2.pdf
+#
+# 방식별 청크 수, 임베딩할 총 토큰 수, 모델 최대 길이를 넘어 잘리는 청크/토큰 수, 겹침(overlap) 토큰 수,
+# 반복 머리말/꼬리말 제거로 줄어든 글자/청크 수, 분할 시간
+# (임베딩은 하지 않고 토크나이저만 사용)
+# ===========================
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd  # noqa: E402
+from pdf_processor import PDFProcessor  # noqa: E402
+
+
+class _LocalFile:
+    """업로드 파일(UploadedFile)과 같은 인터페이스로 로컬 PDF를 감쌈"""
+
+    def __init__(self, path: str):
+        self.name = os.path.basename(path)
+        with open(path, "rb") as f:
+            self._data = f.read()
+        self.size = len(self._data)
+
+    def getvalue(self) -> bytes:
+        return self._data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="청크 분할 방식별 토큰/잘림 통계 비교")
+    parser.add_argument("pdfs", nargs="+", help="비교할 PDF 파일")
+    args = parser.parse_args()
+
+    rows = []
+    for path in args.pdfs:
+        file = _LocalFile(path)
+        for mode in ("chars", "tokens"):
+            pdf = PDFProcessor()
+            pdf.mode = mode
+            stats = {}
+            start = time.perf_counter()
+            for _ in pdf.iter_chunks(file, stats):
+                pass
+            stats["boilerplate_lines"] = len(stats["boilerplate_lines"])
+            rows.append({"file": file.name, **stats, "seconds": round(time.perf_counter() - start, 3)})
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# ===========================
+# 앱 시작 비용 측정
+#   python benchmarks/startup_bench.py             # 모듈별 import 시간 + 첫 화면 렌더링 시간
+#   python benchmarks/startup_bench.py --runs 5    # 5회 측정 중앙값
+#
+# - 모듈별 import: 모듈마다 새 파이썬 프로세스에서 import (앞선 import 캐시 영향 없음)
+# - 첫 화면: streamlit.testing AppTest로 app.py 첫 실행(첫 페이지 렌더)까지 걸린 시간과,
+#   그때 이미 로드된 무거운 모듈 목록 (지연 import가 깨지면 여기 나타남)
+# ===========================
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "config", "subject_catalog", "embeddings", "subject_index", "vector_store", "pdf_processor",
+    "context_packer", "llm_gateway", "chatbot", "quiz_generator", "utils.web_tools",
+]
+# 첫 화면에서 로드되면 안 되는 무거운 의존성
+HEAVY_MODULES = [
+    "langchain_core", "langchain.chains", "langchain_anthropic", "langchain_openai",
+    "langchain_community.chat_models", "langchain_community.vectorstores", "langchain_huggingface",
+    "faiss", "sentence_transformers", "torch", "onnxruntime", "matplotlib.pyplot",
+    "PyPDF2", "ddgs", "bs4", "openai", "anthropic",
+]
+
+IMPORT_SNIPPET = """
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+RENDER_SNIPPET = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+app = AppTest.from_file({app!r}, default_timeout=600).run()
+elapsed = time.perf_counter() - start
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{"seconds": elapsed, "errors": [str(e.value) for e in app.exception], "heavy": heavy}}))
+"""
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    # Config.validate()를 통과하도록 키가 없으면 더미 값 사용 (LLM은 호출하지 않음)
+    env.setdefault("OPENAI_API_KEY", "sk-startup-bench")
+    env.setdefault("ANTHROPIC_API_KEY", "sk-startup-bench")
+    return env
+
+
+def _run(code: str) -> str:
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=_env(), capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "실패")
+    return result.stdout.strip().splitlines()[-1]
+
+
+def import_times(runs: int) -> list:
+    rows = []
+    for module in MODULES:
+        try:
+            samples = [float(_run(IMPORT_SNIPPET.format(root=ROOT, module=module))) for _ in range(runs)]
+            rows.append((module, f"{statistics.median(samples):.3f}s"))
+        except RuntimeError as e:
+            rows.append((module, f"실패: {e}"))
+    return rows
+
+
+def first_render(runs: int) -> dict:
+    results = [json.loads(_run(RENDER_SNIPPET.format(root=ROOT, app=os.path.join(ROOT, "app.py"),
+                                                     heavy=HEAVY_MODULES)))
+               for _ in range(runs)]
+    return {**results[-1], "seconds": statistics.median(r["seconds"] for r in results)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="앱 시작 시간 측정 (모듈 import 비용, 첫 화면 렌더링)")
+    parser.add_argument("--runs", type=int, default=3, help="측정 횟수 (중앙값 사용)")
+    args = parser.parse_args()
+
+    print("📦 모듈별 import 시간 (새 프로세스)")
+    for module, cost in import_times(args.runs):
+        print(f"  {module:<20} {cost}")
+
+    print("\n🖥️ 첫 화면 렌더링 (AppTest, 새 프로세스)")
+    try:
+        render = first_render(args.runs)
+    except RuntimeError as e:
+        print(f"  실패: {e}")
+        return
+    print(f"  time-to-first-render  {render['seconds']:.3f}s")
+    print(f"  앱 예외              {render['errors'] or '없음'}")
+    print(f"  첫 화면에 로드된 무거운 모듈  {render['heavy'] or '없음'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,25 @@
-import os
-from openai import OpenAI
-import anthropic
 import pandas as pd
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer, util
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+from sentence_transformers import util
+from embeddings import build_embeddings
+from subject_index import SubjectIndex
+from llm_gateway import get_gateway
 
 # ===========================
 # 0️⃣ .env 로드
 # ===========================
 load_dotenv()
 
-# 🔑 API 키 불러오기
-openai_api_key = os.getenv("OPENAI_API_KEY")
-anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
-
-# OpenAI / Anthropic 클라이언트 초기화
-client = OpenAI(api_key=openai_api_key)
-anthropic_client = anthropic.Anthropic(api_key=anthropic_api_key)
+# 🔑 API 키는 Config가 읽고, 호출은 공용 LLM 게이트웨이로 (재시도·동시 요청 제한·토큰/지연 기록)
+# 평가는 모델별 비교이므로 다른 제공사로의 대체는 끔
+gateway = get_gateway()
 
 # ===========================
 # 1️⃣ 임베딩 및 BERT 모델 로드
 # ===========================
-embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-bert_model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+# ✅ 디스크 캐시를 거치므로 재실행 시 같은 텍스트는 다시 인코딩하지 않음
+embedding_model = build_embeddings("sentence-transformers/all-MiniLM-L6-v2")
+bert_model = embedding_model
 
 # ===========================
 # 2️⃣ 과목명 & 질문 설정
@@ -44,7 +39,7 @@ models = {
 # 3️⃣ FAISS 로드 & 문서 검색
 # ===========================
 faiss_path = f"./faiss_subjects/{subject}"
-vs = FAISS.load_local(faiss_path, embedding_model, allow_dangerous_deserialization=True)
+vs = SubjectIndex.load(faiss_path, embedding_model)  # 세그먼트 색인 (구 형식은 자동 변환)
 
 docs = vs.similarity_search(question, k=3)
 rag_context = "\n\n".join([doc.page_content for doc in docs])
@@ -59,52 +54,30 @@ rag_responses = {}
 for model_name, provider in models.items():
     # ---- Non-RAG 응답 ----
     print(f"[요청 중] {model_name} ({provider}) - Non-RAG")
-    if provider == "openai":
-        completion = client.chat.completions.create(
-            model=model_name,
-            messages=[{"role": "user", "content": question}],
-            timeout=60  # 타임아웃 설정
-        )
-        non_rag_responses[model_name] = completion.choices[0].message.content
-    else:
-        completion = anthropic_client.messages.create(
-            model=model_name,
-            max_tokens=500,
-            messages=[{"role": "user", "content": question}],
-            timeout=60
-        )
-        non_rag_responses[model_name] = completion.content[0].text
+    non_rag_responses[model_name] = gateway.complete(
+        question, provider=provider, model=model_name,
+        max_tokens=500 if provider == "anthropic" else None, fallback=False
+    ).content
     print(f"[완료] {model_name} - Non-RAG")
 
     # ---- RAG 응답 ----
     rag_prompt = f"다음 문서를 참고하여 질문에 답변하세요.\n\n문서:\n{rag_context}\n\n질문: {question}"
     print(f"[요청 중] {model_name} ({provider}) - RAG")
-    if provider == "openai":
-        completion = client.chat.completions.create(
-            model=model_name,
-            messages=[{"role": "user", "content": rag_prompt}],
-            timeout=60
-        )
-        rag_responses[model_name] = completion.choices[0].message.content
-    else:
-        completion = anthropic_client.messages.create(
-            model=model_name,
-            max_tokens=500,
-            messages=[{"role": "user", "content": rag_prompt}],
-            timeout=60
-        )
-        rag_responses[model_name] = completion.content[0].text
+    rag_responses[model_name] = gateway.complete(
+        rag_prompt, provider=provider, model=model_name,
+        max_tokens=500 if provider == "anthropic" else None, fallback=False
+    ).content
     print(f"[완료] {model_name} - RAG")
 
 # ===========================
 # 5️⃣ BERTScore 계산 및 저장
 # ===========================
-emb_q = bert_model.encode(question, convert_to_tensor=True)
+emb_q = bert_model.embed_query(question)
 results = []
 
 for model_name in models.keys():
-    score_non_rag = util.cos_sim(emb_q, bert_model.encode(non_rag_responses[model_name], convert_to_tensor=True)).item()
-    score_rag = util.cos_sim(emb_q, bert_model.encode(rag_responses[model_name], convert_to_tensor=True)).item()
+    score_non_rag = util.cos_sim(emb_q, bert_model.embed_query(non_rag_responses[model_name])).item()
+    score_rag = util.cos_sim(emb_q, bert_model.embed_query(rag_responses[model_name])).item()
 
     results.append({
         "Model": model_name,
@@ -125,3 +98,7 @@ for model_name in models.keys():
 df_scores = pd.DataFrame(results)
 df_scores.to_csv(f"bert_scores_{subject}.csv", index=False, encoding="utf-8-sig")
 print(f"\n✅ BERTScore 및 응답이 'bert_scores_{subject}.csv'로 저장되었습니다.")
+
+if hasattr(bert_model, "stats"):
+    print(f"임베딩 캐시: {bert_model.stats()}")
+print(f"LLM 게이트웨이: {gateway.stats()}")
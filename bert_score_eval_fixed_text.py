@@ -1,10 +1,12 @@
 import pandas as pd
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import util
+from embeddings import build_embeddings
 
 # ===========================
 # 1️⃣ 임베딩 모델 로드
 # ===========================
-bert_model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+# ✅ 디스크 캐시를 거치므로 재실행 시 같은 텍스트는 다시 인코딩하지 않음
+bert_model = build_embeddings("sentence-transformers/all-MiniLM-L6-v2")
 
 # ===========================
 # 2️⃣ 기준 텍스트 설정 (reference_text)
@@ -31,7 +33,7 @@ df = pd.read_csv("total_responses.csv")
 # ===========================
 # 4️⃣ reference_text 임베딩
 # ===========================
-emb_ref = bert_model.encode(reference_text, convert_to_tensor=True)
+emb_ref = bert_model.embed_query(reference_text)
 
 # ===========================
 # 5️⃣ 각 모델 응답과 BERTScore 계산
@@ -41,7 +43,7 @@ for idx, row in df.iterrows():
     model_name = row["Model"]
     response = row["Response"]
 
-    emb_res = bert_model.encode(response, convert_to_tensor=True)
+    emb_res = bert_model.embed_query(response)
     score = util.cos_sim(emb_ref, emb_res).item()
 
     results.append({
@@ -58,3 +60,6 @@ df_scores.to_csv("bert_scores_vs_reference.csv", index=False, encoding="utf-8-si
 
 print("\n✅ BERTScore 계산 완료: 'bert_scores_vs_reference.csv'로 저장됨")
 print(df_scores[["Model", "BERTScore (cosine similarity)"]])
+
+if hasattr(bert_model, "stats"):
+    print(f"임베딩 캐시: {bert_model.stats()}")
@@ -1,24 +1,14 @@
-#from langchain_openai import ChatOpenAI
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
+import asyncio
+from contextlib import closing
+from typing import Iterator, Tuple
 from config import Config
-from vector_store import MultiSubjectVectorStoreManager
-from utils.web_tools import web_search, fetch_link_content
-from langchain_anthropic import ChatAnthropic
-
-# 모델 선택
-if Config.MODEL_TYPE == "openai":
-    from langchain.chat_models import ChatOpenAI
-    llm = ChatOpenAI(model_name="gpt-4o", temperature=0, openai_api_key=Config.OPENAI_API_KEY)
-elif Config.MODEL_TYPE == "claude":
-    from langchain_anthropic import ChatAnthropic
-    llm = ChatAnthropic(
-    model=Config.LLM_MODEL(),  # ✅ Config에서 선택된 모델 사용
-    temperature=0,
-    anthropic_api_key=Config.ANTHROPIC_API_KEY
-)
-else:
-    raise ValueError("지원하지 않는 모델 타입입니다. (openai 또는 claude)")
+from vector_store import MultiSubjectVectorStoreManager, SearchHits
+from answer_cache import ALL_SUBJECTS_KEY, get_answer_cache
+from context_packer import PackedContext, get_context_packer
+from llm_gateway import get_gateway
+
+# LLM 호출은 공용 게이트웨이(llm_gateway)로 보냄: 연결 풀 공유, 동시 요청 제한, 재시도, 제공사 대체
+OPENAI_CHAT_MODEL = "gpt-4o"
 
 
 PROMPT_TEMPLATE = """당신은 대학 강의자료 기반 AI 튜터입니다.
@@ -32,37 +22,139 @@ PROMPT_TEMPLATE = """당신은 대학 강의자료 기반 AI 튜터입니다.
 
 답변:"""
 
+# 프롬프트에 넣을 최대 청크 수 (후보는 Config.CONTEXT_FETCH_K개를 검색해 MMR로 고름)
+CONTEXT_K = 4
+
+
+def chat_model_name() -> str:
+    """챗봇 답변에 쓰는 모델명 (게이트웨이 요청과 context 토큰 예산 선택용)"""
+    return OPENAI_CHAT_MODEL if Config.MODEL_TYPE == "openai" else Config.LLM_MODEL()
+
+
 class MultiSubjectChatbot:
     def __init__(self, vs_manager: MultiSubjectVectorStoreManager):
         self.vs_manager = vs_manager
-        self.llm = llm  # 위에서 결정된 llm 객체 사용
-        self.qa_chains = {}
+        # 세션이 달라도 같은 과목의 비슷한 질문은 답변을 공유
+        self.answer_cache = get_answer_cache()
+        self.packer = get_context_packer(vs_manager)
 
-    def create_qa_chain(self, subject_name: str):
-        retriever = self.vs_manager.get_retriever(subject_name)
-        if not retriever:
+    @property
+    def llm(self):
+        return get_gateway()
+
+    def get_retriever(self, subject_name: str, search_all: bool = False):
+        # 통합 검색은 모든 과목을 병렬로 검색하는 리트리버 사용
+        if search_all:
+            return self.vs_manager.get_federated_retriever(k=Config.CONTEXT_FETCH_K)
+        return self.vs_manager.get_retriever(subject_name, k=Config.CONTEXT_FETCH_K)
+
+    def _retrieve(self, subject_name: str, question: str, search_all: bool = False) -> SearchHits:
+        """context 후보 Config.CONTEXT_FETCH_K개와 색인에 저장된 청크 벡터 (MMR이 다시 임베딩하지 않도록)"""
+        if search_all:
+            return self.vs_manager.search_all_hits(question, k=Config.CONTEXT_FETCH_K)
+        return self.vs_manager.search_hits(subject_name, question, k=Config.CONTEXT_FETCH_K)
+
+    def _pack(self, question: str, hits: SearchHits) -> PackedContext:
+        """후보 청크에서 중복 구간을 빼고 MMR로 골라 모델 토큰 예산 안의 context로 조립"""
+        return self.packer.pack(hits.docs, query=question, k=CONTEXT_K, model_name=chat_model_name(),
+                                vectors=hits.vectors, query_vector=hits.query_vector)
+
+    def _cache_entry(self, subject_name: str, question: str, search_all: bool):
+        """답변 캐시 조회/저장에 쓰는 (키, 색인 revision, 질문 벡터). 캐시를 끄면 None
+
+        질문 벡터는 임베딩 캐시에 남으므로 이어지는 검색에서 다시 계산하지 않음.
+        """
+        if not Config.ANSWER_CACHE_ENABLED:
             return None
-        prompt = PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["context", "question"])
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=self.llm,
-            chain_type="stuff",
-            retriever=retriever,
-            chain_type_kwargs={"prompt": prompt},
-            return_source_documents=True,
-        )
-        self.qa_chains[subject_name] = qa_chain
-        return qa_chain
-
-    def ask(self, subject_name: str, question: str):
-        if subject_name not in self.qa_chains:
-            qa_chain = self.create_qa_chain(subject_name)
-            if not qa_chain:
-                return f"{subject_name} 과목의 자료가 없습니다. PDF를 먼저 업로드해주세요.", []
-        qa_chain = self.qa_chains[subject_name]
+        if search_all:
+            key = ALL_SUBJECTS_KEY
+            revision = tuple((s, self.vs_manager.get_index_revision(s)) for s in sorted(self.vs_manager.get_subjects()))
+        else:
+            key, revision = subject_name, self.vs_manager.get_index_revision(subject_name)
+        return key, revision, self.vs_manager.embed.embed_query(question)
+
+    def ask(self, subject_name: str, question: str, search_all: bool = False):
+        retriever = self.get_retriever(subject_name, search_all)
+        if not retriever:
+            return f"{subject_name} 과목의 자료가 없습니다. PDF를 먼저 업로드해주세요.", []
         try:
-            result = qa_chain.invoke({"query": question})
-            return result["result"], result["source_documents"]
+            cache_entry = self._cache_entry(subject_name, question, search_all)
+            cached = cache_entry and self.answer_cache.lookup(*cache_entry)
+            if cached:
+                return cached
+            packed = self._pack(question, self._retrieve(subject_name, question, search_all))
+            answer = self.llm.complete(PROMPT_TEMPLATE.format(context=packed.text, question=question),
+                                       model=chat_model_name(), temperature=0).content
+            if cache_entry:
+                self.answer_cache.store(*cache_entry, question, answer, packed.docs)
+            return answer, packed.docs
         except Exception as e:
             return f"오류가 발생했습니다: {str(e)}", []
 
+    async def aask(self, subject_name: str, question: str, search_all: bool = False):
+        """ask의 비동기 버전 (스트리밍 없이 답변 전체를 받는 호출자용, utils.async_runner의 공유 루프에서 실행)
+
+        앱의 채팅 화면은 ask_stream을 씀. 검색(스레드)과 이 루프의 LLM 비동기 클라이언트 준비를 동시에 진행하고,
+        답변은 게이트웨이의 비동기 호출(acomplete)로 받음.
+        """
+        retriever = self.get_retriever(subject_name, search_all)
+        if not retriever:
+            return f"{subject_name} 과목의 자료가 없습니다. PDF를 먼저 업로드해주세요.", []
+        try:
+            # 질문 임베딩/검색은 CPU 작업이라 루프를 막지 않도록 실행기(스레드 풀)에서
+            cache_entry = await asyncio.to_thread(self._cache_entry, subject_name, question, search_all)
+            cached = cache_entry and self.answer_cache.lookup(*cache_entry)
+            if cached:
+                return cached
+            hits, _ = await asyncio.gather(asyncio.to_thread(self._retrieve, subject_name, question, search_all),
+                                           self.llm.prepare())
+            packed = await asyncio.to_thread(self._pack, question, hits)
+            response = await self.llm.acomplete(PROMPT_TEMPLATE.format(context=packed.text, question=question),
+                                                model=chat_model_name(), temperature=0)
+            answer = response.content
+            if cache_entry:
+                self.answer_cache.store(*cache_entry, question, answer, packed.docs)
+            return answer, packed.docs
+        except Exception as e:
+            return f"오류가 발생했습니다: {str(e)}", []
+
+    def ask_stream(self, subject_name: str, question: str, search_all: bool = False) -> Iterator[Tuple[str, object]]:
+        """ask의 스트리밍 버전. 먼저 ("sources", 문서 목록)을 한 번 내고, 이후 ("token", 텍스트 조각)을 도착하는 대로 냄
+
+        검색·context 조립·프롬프트는 ask와 같고, LLM 응답만 stream으로 받음.
+        """
+        retriever = self.get_retriever(subject_name, search_all)
+        if not retriever:
+            yield "sources", []
+            yield "token", f"{subject_name} 과목의 자료가 없습니다. PDF를 먼저 업로드해주세요."
+            return
+        try:
+            cache_entry = self._cache_entry(subject_name, question, search_all)
+            cached = cache_entry and self.answer_cache.lookup(*cache_entry)
+            packed = None if cached else self._pack(question, self._retrieve(subject_name, question, search_all))
+        except Exception as e:
+            yield "sources", []
+            yield "token", f"오류가 발생했습니다: {str(e)}"
+            return
+        if cached:
+            yield "sources", cached[1]
+            yield "token", cached[0]
+            return
+        yield "sources", packed.docs
+        parts = []
+        try:
+            # 이 생성기가 중간에 닫혀도 게이트웨이 스트림(동시 요청 자리)을 바로 닫음
+            with closing(self.llm.stream(PROMPT_TEMPLATE.format(context=packed.text, question=question),
+                                         model=chat_model_name(), temperature=0)) as tokens:
+                for text in tokens:
+                    parts.append(text)
+                    yield "token", text
+        except Exception as e:
+            yield "token", f"\n\n오류가 발생했습니다: {str(e)}"
+            return
+        # 끝까지 받은 답변만 캐시 (중간에 화면을 떠나 스트림이 닫히면 저장하지 않음)
+        if cache_entry:
+            self.answer_cache.store(*cache_entry, question, "".join(parts), packed.docs)
+
+
 # 웹 검색과 링크 크롤링은 utils/web_tools에서 불러옴
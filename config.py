@@ -18,6 +18,23 @@ class Config:
     def LLM_MODEL(cls):
         return cls.CLAUDE_MODEL if cls.MODEL_TYPE == "claude" else cls.OPENAI_MODEL
 
+    @classmethod
+    def default_model(cls, provider: str) -> str:
+        return cls.CLAUDE_MODEL if provider == "claude" else cls.OPENAI_MODEL
+
+    # LLM 게이트웨이: 제공사별 동시 요청 수 제한, 429/529/5xx 재시도 (지수 백오프 + jitter),
+    # 재시도 후에도 실패하면 다른 제공사(Claude ↔ OpenAI, 키가 설정된 경우)로 대체
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+    LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+    LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+    LLM_MAX_CONCURRENCY = {
+        "openai": int(os.getenv("LLM_MAX_CONCURRENCY_OPENAI", "8")),
+        "claude": int(os.getenv("LLM_MAX_CONCURRENCY_CLAUDE", "4")),
+    }
+    LLM_FALLBACK = os.getenv("LLM_FALLBACK", "true").lower() == "true"
+    LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "2048"))  # Claude 응답 최대 토큰 (API 필수값)
+
     @classmethod
     def validate(cls):
         if cls.MODEL_TYPE == "openai" and not cls.OPENAI_API_KEY.startswith("sk"):
@@ -30,9 +47,101 @@ class Config:
     MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "10"))
     CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
     CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+    # 청크 분할 기준: tokens (임베딩 모델 토크나이저로 길이를 재고 문장 경계 우선) 또는 chars (위 글자 수 기준)
+    CHUNK_MODE = os.getenv("CHUNK_MODE", "tokens").lower()
+    # tokens 방식의 청크 최대 토큰 수 (0이면 임베딩 모델의 최대 입력 길이), 앞 청크에서 이어 붙일 문장의 토큰 수 한도
+    CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "0"))
+    CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "0"))
+    # 페이지마다 반복되는 머리말/꼬리말(과목명, 학교명, 쪽 번호) 제거: 앞쪽 SAMPLE_PAGES 페이지의
+    # 위/아래 EDGE_LINES줄 중 MIN_RATIO 이상의 페이지에 나오는 줄을 반복 줄로 봄
+    BOILERPLATE_STRIP = os.getenv("BOILERPLATE_STRIP", "true").lower() == "true"
+    BOILERPLATE_SAMPLE_PAGES = int(os.getenv("BOILERPLATE_SAMPLE_PAGES", "30"))
+    BOILERPLATE_EDGE_LINES = int(os.getenv("BOILERPLATE_EDGE_LINES", "3"))
+    BOILERPLATE_MIN_RATIO = float(os.getenv("BOILERPLATE_MIN_RATIO", "0.5"))
+    # 페이지 텍스트 병렬 추출 (워커 1이면 순차 처리). 워커마다 PDF를 다시 파싱하는 고정 비용(풀을 띄운 뒤에도
+    # 파일당 0.1초 안팎)이 있어 페이지 수나 파일 크기 중 하나가 기준을 넘는 큰 PDF만 병렬로 추출
+    PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+    PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "300"))
+    PDF_PARALLEL_MIN_MB = float(os.getenv("PDF_PARALLEL_MIN_MB", "20"))
+    # 스트리밍 업로드 시 한 번에 임베딩/색인할 청크 수
+    EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+    # 여러 파일 일괄 업로드 시 파일 경계를 넘어 모으는 임베딩 배치 크기
+    BULK_EMBED_BATCH_SIZE = int(os.getenv("BULK_EMBED_BATCH_SIZE", "256"))
+    # 적재 중인 tail이 이 행 수에 닿으면 세그먼트로 기록하고 비움 (큰 업로드 전체를 메모리에 두지 않도록)
+    INGEST_FLUSH_ROWS = int(os.getenv("INGEST_FLUSH_ROWS", "4096"))
+
+    # 임베딩 모델 및 디스크 캐시
+    EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+    EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "true").lower() == "true"
+    EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./embedding_cache/embeddings.sqlite")
+    EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+    # 캐시 적중 시각(LRU 정리 기준)은 메모리에 모았다가 이만큼 쌓이거나 정리하기 직전에 한 번에 기록
+    EMBED_CACHE_TOUCH_BATCH = int(os.getenv("EMBED_CACHE_TOUCH_BATCH", "1000"))
+    # 임베딩 실행 방식: torch (sentence-transformers) 또는 onnx (ONNX Runtime, CPU)
+    EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch").lower()
+    EMBED_ONNX_QUANTIZE = os.getenv("EMBED_ONNX_QUANTIZE", "true").lower() == "true"  # 동적 int8 양자화
+    EMBED_ONNX_DIR = os.getenv("EMBED_ONNX_DIR", "./embedding_cache/onnx")
+    # 모델 한 번의 forward에 넣는 문장 수, CPU 스레드 수 (0이면 라이브러리 기본값)
+    EMBED_MODEL_BATCH_SIZE = int(os.getenv("EMBED_MODEL_BATCH_SIZE", "32"))
+    EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))
+    # 대량 업로드 시 임베딩을 나눠 맡을 워커 프로세스 수 (1이면 현재 프로세스에서만 계산)
+    EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+    # 이 개수 이상의 문서 배치만 워커로 보냄 (작은 배치는 프로세스 간 전송 비용이 더 큼)
+    EMBED_POOL_MIN_TEXTS = int(os.getenv("EMBED_POOL_MIN_TEXTS", "128"))
+    # ONNX 임베딩이 PyTorch 결과와 이 코사인 유사도 이상 같아야 사용 (미달 시 torch로 대체)
+    EMBED_PARITY_MIN_COSINE = float(os.getenv("EMBED_PARITY_MIN_COSINE", "0.99"))
 
     # FAISS 저장 경로
     FAISS_BASE_PATH = os.getenv("FAISS_BASE_PATH", "./faiss_subjects")
+    # 메모리에 올려둘 과목 색인의 총량 한도 (초과 시 오래 안 쓴 과목부터 내림)
+    SUBJECT_CACHE_MAX_MB = int(os.getenv("SUBJECT_CACHE_MAX_MB", "512"))
+    # 여러 과목 통합 검색 시 과목별 검색을 병렬로 돌릴 스레드 수
+    SEARCH_FANOUT_WORKERS = int(os.getenv("SEARCH_FANOUT_WORKERS", "8"))
+    # 세그먼트 병합 정책: 남은 행 수가 COMPACT_TIER_RATIO배 범위 안인 세그먼트를 같은 단계로 보고,
+    # 한 단계에 COMPACT_MERGE_FACTOR개가 모이면 그것들만 병합 (COMPACT_MIN_SEGMENT_ROWS 미만은 모두 가장 아래 단계)
+    COMPACT_MERGE_FACTOR = int(os.getenv("COMPACT_MERGE_FACTOR", "4"))
+    COMPACT_TIER_RATIO = int(os.getenv("COMPACT_TIER_RATIO", "4"))
+    COMPACT_MIN_SEGMENT_ROWS = int(os.getenv("COMPACT_MIN_SEGMENT_ROWS", "1000"))
+    # 과목당 세그먼트가 이 개수를 넘으면 가장 작은 세그먼트부터 병합해 개수를 맞춤
+    MAX_SEGMENTS = int(os.getenv("MAX_SEGMENTS", "16"))
+    # 세그먼트에서 파일 삭제로 지워진(tombstone) 청크 비율이 이 값을 넘으면 다시 써서 실제로 제거
+    MAX_DELETED_RATIO = float(os.getenv("MAX_DELETED_RATIO", "0.2"))
+    # 세그먼트가 이 크기를 넘으면 백그라운드에서 ANN 색인(hnsw 또는 ivf)을 학습하고 recall 검사 통과 시 전환
+    ANN_THRESHOLD = int(os.getenv("ANN_THRESHOLD", "20000"))
+    ANN_INDEX_TYPE = os.getenv("ANN_INDEX_TYPE", "hnsw")
+    ANN_MIN_RECALL = float(os.getenv("ANN_MIN_RECALL", "0.95"))
+    ANN_RECALL_SAMPLES = int(os.getenv("ANN_RECALL_SAMPLES", "200"))
+    ANN_HNSW_EF_SEARCH = int(os.getenv("ANN_HNSW_EF_SEARCH", "64"))
+    ANN_IVF_NPROBE = int(os.getenv("ANN_IVF_NPROBE", "16"))
+    # 벡터 압축 저장 (none/fp16/int8/pq). 압축 시 후보를 RERANK_FACTOR배 뽑아 원본 벡터로 재정렬
+    DEFAULT_COMPRESSION = os.getenv("DEFAULT_COMPRESSION", "none")
+    RERANK_FACTOR = int(os.getenv("RERANK_FACTOR", "4"))
+
+    # 챗봇 답변 캐시: 같은 과목에서 질문 임베딩의 코사인 유사도가 기준 이상이면 이전 답변 재사용
+    # (TTL 초가 지나거나 과목 색인이 바뀌면 무효)
+    ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+    ANSWER_CACHE_MIN_SIMILARITY = float(os.getenv("ANSWER_CACHE_MIN_SIMILARITY", "0.95"))
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+
+    # RAG 프롬프트 context 조립: 후보 FETCH_K개를 검색해 MMR로 다양하게 고르고, 겹치는 구간을 잘라낸 뒤
+    # 모델별 토큰 예산 안에서 채움 (CONTEXT_TOKEN_BUDGET을 지정하면 모든 모델에 적용)
+    CONTEXT_FETCH_K = int(os.getenv("CONTEXT_FETCH_K", "12"))
+    CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))  # 1이면 관련도만, 0이면 다양성만
+    CONTEXT_MIN_OVERLAP_CHARS = int(os.getenv("CONTEXT_MIN_OVERLAP_CHARS", "30"))
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))
+    CONTEXT_TOKEN_BUDGETS = {
+        "gpt-3.5-turbo": 2500,
+        "gpt-4o": 4000,
+        "claude-3-7-sonnet-20250219": 4000,
+    }
+    CONTEXT_DEFAULT_TOKEN_BUDGET = 3000
+
+    @classmethod
+    def context_budget(cls, model_name: str = None) -> int:
+        if cls.CONTEXT_TOKEN_BUDGET:
+            return cls.CONTEXT_TOKEN_BUDGET
+        return cls.CONTEXT_TOKEN_BUDGETS.get(model_name or cls.LLM_MODEL(), cls.CONTEXT_DEFAULT_TOKEN_BUDGET)
 
     # UI 설정
     APP_TITLE = "대학강의 PDF 챗봇 & 퀴즈 생성기"
@@ -0,0 +1,171 @@
+import threading
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional
+import numpy as np
+from config import Config
+
+if TYPE_CHECKING:  # 앱 사이드바가 통계만 볼 때 LangChain을 불러오지 않도록
+    from langchain.docstore.document import Document
+
+
+@lru_cache(maxsize=8)
+def _encoder(model_name: str):
+    """tiktoken 인코더 (없거나 모델을 모르면 None → 근사치 사용)"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except Exception:
+        try:
+            return tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            return None
+
+
+def count_tokens(text: str, model_name: str = None) -> int:
+    """LLM 프롬프트 토큰 수. tiktoken이 없으면 UTF-8 바이트/3으로 넉넉하게 추정 (한글 1글자 ≈ 1토큰)"""
+    encoder = _encoder(model_name or Config.LLM_MODEL())
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return max(1, len(text.encode("utf-8")) // 3) if text else 0
+
+
+def _overlap(a: str, b: str, min_chars: int) -> int:
+    """a의 끝과 b의 앞이 겹치는 글자 수 (min_chars 미만이면 0). 청크 분할 overlap 구간을 찾는 데 사용"""
+    probe = b[:min_chars]
+    if len(probe) < min_chars:
+        return 0
+    start = a.find(probe, max(0, len(a) - len(b)))
+    while start != -1:
+        if b.startswith(a[start:]):
+            return len(a) - start
+        start = a.find(probe, start + 1)
+    return 0
+
+
+def mmr_order(query_vector, doc_vectors, k: int, lambda_mult: float = None) -> List[int]:
+    """Maximal Marginal Relevance: 질문과의 유사도와 이미 고른 문서와의 중복을 함께 고려한 선택 순서"""
+    lambda_mult = Config.CONTEXT_MMR_LAMBDA if lambda_mult is None else lambda_mult
+    docs = np.asarray(doc_vectors, dtype=np.float32)
+    docs = docs / np.clip(np.linalg.norm(docs, axis=1, keepdims=True), 1e-12, None)
+    query = np.asarray(query_vector, dtype=np.float32)
+    relevance = docs @ (query / max(float(np.linalg.norm(query)), 1e-12))
+    selected: List[int] = []
+    redundancy = np.full(len(docs), -np.inf)
+    while len(selected) < min(k, len(docs)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * np.where(np.isinf(redundancy), 0, redundancy)
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        redundancy = np.maximum(redundancy, docs @ docs[best])
+    return selected
+
+
+class PackedContext(NamedTuple):
+    text: str
+    docs: List["Document"]  # 프롬프트에 들어간 원본 청크 (참조 문서 표시용)
+    stats: Dict
+
+
+class ContextPacker:
+    """검색된 청크로 프롬프트 context를 조립
+
+    1. (질문이 있으면) MMR로 후보를 다양하게 정렬
+    2. 이미 넣은 청크와 겹치는 구간(분할 overlap)은 잘라내고, 통째로 포함된 청크는 버림
+    3. 모델별 토큰 예산(Config.context_budget)을 넘지 않을 때까지, 최대 k개를 채움
+
+    MMR은 검색 결과와 함께 받은 색인의 저장 벡터(vectors)로 계산하므로 청크를 다시 임베딩하지 않음
+    (벡터 없이 넘기면 검색 순서 그대로 사용).
+    stats()는 단순 이어 붙이기(상위 k개) 대비 줄인 토큰의 누적값.
+    """
+
+    def __init__(self, vs_manager=None):
+        self.vs_manager = vs_manager
+        self.totals = {"requests": 0, "tokens_before": 0, "tokens_after": 0, "tokens_saved": 0,
+                       "duplicates_removed": 0, "chars_trimmed": 0}
+        self._lock = threading.Lock()
+
+    def _order(self, docs: List["Document"], query: Optional[str], vectors, query_vector) -> List["Document"]:
+        if not query or vectors is None or len(docs) <= 1:
+            return docs
+        try:
+            if query_vector is None:
+                if self.vs_manager is None:
+                    return docs
+                query_vector = self.vs_manager.embed.embed_query(query)
+            order = mmr_order(query_vector, vectors, len(docs))
+        except Exception as e:
+            print(f"MMR 정렬 실패, 검색 순서를 사용합니다: {e}")
+            return docs
+        return [docs[i] for i in order]
+
+    def pack(self, docs: List["Document"], query: Optional[str] = None, k: int = 4, model_name: str = None,
+             budget: int = None, separator: str = "\n\n", vectors=None, query_vector=None) -> PackedContext:
+        """docs는 관련도 순 후보 (k보다 많이 넘기면 MMR이 그중에서 고름)
+
+        vectors는 docs와 같은 순서의 청크 벡터 (검색 결과 SearchHits.vectors), query_vector는 질의 벡터
+        """
+        model_name = model_name or Config.LLM_MODEL()
+        budget = budget or Config.context_budget(model_name)
+        sep_tokens = count_tokens(separator, model_name)
+        texts: List[str] = []
+        used: List["Document"] = []
+        used_tokens = duplicates = trimmed = 0
+        for doc in self._order(docs, query, vectors, query_vector):
+            if len(used) >= k:
+                break
+            text = doc.page_content.strip()
+            if any(text in d.page_content for d in used):
+                duplicates += 1
+                continue
+            for t in texts:
+                head = _overlap(t, text, Config.CONTEXT_MIN_OVERLAP_CHARS)
+                tail = _overlap(text, t, Config.CONTEXT_MIN_OVERLAP_CHARS)
+                if head or tail:
+                    text = text[head:len(text) - tail].strip()
+            if not text:
+                duplicates += 1
+                continue
+            n = count_tokens(text, model_name) + (sep_tokens if texts else 0)
+            if used_tokens + n > budget:
+                continue  # 더 짧은 다음 후보는 들어갈 수 있음
+            trimmed += len(doc.page_content.strip()) - len(text)
+            texts.append(text)
+            used.append(doc)
+            used_tokens += n
+        packed = separator.join(texts)
+        # 비교 기준: 기존 stuff 체인처럼 상위 k개를 그대로 이어 붙였을 때
+        before = count_tokens(separator.join(d.page_content for d in docs[:k]), model_name)
+        after = count_tokens(packed, model_name)
+        stats = {"chunks": len(used), "candidates": len(docs), "tokens_before": before, "tokens_after": after,
+                 "tokens_saved": before - after, "duplicates_removed": duplicates, "chars_trimmed": trimmed,
+                 "budget": budget}
+        with self._lock:
+            self.totals["requests"] += 1
+            for key in ("tokens_before", "tokens_after", "tokens_saved", "duplicates_removed", "chars_trimmed"):
+                self.totals[key] += stats[key]
+        return PackedContext(packed, used, stats)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            totals = dict(self.totals)
+        totals["saved_ratio"] = totals["tokens_saved"] / totals["tokens_before"] if totals["tokens_before"] else 0.0
+        return totals
+
+
+# 프로세스당 하나 (누적 통계도 프로세스 전체 기준). 관리자는 질의 벡터가 없을 때 질의를 임베딩하는 데만 사용
+_shared_packer: Optional[ContextPacker] = None
+_shared_lock = threading.Lock()
+
+
+def get_context_packer(vs_manager=None) -> ContextPacker:
+    global _shared_packer
+    if _shared_packer is None:
+        with _shared_lock:
+            if _shared_packer is None:
+                _shared_packer = ContextPacker(vs_manager)
+    if _shared_packer.vs_manager is None:
+        _shared_packer.vs_manager = vs_manager
+    return _shared_packer
@@ -0,0 +1,461 @@
+import os, shutil
+import re
+import atexit
+import json
+import inspect
+import sqlite3
+import threading
+import time
+import hashlib
+import multiprocessing
+from array import array
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from config import Config
+
+
+class CachedEmbeddings(Embeddings):
+    """임베딩 결과를 SQLite에 (모델명 + 텍스트 해시) 키로 저장해 재사용하는 래퍼
+
+    최대 항목 수를 넘으면 가장 오래 사용하지 않은 항목부터 삭제하고, 적중/미스 횟수를 기록함.
+    적중할 때마다 SQLite에 쓰지 않도록 사용 시각은 메모리에 모아 두었다가 한꺼번에 기록하고,
+    항목 수는 열 때 한 번 세어 메모리에서 유지함 (정리할 때 다시 세어 다른 프로세스의 추가분을 반영).
+    """
+
+    def __init__(self, base: Embeddings, model_name: str, path: str = None, max_entries: int = None):
+        self.base = base
+        self.model_name = model_name
+        self.path = path or Config.EMBED_CACHE_PATH
+        self.max_entries = max_entries or Config.EMBED_CACHE_MAX_ENTRIES
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Streamlit은 여러 스레드에서 호출하므로 연결을 공유하고 락으로 보호
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._touched: Dict[str, float] = {}  # 아직 기록하지 않은 적중 항목 → 사용 시각
+        atexit.register(self.flush)
+
+    def _key(self, kind: str, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for key, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[key] = vec.tolist()
+            if found:
+                now = time.time()
+                self._touched.update((k, now) for k in found)
+                if len(self._touched) >= Config.EMBED_CACHE_TOUCH_BATCH:
+                    self._write_touched()
+                    self._conn.commit()
+        return found
+
+    def _write_touched(self):
+        # 호출자는 self._lock을 잡고 있어야 함 (commit도 호출자가)
+        if self._touched:
+            self._conn.executemany("UPDATE embeddings SET last_used=? WHERE key=?",
+                                   [(t, k) for k, t in self._touched.items()])
+            self._touched = {}
+
+    def flush(self):
+        """모아 둔 사용 시각을 기록 (종료 전 등)"""
+        with self._lock:
+            self._write_touched()
+            self._conn.commit()
+
+    def _store(self, items: Dict[str, List[float]]):
+        now = time.time()
+        with self._lock:
+            # 이미 있는 키(다른 스레드/프로세스가 먼저 저장)는 건너뛰어 새로 들어간 행만 셈
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings(key, vector, last_used) VALUES (?, ?, ?)",
+                [(k, array("f", v).tobytes(), now) for k, v in items.items()],
+            )
+            self._count += max(cursor.rowcount, 0)
+            if self._count > self.max_entries:
+                # 정리 기준이 최신이도록 모아 둔 사용 시각부터 기록하고, 다른 프로세스가 추가한 분량까지 다시 셈
+                self._write_touched()
+                self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                if self._count > self.max_entries:
+                    # 한 번에 10% 여유를 두고 정리해 매 삽입마다 삭제가 반복되지 않게 함
+                    excess = self._count - int(self.max_entries * 0.9)
+                    self._conn.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+                    )
+                    self._count -= excess
+            self._conn.commit()
+
+    def _embed_cached(self, kind: str, texts: List[str], batch_queries: bool = False) -> List[List[float]]:
+        keys = [self._key(kind, t) for t in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+        missing = list(dict.fromkeys(k for k in keys if k not in found))
+        if missing:
+            first_text = {}
+            for k, t in zip(keys, texts):
+                first_text.setdefault(k, t)
+            if kind == "query" and not batch_queries:
+                vectors = [self.base.embed_query(first_text[k]) for k in missing]
+            else:
+                vectors = self.base.embed_documents([first_text[k] for k in missing])
+            # 캐시에서 읽은 값과 동일하도록 float32로 맞춰 반환
+            new_items = {k: array("f", v).tolist() for k, v in zip(missing, vectors)}
+            self._store(new_items)
+            found.update(new_items)
+        with self._lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        return [found[k] for k in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._embed_cached("doc", texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_cached("query", [text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """질의 여러 개를 한 번의 배치로 임베딩 (HuggingFace 모델은 embed_query가 단건 배치와 동일)"""
+        if not texts:
+            return []
+        return self._embed_cached("query", texts, batch_queries=True)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        with self._lock:
+            entries = self._count
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+        }
+
+
+# ONNX 변환 결과가 PyTorch와 같은지 확인할 때 쓰는 문장 (강의자료와 비슷한 한/영 혼합)
+PARITY_TEXTS = [
+    "데이터베이스 정규화는 중복을 줄이고 이상 현상을 방지하기 위한 과정이다.",
+    "트랜잭션의 ACID 특성은 원자성, 일관성, 고립성, 지속성을 의미한다.",
+    "운영체제는 프로세스 스케줄링과 메모리 관리를 담당한다.",
+    "TCP는 연결 지향 프로토콜이며 3-way handshake로 연결을 맺는다.",
+    "A binary search tree keeps keys ordered so lookups take O(log n) on average.",
+    "Gradient descent updates parameters in the direction that reduces the loss.",
+    "=== 페이지 3 === 1. 관계 대수 σ(선택), π(추출), ⋈(조인)",
+    "짧은 문장",
+]
+
+
+def onnx_model_dir(model_name: str, quantize: bool) -> str:
+    safe_name = re.sub(r"[^\w.-]", "_", model_name)
+    return os.path.join(Config.EMBED_ONNX_DIR, f"{safe_name}-{'int8' if quantize else 'fp32'}")
+
+
+def _pooling_mode(pooling) -> str:
+    # sentence-transformers 버전에 따라 설정 키가 다름 (pooling_mode 문자열 또는 모드별 bool)
+    config = pooling.get_config_dict()
+    if isinstance(config.get("pooling_mode"), str):
+        return config["pooling_mode"]
+    if config.get("pooling_mode_cls_token"):
+        return "cls"
+    if config.get("pooling_mode_max_tokens"):
+        return "max"
+    return "mean"
+
+
+def export_onnx(model_name: str, out_dir: str, quantize: bool):
+    """sentence-transformers 모델의 트랜스포머 부분을 ONNX로 내보내고 (선택 시 동적 int8 양자화) 토크나이저와 함께 저장
+
+    pooling/정규화는 numpy로 처리하므로 그 설정만 meta.json에 기록. 임시 폴더에 쓴 뒤 이름을 바꿈
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model.eval()
+    pooling = next((m for m in model if isinstance(m, Pooling)), None)
+    sample = model.tokenizer(PARITY_TEXTS[:2], padding=True, truncation=True, return_tensors="pt")
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+
+    class _Encoder(torch.nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, *inputs):
+            return self.inner(**dict(zip(input_names, inputs))).last_hidden_state
+
+    tmp_dir = f"{out_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    fp32_path = os.path.join(tmp_dir, "model_fp32.onnx")
+    dynamic_axes = {n: {0: "batch", 1: "sequence"} for n in input_names + ["last_hidden_state"]}
+    export_kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        export_kwargs["dynamo"] = False  # 최신 torch의 기본 exporter는 onnxscript가 필요하므로 기존 방식 사용
+    with torch.no_grad():
+        torch.onnx.export(_Encoder(transformer), tuple(sample[n] for n in input_names), fp32_path,
+                          input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes, opset_version=14, **export_kwargs)
+    model_path = os.path.join(tmp_dir, "model.onnx")
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(fp32_path, model_path, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+    else:
+        os.replace(fp32_path, model_path)
+    model.tokenizer.save_pretrained(tmp_dir)
+    meta = {
+        "model_name": model_name,
+        "quantized": quantize,
+        "input_names": input_names,
+        "pooling": _pooling_mode(pooling) if pooling else "mean",
+        "normalize": any(isinstance(m, Normalize) for m in model),
+        "max_length": model.max_seq_length,
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+
+
+class OnnxEmbeddings(Embeddings):
+    """sentence-transformers 모델을 ONNX Runtime(CPU)으로 실행하는 임베딩
+
+    처음 사용할 때 EMBED_ONNX_DIR에 모델을 내보내고 (int8 양자화 선택), 이후에는 저장된 모델만 로드함.
+    문장을 길이순으로 묶어 padding 낭비를 줄이고, 결과는 입력 순서대로 반환.
+    """
+
+    def __init__(self, model_name: str, quantize: bool = None, batch_size: int = None, threads: int = None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.quantize = Config.EMBED_ONNX_QUANTIZE if quantize is None else quantize
+        self.batch_size = batch_size or Config.EMBED_MODEL_BATCH_SIZE
+        threads = Config.EMBED_THREADS if threads is None else threads
+        self.model_dir = onnx_model_dir(model_name, self.quantize)
+        if not os.path.exists(os.path.join(self.model_dir, "meta.json")):
+            export_onnx(model_name, self.model_dir, self.quantize)
+        with open(os.path.join(self.model_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(os.path.join(self.model_dir, "model.onnx"), options,
+                                            providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
+        # fast 토크나이저는 여러 스레드에서 동시에 호출하면 오류가 나므로 토큰화만 직렬화 (추론은 동시 실행 가능)
+        self._tokenizer_lock = threading.Lock()
+
+    @property
+    def backend_name(self) -> str:
+        return f"onnx-{'int8' if self.quantize else 'fp32'}"
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        out: Optional[np.ndarray] = None
+        for start in range(0, len(texts), self.batch_size):
+            idx = order[start:start + self.batch_size]
+            with self._tokenizer_lock:
+                enc = self.tokenizer([texts[i] for i in idx], padding=True, truncation=True,
+                                     max_length=self.meta["max_length"], return_tensors="np")
+            feeds = {n: enc[n].astype(np.int64) for n in self.meta["input_names"]}
+            hidden = self.session.run(None, feeds)[0]
+            mask = enc["attention_mask"].astype(np.float32)[:, :, None]
+            if self.meta["pooling"] == "cls":
+                pooled = hidden[:, 0]
+            elif self.meta["pooling"] == "max":
+                pooled = np.where(mask > 0, hidden, -1e9).max(axis=1)
+            else:
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.meta["normalize"]:
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            if out is None:
+                out = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            out[idx] = pooled
+        return out
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._encode(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
+
+
+@lru_cache(maxsize=4)
+def load_tokenizer(model_name: Optional[str] = None) -> Tuple[object, int]:
+    """임베딩 모델의 토크나이저와 최대 입력 토큰 수(특수 토큰 포함)를 반환 (모델 가중치는 로드하지 않음)
+
+    이 길이를 넘는 입력은 임베딩할 때 잘리므로, 청크 분할이 같은 기준을 쓰도록 함.
+    """
+    from transformers import AutoTokenizer
+
+    model_name = model_name or Config.EMBED_MODEL_NAME
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    max_length = _max_seq_length(model_name) or tokenizer.model_max_length
+    return tokenizer, min(max_length, tokenizer.model_max_length)
+
+
+def _max_seq_length(model_name: str) -> Optional[int]:
+    # sentence-transformers는 토크나이저 설정(512 등)보다 짧은 max_seq_length를 별도 파일에 둠
+    try:
+        if os.path.isdir(model_name):
+            path = os.path.join(model_name, "sentence_bert_config.json")
+        else:
+            from huggingface_hub import hf_hub_download
+
+            path = hf_hub_download(model_name, "sentence_bert_config.json")
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("max_seq_length")
+    except Exception:
+        return None
+
+
+def _torch_embeddings(model_name: str, threads: int = None) -> Embeddings:
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    threads = Config.EMBED_THREADS if threads is None else threads
+    if threads:
+        import torch
+
+        torch.set_num_threads(threads)
+    return HuggingFaceEmbeddings(model_name=model_name, encode_kwargs={"batch_size": Config.EMBED_MODEL_BATCH_SIZE})
+
+
+def check_parity(model_name: Optional[str] = None, texts: List[str] = None, quantize: bool = None) -> Dict:
+    """ONNX 임베딩과 PyTorch 임베딩의 문장별 코사인 유사도 비교 (min_cosine이 기준 이상이면 passed)"""
+    model_name = model_name or Config.EMBED_MODEL_NAME
+    texts = texts or PARITY_TEXTS
+    onnx = OnnxEmbeddings(model_name, quantize=quantize)
+    reference = np.asarray(_torch_embeddings(model_name).embed_documents(texts), dtype=np.float32)
+    candidate = np.asarray(onnx.embed_documents(texts), dtype=np.float32)
+    cosine = (reference * candidate).sum(axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1))
+    return {
+        "model": model_name,
+        "backend": onnx.backend_name,
+        "min_cosine": round(float(cosine.min()), 5),
+        "mean_cosine": round(float(cosine.mean()), 5),
+        "threshold": Config.EMBED_PARITY_MIN_COSINE,
+        "passed": bool(cosine.min() >= Config.EMBED_PARITY_MIN_COSINE),
+    }
+
+
+def _onnx_embeddings(model_name: str) -> Optional[Embeddings]:
+    """ONNX 백엔드를 준비. 처음 내보낼 때 parity 검사를 하고 결과를 meta.json에 남겨, 미달이면 None (torch 사용)"""
+    try:
+        onnx = OnnxEmbeddings(model_name)
+        if "parity" not in onnx.meta:
+            onnx.meta["parity"] = check_parity(model_name, quantize=onnx.quantize)
+            with open(os.path.join(onnx.model_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(onnx.meta, f, ensure_ascii=False)
+    except ImportError as e:
+        print(f"ONNX Runtime이 설치되지 않아 PyTorch로 실행합니다 (pip install -r requirements-onnx.txt): {e}")
+        return None
+    except Exception as e:
+        print(f"ONNX 임베딩 준비 실패, PyTorch로 실행합니다: {e}")
+        return None
+    parity = onnx.meta["parity"]
+    if not parity["passed"]:
+        print(f"ONNX 임베딩이 PyTorch와 달라 사용하지 않습니다 (min cosine {parity['min_cosine']} < "
+              f"{parity['threshold']})")
+        return None
+    return onnx
+
+
+_worker_model: Optional[Embeddings] = None
+
+
+def _init_embed_worker(model_name: str, backend: str, threads: int):
+    # 워커 프로세스마다 모델을 한 번만 로드 (코어를 나눠 쓰도록 스레드 수 제한)
+    global _worker_model
+    if backend.startswith("onnx"):
+        _worker_model = OnnxEmbeddings(model_name, threads=threads)
+    else:
+        _worker_model = _torch_embeddings(model_name, threads=threads)
+
+
+def _embed_shard(texts: List[str]) -> np.ndarray:
+    return np.asarray(_worker_model.embed_documents(texts), dtype=np.float32)
+
+
+class ProcessPoolEmbeddings(Embeddings):
+    """큰 문서 배치를 여러 워커 프로세스(각자 모델 보유)로 나눠 임베딩하고 입력 순서대로 합침
+
+    질의와 작은 배치는 이 프로세스의 모델로 바로 계산. 워커 풀은 처음 큰 배치가 들어올 때 만듦.
+    """
+
+    def __init__(self, local: Embeddings, model_name: str, backend: str, workers: int = None):
+        self.local = local
+        self.model_name = model_name
+        self.backend = backend
+        self.workers = workers or Config.EMBED_WORKERS
+        # 워커당 스레드 수: 지정이 없으면 코어를 워커 수로 나눔
+        self.threads = Config.EMBED_THREADS or max(1, (os.cpu_count() or 1) // self.workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                # torch/ONNX 스레드 풀을 fork로 복제하면 멈출 수 있어 spawn 사용
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_embed_worker, initargs=(self.model_name, self.backend, self.threads))
+            return self._pool
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = list(texts)
+        if len(texts) < Config.EMBED_POOL_MIN_TEXTS:
+            return self.local.embed_documents(texts)
+        # 워커마다 한 덩어리씩, 단 모델 배치보다 작게 쪼개지는 않음
+        shard = max(Config.EMBED_MODEL_BATCH_SIZE, -(-len(texts) // self.workers))
+        shards = [texts[i:i + shard] for i in range(0, len(texts), shard)]
+        # map은 제출 순서대로 결과를 돌려주므로 그대로 이어 붙이면 입력 순서가 유지됨
+        return np.concatenate(list(self._get_pool().map(_embed_shard, shards))).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.local.embed_query(text)
+
+
+def build_embeddings(model_name: Optional[str] = None) -> Embeddings:
+    """설정에 맞는 임베딩 객체 생성 (EMBED_BACKEND=onnx면 ONNX Runtime, EMBED_WORKERS>1이면 워커 프로세스 풀,
+    캐시 사용 시 CachedEmbeddings로 감쌈)"""
+    model_name = model_name or Config.EMBED_MODEL_NAME
+    base = _onnx_embeddings(model_name) if Config.EMBED_BACKEND == "onnx" else None
+    # 캐시 키에 실행 방식을 넣어 torch/onnx 벡터가 섞이지 않게 함
+    cache_name = f"{model_name}@{base.backend_name}" if base is not None else model_name
+    if base is None:
+        base = _torch_embeddings(model_name)
+    if Config.EMBED_WORKERS > 1:
+        base = ProcessPoolEmbeddings(base, model_name, cache_name.partition("@")[2] or "torch")
+    if not Config.EMBED_CACHE_ENABLED:
+        return base
+    return CachedEmbeddings(base, cache_name)
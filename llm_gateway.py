@@ -0,0 +1,420 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+from config import Config
+
+# ===========================
+# 모든 LLM 호출(챗봇, 퀴즈, 평가 스크립트)이 거치는 게이트웨이
+# - 제공사별 SDK 클라이언트를 프로세스당 하나씩 재사용 (HTTP 연결 풀 공유)
+# - 제공사별 동시 요청 수 제한 (동기/비동기 호출 합산)
+# - 429/529/5xx/연결 오류는 지수 백오프 + jitter로 재시도 (Retry-After 헤더 우선), SDK 자체 재시도는 끔
+# - 재시도 후에도 실패하면 Config.LLM_FALLBACK에 따라 다른 제공사(Claude ↔ OpenAI)로 대체
+# - 제공사/모델별 요청·오류·재시도·대체 횟수, 입력/출력 토큰, 지연 시간 기록
+# ===========================
+
+PROVIDERS = ("openai", "claude")
+_ALIASES = {"anthropic": "claude"}
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError",
+                    "OverloadedError", "ServiceUnavailableError"}
+
+
+class LLMResponse(NamedTuple):
+    content: str
+    provider: str
+    model: str
+    input_tokens: int
+    output_tokens: int
+
+
+class LLMGatewayError(Exception):
+    """모든 시도(재시도, 대체 제공사 포함)가 실패함. errors에는 (제공사, 모델, 마지막 예외)"""
+
+    def __init__(self, errors: List[Tuple[str, str, Exception]]):
+        super().__init__("; ".join(f"{p}/{m}: {e}" for p, m, e in errors))
+        self.errors = errors
+
+
+def normalize_provider(provider: Optional[str]) -> str:
+    provider = _ALIASES.get(provider, provider) if provider else Config.MODEL_TYPE
+    if provider not in PROVIDERS:
+        raise ValueError("지원하지 않는 모델 타입입니다. (openai 또는 claude)")
+    return provider
+
+
+def _status(e: Exception) -> Optional[int]:
+    status = getattr(e, "status_code", None)
+    if status is None:
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    return status
+
+
+def is_retryable(e: Exception) -> bool:
+    return _status(e) in RETRYABLE_STATUS or type(e).__name__ in RETRYABLE_ERRORS
+
+
+def backoff_delay(attempt: int, e: Exception = None) -> float:
+    """full jitter 지수 백오프. 서버가 Retry-After를 주면 그보다 짧게 기다리지 않음"""
+    delay = random.uniform(0, min(Config.LLM_BACKOFF_MAX, Config.LLM_BACKOFF_BASE * (2 ** attempt)))
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        delay = max(delay, min(float(headers.get("retry-after", 0)), Config.LLM_BACKOFF_MAX))
+    except (TypeError, ValueError):
+        pass
+    return delay
+
+
+class _Waiter:
+    """_Limiter 대기열 항목. 동기 호출은 Event, 비동기 호출은 자기 루프의 Future로 깨움"""
+
+    __slots__ = ("granted", "_event", "_loop", "_future")
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.granted = False  # release가 자리를 넘겨줬는지 (_Limiter._lock 안에서만 변경)
+        self._loop = loop
+        self._event = threading.Event() if loop is None else None
+        self._future = loop.create_future() if loop is not None else None
+
+    def wake(self) -> bool:
+        """깨울 수 없으면(루프가 닫힘) False"""
+        if self._loop is None:
+            self._event.set()
+            return True
+        try:
+            self._loop.call_soon_threadsafe(self._resolve)
+        except RuntimeError:
+            return False
+        return True
+
+    def _resolve(self):
+        if not self._future.done():
+            self._future.set_result(None)
+
+    def wait(self):
+        self._event.wait()
+
+    async def wait_async(self):
+        await self._future
+
+
+class _Limiter:
+    """제공사별 동시 요청 수 제한 (동기/비동기 호출 합산)
+
+    빈 자리가 없으면 동기·비동기 호출 모두 하나의 FIFO 대기열에 줄을 서고, release는 자리를 반납하지 않고
+    맨 앞 대기자에게 바로 넘겨줌 (늦게 온 호출이 끼어들거나 비동기 호출이 계속 밀리지 않음).
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.in_flight = 0
+        self._waiters: "deque[_Waiter]" = deque()
+        self._lock = threading.Lock()
+
+    def _enqueue(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> Optional[_Waiter]:
+        """자리가 있으면 바로 차지하고 None, 없으면 대기열에 넣은 _Waiter"""
+        with self._lock:
+            # 대기자가 있으면 항상 in_flight == limit (release가 자리를 그대로 넘겨주므로)
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return None
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+            return waiter
+
+    def acquire(self):
+        waiter = self._enqueue()
+        if waiter is not None:
+            waiter.wait()
+
+    async def acquire_async(self):
+        waiter = self._enqueue(asyncio.get_running_loop())
+        if waiter is None:
+            return
+        try:
+            await waiter.wait_async()
+        except BaseException:
+            # 취소됨: 아직 줄에 있으면 빠지고, 이미 자리를 넘겨받았으면 다음 대기자에게 넘김
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._waiters.remove(waiter)
+            if granted:
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                if waiter.wake():
+                    return
+            self.in_flight -= 1
+
+
+class _Metrics:
+    def __init__(self):
+        self.requests = self.errors = self.retries = self.fallbacks = 0
+        self.input_tokens = self.output_tokens = 0
+        self.latencies = deque(maxlen=500)
+
+    def row(self) -> Dict:
+        latencies = sorted(self.latencies)
+        pct = (lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 3)) if latencies else (lambda q: None)
+        return {"requests": self.requests, "errors": self.errors, "retries": self.retries, "fallbacks": self.fallbacks,
+                "input_tokens": self.input_tokens, "output_tokens": self.output_tokens,
+                "latency_p50": pct(0.5), "latency_p95": pct(0.95)}
+
+
+class LLMGateway:
+    def __init__(self):
+        self._limiters = {p: _Limiter(Config.LLM_MAX_CONCURRENCY[p]) for p in PROVIDERS}
+        self._clients: Dict[str, object] = {}
+        # 비동기 클라이언트의 연결 풀은 만든 이벤트 루프에 묶이므로 루프별로 따로 둠
+        self._async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        self._metrics: Dict[Tuple[str, str], _Metrics] = {}
+        self._lock = threading.Lock()
+
+    # ----- 클라이언트 -----
+    @staticmethod
+    def _new_client(provider: str, use_async: bool):
+        # 재시도는 게이트웨이가 직접 하므로 SDK 재시도는 끔
+        kwargs = {"timeout": Config.LLM_TIMEOUT, "max_retries": 0}
+        if provider == "openai":
+            import openai
+
+            return (openai.AsyncOpenAI if use_async else openai.OpenAI)(api_key=Config.OPENAI_API_KEY, **kwargs)
+        import anthropic
+
+        return (anthropic.AsyncAnthropic if use_async else anthropic.Anthropic)(api_key=Config.ANTHROPIC_API_KEY,
+                                                                               **kwargs)
+
+    def _client(self, provider: str):
+        if provider not in self._clients:
+            with self._lock:
+                if provider not in self._clients:
+                    self._clients[provider] = self._new_client(provider, False)
+        return self._clients[provider]
+
+    def _async_client(self, provider: str):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            if provider not in clients:
+                clients[provider] = self._new_client(provider, True)
+            return clients[provider]
+
+    async def prepare(self, provider: str = None):
+        """acomplete가 쓸 이 루프의 비동기 클라이언트를 미리 만들어 둠 (SDK import와 클라이언트 생성 지연을
+        검색 등 다른 작업과 겹치게 할 때). 클라이언트는 루프마다 따로이므로 호출할 루프 안에서 바로 await"""
+        return self._async_client(normalize_provider(provider))
+
+    # ----- 대상 선택 -----
+    @staticmethod
+    def _has_key(provider: str) -> bool:
+        key = Config.OPENAI_API_KEY if provider == "openai" else Config.ANTHROPIC_API_KEY
+        return bool(key) and key.startswith("sk")
+
+    def _targets(self, provider: Optional[str], model: Optional[str], fallback: Optional[bool]) -> List[Tuple[str, str]]:
+        provider = normalize_provider(provider)
+        targets = [(provider, model or Config.default_model(provider))]
+        fallback = Config.LLM_FALLBACK if fallback is None else fallback
+        other = "claude" if provider == "openai" else "openai"
+        if fallback and self._has_key(other):
+            targets.append((other, Config.default_model(other)))
+        return targets
+
+    def _metric(self, provider: str, model: str) -> _Metrics:
+        with self._lock:
+            return self._metrics.setdefault((provider, model), _Metrics())
+
+    def _record(self, provider: str, model: str, **counts):
+        metric = self._metric(provider, model)
+        with self._lock:
+            for key, value in counts.items():
+                if key == "latency":
+                    metric.latencies.append(value)
+                else:
+                    setattr(metric, key, getattr(metric, key) + value)
+
+    # ----- 요청 형식 -----
+    @staticmethod
+    def _request(provider: str, model: str, prompt: str, temperature: Optional[float],
+                 max_tokens: Optional[int]) -> Dict:
+        request = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+        if temperature is not None:
+            request["temperature"] = temperature
+        if provider == "claude":
+            request["max_tokens"] = max_tokens or Config.LLM_MAX_TOKENS  # Anthropic API 필수값
+        elif max_tokens:
+            request["max_tokens"] = max_tokens
+        return request
+
+    @staticmethod
+    def _parse(provider: str, model: str, response) -> LLMResponse:
+        if provider == "openai":
+            usage = response.usage
+            return LLMResponse(response.choices[0].message.content or "", provider, model,
+                               getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0))
+        text = "".join(getattr(block, "text", "") for block in response.content)
+        return LLMResponse(text, provider, model, response.usage.input_tokens, response.usage.output_tokens)
+
+    # ----- 호출 -----
+    def complete(self, prompt: str, provider: str = None, model: str = None, temperature: float = None,
+                 max_tokens: int = None, fallback: bool = None) -> LLMResponse:
+        """프롬프트 하나에 대한 응답 (재시도와 제공사 대체 포함). 모두 실패하면 LLMGatewayError"""
+        errors = []
+        for i, (target_provider, target_model) in enumerate(self._targets(provider, model, fallback)):
+            request = self._request(target_provider, target_model, prompt, temperature, max_tokens)
+            for attempt in range(Config.LLM_MAX_RETRIES + 1):
+                limiter = self._limiters[target_provider]
+                limiter.acquire()
+                start = time.perf_counter()
+                try:
+                    client = self._client(target_provider)
+                    if target_provider == "openai":
+                        raw = client.chat.completions.create(**request)
+                    else:
+                        raw = client.messages.create(**request)
+                except Exception as e:
+                    self._record(target_provider, target_model, requests=1, errors=1)
+                    error = e
+                else:
+                    result = self._parse(target_provider, target_model, raw)
+                    self._record(target_provider, target_model, requests=1, fallbacks=int(i > 0),
+                                 input_tokens=result.input_tokens, output_tokens=result.output_tokens,
+                                 latency=time.perf_counter() - start)
+                    return result
+                finally:
+                    limiter.release()
+                if not is_retryable(error) or attempt == Config.LLM_MAX_RETRIES:
+                    break
+                self._record(target_provider, target_model, retries=1)
+                time.sleep(backoff_delay(attempt, error))
+            errors.append((target_provider, target_model, error))
+        raise LLMGatewayError(errors)
+
+    async def acomplete(self, prompt: str, provider: str = None, model: str = None, temperature: float = None,
+                        max_tokens: int = None, fallback: bool = None) -> LLMResponse:
+        """complete의 비동기 버전 (제공사 비동기 클라이언트 사용, 대기 중에는 루프를 양보)"""
+        errors = []
+        for i, (target_provider, target_model) in enumerate(self._targets(provider, model, fallback)):
+            request = self._request(target_provider, target_model, prompt, temperature, max_tokens)
+            for attempt in range(Config.LLM_MAX_RETRIES + 1):
+                limiter = self._limiters[target_provider]
+                await limiter.acquire_async()
+                start = time.perf_counter()
+                try:
+                    client = self._async_client(target_provider)
+                    if target_provider == "openai":
+                        raw = await client.chat.completions.create(**request)
+                    else:
+                        raw = await client.messages.create(**request)
+                except Exception as e:
+                    self._record(target_provider, target_model, requests=1, errors=1)
+                    error = e
+                else:
+                    result = self._parse(target_provider, target_model, raw)
+                    self._record(target_provider, target_model, requests=1, fallbacks=int(i > 0),
+                                 input_tokens=result.input_tokens, output_tokens=result.output_tokens,
+                                 latency=time.perf_counter() - start)
+                    return result
+                finally:
+                    limiter.release()
+                if not is_retryable(error) or attempt == Config.LLM_MAX_RETRIES:
+                    break
+                self._record(target_provider, target_model, retries=1)
+                await asyncio.sleep(backoff_delay(attempt, error))
+            errors.append((target_provider, target_model, error))
+        raise LLMGatewayError(errors)
+
+    def _stream_pieces(self, provider: str, request: Dict, usage: Dict) -> Iterator[str]:
+        """텍스트 조각 생성기. usage는 스트림을 끝까지 읽은 뒤 채워짐
+
+        요청은 첫 조각을 읽을 때 보내고, 응답 스트림은 생성기 안의 with/finally에서 닫으므로
+        끝까지 읽지 않고 close()해도 연결이 남지 않음.
+        """
+        client = self._client(provider)
+        if provider == "openai":
+            stream = client.chat.completions.create(**request, stream=True, stream_options={"include_usage": True})
+            try:
+                for chunk in stream:
+                    if chunk.usage:
+                        usage.update(input_tokens=chunk.usage.prompt_tokens, output_tokens=chunk.usage.completion_tokens)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                stream.close()
+        else:
+            with client.messages.stream(**request) as stream:
+                yield from stream.text_stream
+                final = stream.get_final_message()
+                usage.update(input_tokens=final.usage.input_tokens, output_tokens=final.usage.output_tokens)
+
+    def stream(self, prompt: str, provider: str = None, model: str = None, temperature: float = None,
+               max_tokens: int = None, fallback: bool = None) -> Iterator[str]:
+        """응답을 텍스트 조각으로 생성. 재시도/제공사 대체는 첫 조각을 받기 전까지만 (이미 보낸 내용은 되돌릴 수 없음)
+
+        동시 요청 자리는 첫 조각을 요청할 때 잡고, 스트림을 끝까지 읽거나 생성기를 close()할 때 반납함
+        (스트림이 열려 있는 동안은 요청 중으로 셈). 읽다 말 때는 contextlib.closing 등으로 반드시 닫을 것.
+        서버가 멈춰도 조각 사이 대기는 SDK timeout(Config.LLM_TIMEOUT)에서 끊김.
+        """
+        errors = []
+        for i, (target_provider, target_model) in enumerate(self._targets(provider, model, fallback)):
+            request = self._request(target_provider, target_model, prompt, temperature, max_tokens)
+            for attempt in range(Config.LLM_MAX_RETRIES + 1):
+                limiter = self._limiters[target_provider]
+                limiter.acquire()
+                start = time.perf_counter()
+                started = False
+                usage = {"input_tokens": 0, "output_tokens": 0}
+                pieces = self._stream_pieces(target_provider, request, usage)
+                try:
+                    for piece in pieces:
+                        started = True
+                        yield piece
+                except Exception as e:
+                    self._record(target_provider, target_model, requests=1, errors=1)
+                    if started:
+                        raise
+                    error = e
+                else:
+                    self._record(target_provider, target_model, requests=1, fallbacks=int(i > 0),
+                                 latency=time.perf_counter() - start, **usage)
+                    return
+                finally:
+                    # 바깥 생성기가 닫혀도(GeneratorExit) 응답 스트림을 바로 닫고 자리를 반납
+                    pieces.close()
+                    limiter.release()
+                if not is_retryable(error) or attempt == Config.LLM_MAX_RETRIES:
+                    break
+                self._record(target_provider, target_model, retries=1)
+                time.sleep(backoff_delay(attempt, error))
+            errors.append((target_provider, target_model, error))
+        raise LLMGatewayError(errors)
+
+    def stats(self) -> List[Dict]:
+        """제공사/모델별 요청·오류·재시도·대체 횟수, 토큰, 지연(p50/p95 초), 현재 동시 요청 수"""
+        with self._lock:
+            rows = [{"provider": p, "model": m, **metric.row()} for (p, m), metric in self._metrics.items()]
+        for row in rows:
+            row["in_flight"] = self._limiters[row["provider"]].in_flight
+        return rows
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> LLMGateway:
+    """프로세스 공용 게이트웨이 (여러 세션과 스크립트가 같은 연결 풀과 동시 요청 제한을 공유)"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway()
+    return _gateway
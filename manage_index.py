@@ -0,0 +1,57 @@
+import argparse
+import pandas as pd
+from vector_store import MultiSubjectVectorStoreManager
+from subject_index import COMPRESSION_MODES
+
+# ===========================
+# 과목 색인 관리 도구
+#   python manage_index.py report 데이터베이스          # 압축 방식별 메모리/recall 비교
+#   python manage_index.py compress 데이터베이스 --mode fp16
+#   python manage_index.py compress --all --mode pq     # faiss_subjects/ 아래 모든 과목 변환
+#   python manage_index.py optimize 데이터베이스        # 세그먼트 병합 + ANN 전환 검사
+#   python manage_index.py embed-check                   # ONNX 임베딩과 PyTorch 임베딩 일치 여부 (코사인)
+# ===========================
+
+
+def _targets(vs: MultiSubjectVectorStoreManager, args) -> list:
+    subjects = vs.get_subjects() if args.all else [args.subject]
+    return [s for s in subjects if s]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="과목 색인 관리 (압축 변환, 리포트, 최적화)")
+    parser.add_argument("command", choices=["report", "compress", "optimize", "status", "embed-check"])
+    parser.add_argument("subject", nargs="?", default="")
+    parser.add_argument("--all", action="store_true", help="모든 과목에 적용")
+    parser.add_argument("--mode", choices=COMPRESSION_MODES, default="fp16", help="compress 대상 방식")
+    args = parser.parse_args()
+    if args.command == "embed-check":
+        from embeddings import check_parity
+
+        try:
+            print(pd.DataFrame([check_parity()]).to_string(index=False))
+        except ImportError as e:
+            print(f"ONNX Runtime이 설치되지 않았습니다 (pip install -r requirements-onnx.txt): {e}")
+        return
+    if not args.subject and not args.all:
+        parser.error("과목명 또는 --all을 지정하세요.")
+
+    vs = MultiSubjectVectorStoreManager()
+    for subject in _targets(vs, args):
+        print(f"\n📚 {subject}")
+        if args.command == "report":
+            rows = vs.compression_report(subject)
+        elif args.command == "compress":
+            rows = vs.set_compression(subject, args.mode)
+        elif args.command == "optimize":
+            rows = vs.optimize_subject(subject)
+        else:
+            rows = vs.get_index_report(subject)
+        if rows:
+            print(pd.DataFrame(rows).to_string(index=False))
+        else:
+            print("색인이 없습니다.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,183 @@
-import os, tempfile
-from typing import List, Optional
+import re
+import threading
+from io import BytesIO
+from collections import Counter
+from itertools import chain
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 from PyPDF2 import PdfReader
 from langchain.docstore.document import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from config import Config
+from utils.pdf_extract import extract_page_range, get_extract_pool
+
+
+# 문장 경계: 문장부호(. ! ? 。 등) 뒤 공백, 마침표 없이 줄이 끝나는 한국어 종결어미(~다, ~요, ~음, ~함 등),
+# 빈 줄, 글머리 기호/번호로 시작하는 줄. PDF의 일반 줄바꿈은 문장 중간인 경우가 많아 경계로 보지 않음
+_SENTENCE_BOUNDARY = re.compile(
+    r"(?<=[.!?。！？])\s+"
+    r"|(?<=[다요죠음함됨임])[ \t]*\n\s*"
+    r"|\n[ \t]*\n\s*"
+    r"|\n(?=[ \t]*(?:[-•▪◦·※○●■□▶>]|\d+[.)]|[①-⑳]))"
+)
+
+
+_NUMBER = re.compile(r"\d+")
+
+
+def _line_keys(line: str, page_no: int) -> Set[str]:
+    """줄의 비교 키: 공백을 정리한 원문, 그리고 쪽 번호를 따라 바뀌는 숫자(쪽 번호 + 일정한 차이)를 #로 바꾼 형태
+
+    "Example 1:"처럼 페이지와 상관없는 숫자는 그대로 두므로 숫자만 다른 본문 줄이 반복 줄로 묶이지 않음.
+    쪽 번호와의 차이가 0이 아니면 "#+2"처럼 차이를 남김 (표지 등으로 인쇄된 쪽 번호가 밀린 경우)
+    """
+    line = " ".join(line.split())
+    keys = {line}
+    offsets = {int(m.group()) - page_no for m in _NUMBER.finditer(line) if len(m.group()) <= 4}
+    for offset in offsets:
+        mark = "#" + (f"{offset:+d}" if offset else "")
+        keys.add(_NUMBER.sub(
+            lambda m: mark if len(m.group()) <= 4 and int(m.group()) - page_no == offset else m.group(), line))
+    return keys
+
+
+def _edge_indices(lines: List[str], edge: int) -> List[int]:
+    """내용이 있는 줄 중 위/아래 edge줄의 위치 (짧은 페이지는 본문이 남도록 1/3까지만)"""
+    content = [i for i, l in enumerate(lines) if l.strip()]
+    edge = min(edge, len(content) // 3)
+    return content[:edge] + content[len(content) - edge:] if edge else []
+
+
+def _edge_lines(text: str, edge: int) -> List[str]:
+    lines = text.splitlines()
+    return [lines[i] for i in _edge_indices(lines, edge)]
+
+
+def detect_boilerplate(pages: List[Tuple[int, str]], edge: int = None, min_ratio: float = None) -> Set[str]:
+    """여러 페이지의 위/아래 edge줄에 반복해서 나오는 줄의 키를 찾음 (과목명, 학교명, 쪽 번호 등)
+
+    pages: (페이지 번호, 텍스트). 숫자만 있는 줄도 페이지마다 쪽 번호를 따라 바뀔 때만 반복 줄이 됨
+    """
+    edge = edge or Config.BOILERPLATE_EDGE_LINES
+    min_ratio = Config.BOILERPLATE_MIN_RATIO if min_ratio is None else min_ratio
+    pages = [(page_no, p) for page_no, p in pages if p.strip()]
+    if len(pages) < 3:
+        return set()
+    counts = Counter(chain.from_iterable(
+        set(chain.from_iterable(_line_keys(l, page_no) for l in _edge_lines(p, edge))) for page_no, p in pages))
+    threshold = max(2, min_ratio * len(pages))
+    return {key for key, n in counts.items() if n >= threshold and key.strip()}
+
+
+def strip_boilerplate(text: str, boilerplate: Set[str], page_no: int, edge: int = None) -> str:
+    """페이지 위/아래 edge줄 중 반복 줄(쪽 번호 줄 포함)을 제거 (본문 가운데 줄은 건드리지 않음)"""
+    edge = edge or Config.BOILERPLATE_EDGE_LINES
+    lines = text.splitlines()
+    edges = set(_edge_indices(lines, edge))
+    kept = [l for i, l in enumerate(lines) if i not in edges or not (_line_keys(l, page_no) & boilerplate)]
+    return "\n".join(kept).strip()
+
+
+class TokenChunker:
+    """임베딩 모델의 토크나이저로 길이를 재서 최대 입력 길이 안에 들어가도록 자르는 분할기
+
+    문장 경계에서 우선 자르고, 한 문장이 한도를 넘을 때만 단어 경계에서 자름. 만든 청크는 다시 세어 한도를 지킴.
+    """
+
+    def __init__(self, model_name: str = None, max_tokens: int = None, overlap_tokens: int = None):
+        from embeddings import load_tokenizer
+
+        self.tokenizer, model_max = load_tokenizer(model_name)
+        if not self.tokenizer.is_fast:
+            raise ValueError("토큰 위치로 자르려면 fast 토크나이저가 필요합니다.")
+        # [CLS]/[SEP] 등 모델이 붙이는 특수 토큰 자리를 빼야 본문이 잘리지 않음
+        self.limit = model_max - self.tokenizer.num_special_tokens_to_add(pair=False)
+        max_tokens = Config.CHUNK_MAX_TOKENS if max_tokens is None else max_tokens
+        self.budget = min(max_tokens, self.limit) if max_tokens else self.limit
+        self.overlap = Config.CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+        # fast 토크나이저는 여러 스레드에서 동시에 호출하면 오류가 남
+        self._lock = threading.Lock()
+
+    def count(self, texts: List[str]) -> List[int]:
+        if not texts:
+            return []
+        with self._lock:
+            ids = self.tokenizer(texts, add_special_tokens=False, verbose=False)["input_ids"]
+        return [len(i) for i in ids]
+
+    def _units(self, text: str, budget: int) -> List[Tuple[int, int, int]]:
+        """(시작, 끝, 토큰 수) 단위 목록. 문장 단위로 나누고 한도를 넘는 문장은 단어 경계에서 자름"""
+        bounds = [0] + [m.end() for m in _SENTENCE_BOUNDARY.finditer(text)] + [len(text)]
+        spans = [(s, e) for s, e in zip(bounds, bounds[1:]) if text[s:e].strip()]
+        units = []
+        for (start, end), n in zip(spans, self.count([text[s:e] for s, e in spans])):
+            if n <= budget:
+                units.append((start, end, n))
+            else:
+                units.extend(self._split_long(text, start, end, budget))
+        return units
+
+    def _split_long(self, text: str, start: int, end: int, budget: int) -> List[Tuple[int, int, int]]:
+        """한도를 넘는 문장을 단어가 시작하는 토큰 위치에서 자름 (##로 이어지는 하위 단어 앞에서는 자르지 않음)
+
+        잘라낸 조각은 토크나이저로 다시 세고, 그래도 넘으면 다시 자름. 한 단어가 한도보다 길 때만 단어 안에서 자름
+        """
+        with self._lock:
+            encoding = self.tokenizer(text[start:end], add_special_tokens=False, verbose=False,
+                                      return_offsets_mapping=True)
+        offsets, words = encoding["offset_mapping"], encoding.word_ids()
+        word_starts = [i for i in range(1, len(offsets)) if words[i] is None or words[i] != words[i - 1]]
+        cuts = [0]
+        while len(offsets) - cuts[-1] > budget:
+            limit = cuts[-1] + budget
+            cuts.append(max((i for i in word_starts if cuts[-1] < i <= limit), default=limit))
+        spans = [(start + offsets[c][0] if c else start, start + offsets[cuts[j + 1]][0] if j + 1 < len(cuts) else end)
+                 for j, c in enumerate(cuts)]
+        units = []
+        for (s, e), n in zip(spans, self.count([text[s:e] for s, e in spans])):
+            if n > budget and (s, e) != (start, end):
+                units.extend(self._split_long(text, s, e, budget))
+            else:
+                units.append((s, e, n))
+        return units
+
+    def split(self, text: str, reserved: int = 0) -> Tuple[List[str], int]:
+        """text를 (청크 목록, 겹쳐 넣은 토큰 수)로 분할. reserved는 청크 앞에 붙일 머리말의 토큰 수"""
+        chunks, _, overlap_tokens = self.split_counted(text, reserved)
+        return chunks, overlap_tokens
+
+    def split_counted(self, text: str, reserved: int = 0) -> Tuple[List[str], List[int], int]:
+        """split과 같지만 청크별 토큰 수도 돌려줌 (마지막 검사에서 센 값이라 다시 토큰화할 필요 없음)"""
+        budget = max(1, self.budget - reserved)
+        chunks, overlap_tokens = [], 0
+        current, current_tokens = [], 0
+        for unit in self._units(text, budget):
+            if current and current_tokens + unit[2] > budget:
+                chunks.append(text[current[0][0]:current[-1][1]].strip())
+                # 다음 청크 앞에 직전 문장을 overlap 토큰 한도 안에서 이어 붙임 (기본 0: 중복 임베딩 없음)
+                kept, kept_tokens = [], 0
+                for prev in reversed(current):
+                    if kept_tokens + prev[2] > self.overlap or kept_tokens + prev[2] + unit[2] > budget:
+                        break
+                    kept.insert(0, prev)
+                    kept_tokens += prev[2]
+                current, current_tokens = kept, kept_tokens
+                overlap_tokens += kept_tokens
+            current.append(unit)
+            current_tokens += unit[2]
+        if current:
+            chunks.append(text[current[0][0]:current[-1][1]].strip())
+        # 문장별 토큰 수의 합과 이어 붙인 청크의 토큰 수가 다를 수 있으므로 (경계 토큰) 다시 세서 넘치면 다시 나눔
+        fitted, counts = [], []
+        for chunk, n in zip(chunks, self.count(chunks)):
+            if n <= budget or budget == 1:
+                fitted.append(chunk)
+                counts.append(n)
+            else:
+                sub_chunks, sub_counts, _ = self.split_counted(chunk, reserved + n - budget)
+                fitted.extend(sub_chunks)
+                counts.extend(sub_counts)
+        return fitted, counts, overlap_tokens
+
 
 class PDFProcessor:
     def __init__(self):
@@ -12,6 +186,21 @@ class PDFProcessor:
             chunk_overlap=Config.CHUNK_OVERLAP,
             separators=["\n\n", "\n", " ", ""],
         )
+        self.mode = Config.CHUNK_MODE
+        self._chunker: Optional[TokenChunker] = None
+        self._chunker_failed = False
+        self._chunker_lock = threading.Lock()
+
+    def _get_chunker(self) -> Optional[TokenChunker]:
+        """토크나이저는 첫 분할 때 로드. 실패하면 글자 수 기준으로 분할하고 토큰 통계는 생략"""
+        with self._chunker_lock:
+            if self._chunker is None and not self._chunker_failed:
+                try:
+                    self._chunker = TokenChunker()
+                except Exception as e:
+                    print(f"임베딩 토크나이저를 불러오지 못해 글자 수 기준으로 분할합니다: {e}")
+                    self._chunker_failed = True
+            return self._chunker
 
     def _valid(self, file) -> bool:
         if file.size > Config.MAX_FILE_SIZE_MB * 1024 * 1024:
@@ -20,27 +209,130 @@ class PDFProcessor:
             return False
         return True
 
-    def _extract_text(self, file) -> Optional[str]:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(file.getvalue())
-            path = tmp.name
-        try:
-            reader = PdfReader(path)
-            text = ""
+    def _page_ranges(self, num_pages: int, workers: int) -> List[Tuple[int, int]]:
+        # 워커당 연속 구간 하나 (워커마다 PDF를 한 번만 파싱하므로 구간을 잘게 나눌 이유가 없음)
+        step = max(1, -(-num_pages // workers))
+        return [(s, min(s + step, num_pages)) for s in range(0, num_pages, step)]
+
+    def iter_pages(self, file) -> Iterator[Tuple[int, str]]:
+        """업로드 버퍼에서 바로 (페이지 번호, 텍스트)를 순서대로 생성 (임시 파일 없음)"""
+        data = file.getvalue()
+        reader = PdfReader(BytesIO(data))
+        num_pages = len(reader.pages)
+        workers = min(Config.PDF_EXTRACT_WORKERS, num_pages)
+        # 워커로 PDF를 보내 다시 파싱하는 비용이 있어 페이지가 아주 많거나 파일이 클 때만 병렬 추출
+        if workers <= 1 or (num_pages < Config.PDF_PARALLEL_MIN_PAGES
+                            and len(data) < Config.PDF_PARALLEL_MIN_MB * 1024 * 1024):
             for i, page in enumerate(reader.pages, 1):
-                if (t := page.extract_text()):
-                    text += f"\n\n=== 페이지 {i} ===\n\n{t}"
-            return text if text.strip() else None
+                yield i, page.extract_text() or ""
+            return
+        ranges = self._page_ranges(num_pages, workers)
+        pool = get_extract_pool(Config.PDF_EXTRACT_WORKERS)
+        futures = [pool.submit(extract_page_range, data, s, e) for s, e in ranges]
+        try:
+            # ✅ 제출 순서대로 결과를 꺼내므로 페이지 순서가 유지됨
+            for future in futures:
+                yield from future.result()
         finally:
-            os.unlink(path)
+            # 중간에 읽기를 멈추면 아직 시작하지 않은 구간은 취소 (풀은 다음 파일이 재사용)
+            for future in futures:
+                future.cancel()
 
-    def process(self, file) -> Optional[List[Document]]:
+    def iter_clean_pages(self, file, stats: Optional[Dict] = None) -> Iterator[Tuple[int, str, str]]:
+        """(페이지 번호, 원문, 머리말/꼬리말을 뺀 본문)을 순서대로 생성
+
+        앞쪽 BOILERPLATE_SAMPLE_PAGES 페이지만 모아서 반복 줄을 찾고, 나머지 페이지는 그대로 흘려보냄.
+        """
+        stats = stats if stats is not None else {}
+        pages = self.iter_pages(file)
+        if not Config.BOILERPLATE_STRIP:
+            for page_no, text in pages:
+                yield page_no, text, text.strip()
+            return
+        sample = []
+        for page_no, text in pages:
+            sample.append((page_no, text))
+            if len(sample) >= Config.BOILERPLATE_SAMPLE_PAGES:
+                break
+        boilerplate = detect_boilerplate(sample)
+        stats["boilerplate_lines"] = sorted(boilerplate)
+        for page_no, text in chain(sample, pages):
+            yield page_no, text, strip_boilerplate(text, boilerplate, page_no)
+
+    @staticmethod
+    def new_stats(mode: str) -> Dict:
+        return {"mode": mode, "chunks": 0, "tokens": 0, "max_tokens": None,
+                "truncated_chunks": 0, "truncated_tokens": 0, "overlap_tokens": 0,
+                "boilerplate_lines": [], "chars_saved": 0, "chunks_saved": 0}
+
+    def _split_page(self, text: str, stats: Optional[Dict] = None) -> Tuple[List[str], Optional[List[int]]]:
+        """(청크 목록, 청크별 토큰 수). 토큰 수는 tokens 방식에서만 (분할하면서 센 값)"""
+        chunker = self._get_chunker()
+        if self.mode == "tokens" and chunker:
+            parts, counts, overlap_tokens = chunker.split_counted(text)
+            if stats is not None:
+                stats["overlap_tokens"] += overlap_tokens
+            return parts, counts
+        return self.splitter.split_text(text), None
+
+    def _record(self, contents: List[str], counts: Optional[List[int]], stats: Dict):
+        stats["chunks"] += len(contents)
+        chunker = self._get_chunker()
+        if not chunker:
+            return
+        # 임베딩 모델이 실제로 버리는 토큰 (최대 입력 길이를 넘는 부분). chars 방식만 여기서 토큰화
+        stats["max_tokens"] = chunker.limit
+        for n in counts if counts is not None else chunker.count(contents):
+            stats["tokens"] += n
+            if n > chunker.limit:
+                stats["truncated_chunks"] += 1
+                stats["truncated_tokens"] += n - chunker.limit
+
+    def iter_chunks(self, file, stats: Optional[Dict] = None) -> Iterator[Document]:
+        """페이지 단위로 분할해 청크를 하나씩 생성 (전체 텍스트를 메모리에 모으지 않음)
+
+        반복되는 머리말/꼬리말과 쪽 번호는 본문에서 빼고, 쪽 번호는 metadata["page"]로만 남김.
+        stats를 넘기면 생성하면서 청크/토큰 수, 임베딩 시 잘리는 토큰 수, 제거로 줄어든 글자/청크 수를 채움 (new_stats 참고).
+        줄어든 청크 수는 다시 분할하지 않고 줄어든 글자 수를 청크당 평균 글자 수로 나눈 추정치.
+        """
+        stats = stats if stats is not None else {}
+        stats.update(self.new_stats(self.mode if self._get_chunker() else "chars"))
+        chunk_id = chunk_chars = 0
+        for page_no, raw, text in self.iter_clean_pages(file, stats):
+            if raw.strip():
+                # 이전 방식(페이지 표시 줄 + 원문)과 비교한 글자 수
+                stats["chars_saved"] += len(f"=== 페이지 {page_no} ===\n\n") + len(raw) - len(text)
+            if not text:
+                continue
+            contents, counts = self._split_page(text, stats)
+            self._record(contents, counts, stats)
+            chunk_chars += sum(len(c) for c in contents)
+            if chunk_chars:
+                stats["chunks_saved"] = round(stats["chars_saved"] * stats["chunks"] / chunk_chars)
+            for content in contents:
+                yield Document(page_content=content,
+                               metadata={"source": file.name, "page": page_no, "chunk_id": chunk_id})
+                chunk_id += 1
+
+    def iter_batches(self, file, batch_size: int = None, stats: Optional[Dict] = None) -> Optional[Iterator[List[Document]]]:
+        """임베딩 배치 단위로 청크 묶음을 생성. 유효하지 않은 파일이면 None"""
         if not self._valid(file):
             return None
-        if not (text := self._extract_text(file)):
+        return self._batched(self.iter_chunks(file, stats), batch_size or Config.EMBED_BATCH_SIZE)
+
+    @staticmethod
+    def _batched(chunks: Iterator[Document], size: int) -> Iterator[List[Document]]:
+        batch = []
+        for c in chunks:
+            batch.append(c)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def process(self, file) -> Optional[List[Document]]:
+        if not self._valid(file):
             return None
-        doc = Document(page_content=text, metadata={"source": file.name})
-        chunks = self.splitter.split_documents([doc])
-        for idx, c in enumerate(chunks):
-            c.metadata.update(chunk_id=idx)
-        return chunks
+        chunks = list(self.iter_chunks(file))
+        return chunks or None
@@ -1,31 +1,16 @@
+import asyncio
 import json
-import random
 import re
-from typing import List, Optional, Union
+from typing import Callable, List, NamedTuple, Optional, Tuple, Union
 import streamlit as st
 from pydantic import BaseModel, Field
 from config import Config
-from vector_store import MultiSubjectVectorStoreManager
-from utils.web_tools import fetch_link_content
-
-# ✅ LLM 모델 자동 선택
-if Config.MODEL_TYPE == "openai":
-    from langchain.chat_models import ChatOpenAI
-    llm = ChatOpenAI(
-        openai_api_key=Config.OPENAI_API_KEY,
-        model_name=Config.LLM_MODEL(),
-        temperature=Config.TEMPERATURE
-    )
-elif Config.MODEL_TYPE == "claude":
-    from langchain_anthropic import ChatAnthropic
-    llm = ChatAnthropic(
-        anthropic_api_key=Config.ANTHROPIC_API_KEY,
-        model=Config.LLM_MODEL(),
-        temperature=0.3,
-        max_tokens=1500
-    )
-else:
-    raise ValueError("지원하지 않는 MODEL_TYPE입니다. (openai 또는 claude)")
+from vector_store import MultiSubjectVectorStoreManager, SearchHits
+from context_packer import get_context_packer
+from llm_gateway import get_gateway
+
+# ✅ LLM 호출은 공용 게이트웨이로 (모델은 Config.MODEL_TYPE 기준, 실패 시 설정에 따라 다른 제공사로 대체)
+QUIZ_LLM_OPTIONS = {"temperature": Config.TEMPERATURE, "max_tokens": 1500}
 
 # ----- Quiz 데이터 모델 -----
 class Quiz(BaseModel):
@@ -36,31 +21,56 @@ class Quiz(BaseModel):
     explanation: str
     subject: str
 
+class QuizBatch(NamedTuple):
+    """비동기 퀴즈 생성 결과. warnings는 건너뛴 문제 등 화면에 보여줄 경고 (스크립트 스레드에서 st.warning으로 표시)"""
+    quizzes: List[Quiz]
+    warnings: List[str]
+
+class QuizGenerationError(Exception):
+    """비동기 퀴즈 생성 실패 (raw에는 파싱하지 못한 LLM 응답)"""
+
+    def __init__(self, message: str, raw: str = ""):
+        super().__init__(message)
+        self.raw = raw
+
+
 # ----- MultiSubjectQuizGen -----
 class MultiSubjectQuizGen:
     def __init__(self, vs_manager: Optional[MultiSubjectVectorStoreManager]):
         self.vs_manager = vs_manager
-        self.llm = llm
 
-    def _get_context(self, subject_name: str, topic: str = "", k: int = 8):
+    @property
+    def llm(self):
+        return get_gateway()
+
+    def _fetch_context(self, subject_name: str, topic: str = "", k: int = 8) -> Tuple[str, str]:
+        """(context, 자료가 없을 때의 경고 문구). Streamlit을 호출하지 않으므로 비동기 경로에서도 사용"""
         store = self.vs_manager.get_store(subject_name) if self.vs_manager else None
         if not store:
-            st.warning(f"{subject_name} 과목의 벡터 스토어가 없습니다. PDF 자료를 업로드하세요.")
-            return ""
+            return "", f"{subject_name} 과목의 벡터 스토어가 없습니다. PDF 자료를 업로드하세요."
         if topic:
-            docs = self.vs_manager.search(subject_name, topic, k)
+            # 주제 검색은 후보를 넉넉히 가져와 (저장된 청크 벡터로) MMR로 다양하게 고름
+            hits = self.vs_manager.search_hits(subject_name, topic, max(k, Config.CONTEXT_FETCH_K))
         else:
-            all_docs = list(store.docstore._dict.values())
-            if not all_docs:
-                st.warning(f"{subject_name} 과목에 자료가 없습니다. PDF를 업로드하세요.")
-                return ""
-            docs = random.sample(all_docs, min(k, len(all_docs)))
-        return "\n".join(d.page_content for d in docs)
-
-    def _safe_parse_json(self, raw: str):
-        """안전하게 JSON 문자열을 파싱"""
+            hits = SearchHits(self.vs_manager.sample_documents(subject_name, k), None, None)
+            if not hits.docs:
+                return "", f"{subject_name} 과목에 자료가 없습니다. PDF를 업로드하세요."
+        # 겹치는 구간을 빼고 모델 토큰 예산 안에서 최대 k개
+        packed = get_context_packer(self.vs_manager).pack(hits.docs, query=topic or None, k=k, separator="\n",
+                                                          vectors=hits.vectors, query_vector=hits.query_vector)
+        return packed.text, ""
+
+    def _get_context(self, subject_name: str, topic: str = "", k: int = 8):
+        ctx, warning = self._fetch_context(subject_name, topic, k)
+        if warning:
+            st.warning(warning)
+        return ctx
+
+    def _safe_parse_json(self, raw: str, report: bool = True):
+        """안전하게 JSON 문자열을 파싱 (report=False면 화면에 오류를 표시하지 않고 None만 반환)"""
         if not raw:
-            st.error("빈 RAW 데이터가 입력되었습니다.")
+            if report:
+                st.error("빈 RAW 데이터가 입력되었습니다.")
             return None
         
         # 코드 블록 제거 (```json 또는 ```)
@@ -70,12 +80,14 @@ class MultiSubjectQuizGen:
         try:
             parsed = json.loads(raw)
             if not isinstance(parsed, list):
-                st.error(f"파싱된 데이터가 리스트 형식이 아닙니다. 원본 데이터: {raw}")
+                if report:
+                    st.error(f"파싱된 데이터가 리스트 형식이 아닙니다. 원본 데이터: {raw}")
                 return None
             return parsed
         except json.JSONDecodeError as e:
-            st.error(f"JSON 파싱 실패: {str(e)}")
-            st.write("🔎 **원본 RAW 데이터 (디버그용)**:", raw)
+            if report:
+                st.error(f"JSON 파싱 실패: {str(e)}")
+                st.write("🔎 **원본 RAW 데이터 (디버그용)**:", raw)
             return None
 
     def _get_difficulty_guideline(self, difficulty: str) -> str:
@@ -87,26 +99,60 @@ class MultiSubjectQuizGen:
             return "어려운 난이도: 추론과 종합적 사고가 필요한 문제."
         return "일반 난이도: 균형 있게 출제."
 
-    def _normalize_options(self, options):
+    def _normalize_options(self, options, warn: Callable = st.write):
         """옵션을 문자열 리스트로 강제 변환"""
         if isinstance(options, dict):
-            st.write("🔎 **options가 딕셔너리 형태로 입력됨**: ", options)
+            warn("🔎 **options가 딕셔너리 형태로 입력됨**: ", options)
             return [str(options.get(str(i), options.get(i, ""))) for i in range(len(options))]
         elif isinstance(options, list):
             return [str(v) for v in options]
         else:
-            st.write("⚠️ **options가 예상치 못한 형태**: ", options)
+            warn("⚠️ **options가 예상치 못한 형태**: ", options)
             return []
 
-    def generate(self, subject_name: str, n=5, difficulty="보통", topic="", quiz_type="혼합"):
-        ctx = self._get_context(subject_name, topic)
-        if not ctx:
-            st.error(f"{subject_name} 과목의 자료가 없습니다. PDF를 업로드한 후 다시 시도하세요.")
-            return []
+    def _build_quizzes(self, data: list, subject_name: str, warn: Callable = st.write) -> List[Quiz]:
+        """LLM이 준 문제 목록을 검증해 Quiz로 변환 (형식이 맞지 않는 문제는 warn으로 알리고 건너뜀)"""
+        valid_quizzes = []
+        for q in data:
+            try:
+                if not isinstance(q, dict):
+                    warn(f"⚠️ 문제 형식이 딕셔너리가 아님: {q}")
+                    continue
+                q_type = q.get("type", "").lower()
+                question = str(q.get("question", "")).strip()
+                explanation = q.get("explanation") or "해설이 제공되지 않았습니다."
+                options = self._normalize_options(q.get("options", []), warn)
+                correct_answer = q.get("correct_answer")
+
+                # 객관식
+                if q_type == "multiple" and len(options) >= 2:
+                    if isinstance(correct_answer, str) and correct_answer in options:
+                        correct_answer = options.index(correct_answer)
+                    if isinstance(correct_answer, (int, float)) and 0 <= int(correct_answer) < len(options):
+                        valid_quizzes.append(
+                            Quiz(type=q_type, question=question, options=options,
+                                 correct_answer=correct_answer, explanation=explanation, subject=subject_name)
+                        )
+                # 주관식
+                elif q_type == "short" and isinstance(correct_answer, str):
+                    valid_quizzes.append(
+                        Quiz(type=q_type, question=question, options=[],
+                             correct_answer=correct_answer, explanation=explanation, subject=subject_name)
+                    )
+                # OX
+                elif q_type == "ox" and [opt.upper() for opt in options] == ["O", "X"] and correct_answer in [0, 1]:
+                    valid_quizzes.append(
+                        Quiz(type=q_type, question=question, options=options,
+                             correct_answer=correct_answer, explanation=explanation, subject=subject_name)
+                    )
+            except Exception as e:
+                warn(f"⚠️ 문제 검증 중 오류: {e}, 문제={q}")
+        return valid_quizzes
 
+    def _build_prompt(self, subject_name: str, n: int, difficulty: str, ctx: str) -> str:
         guideline = self._get_difficulty_guideline(difficulty)
 
-        prompt = f"""
+        return f"""
 너는 '{subject_name}' 과목의 강의자료 기반 퀴즈 생성기야.
 아래 context 내용을 참고하여 {n}개의 {difficulty} 난이도 퀴즈를 생성해.
 - 객관식은 보기(options)를 반드시 4개 포함하고 correct_answer는 보기의 인덱스(0~3)로 지정.
@@ -126,9 +172,17 @@ context:
 {ctx}
 """
 
+    def generate(self, subject_name: str, n=5, difficulty="보통", topic="", quiz_type="혼합"):
+        ctx = self._get_context(subject_name, topic)
+        if not ctx:
+            st.error(f"{subject_name} 과목의 자료가 없습니다. PDF를 업로드한 후 다시 시도하세요.")
+            return []
+
+        prompt = self._build_prompt(subject_name, n, difficulty, ctx)
+
         with st.spinner(f"{subject_name} {difficulty} 퀴즈 생성 중..."):
             try:
-                raw = self.llm.invoke(prompt).content.strip()
+                raw = self.llm.complete(prompt, **QUIZ_LLM_OPTIONS).content.strip()
             except Exception as e:
                 st.error(f"LLM 호출 실패: {str(e)}. API 키나 네트워크를 확인하세요.")
                 return []
@@ -140,46 +194,36 @@ context:
                 st.code(raw)
                 return []
 
-            valid_quizzes = []
-            for q in data:
-                try:
-                    if not isinstance(q, dict):
-                        st.write(f"⚠️ 문제 형식이 딕셔너리가 아님: {q}")
-                        continue
-                    q_type = q.get("type", "").lower()
-                    question = str(q.get("question", "")).strip()
-                    explanation = q.get("explanation") or "해설이 제공되지 않았습니다."
-                    options = self._normalize_options(q.get("options", []))
-                    correct_answer = q.get("correct_answer")
-
-                    # 객관식
-                    if q_type == "multiple" and len(options) >= 2:
-                        if isinstance(correct_answer, str) and correct_answer in options:
-                            correct_answer = options.index(correct_answer)
-                        if isinstance(correct_answer, (int, float)) and 0 <= int(correct_answer) < len(options):
-                            valid_quizzes.append(
-                                Quiz(type=q_type, question=question, options=options,
-                                     correct_answer=correct_answer, explanation=explanation, subject=subject_name)
-                            )
-                    # 주관식
-                    elif q_type == "short" and isinstance(correct_answer, str):
-                        valid_quizzes.append(
-                            Quiz(type=q_type, question=question, options=[],
-                                 correct_answer=correct_answer, explanation=explanation, subject=subject_name)
-                        )
-                    # OX
-                    elif q_type == "ox" and [opt.upper() for opt in options] == ["O", "X"] and correct_answer in [0, 1]:
-                        valid_quizzes.append(
-                            Quiz(type=q_type, question=question, options=options,
-                                 correct_answer=correct_answer, explanation=explanation, subject=subject_name)
-                        )
-                except Exception as e:
-                    st.write(f"⚠️ 문제 검증 중 오류: {e}, 문제={q}")
+            return self._build_quizzes(data, subject_name)
 
-            return valid_quizzes
+    async def agenerate(self, subject_name: str, n=5, difficulty="보통", topic="", quiz_type="혼합") -> QuizBatch:
+        """generate의 비동기 버전 (utils.async_runner의 공유 루프에서 실행)
+
+        자료 검색과 LLM 클라이언트 준비를 동시에 하고, LLM은 게이트웨이의 비동기 호출(acomplete)로 요청.
+        루프 스레드에서는 Streamlit을 쓸 수 없으므로 실패는 QuizGenerationError로, 건너뛴 문제 등 경고는
+        QuizBatch.warnings로 돌려줌 (호출한 스크립트 스레드에서 표시).
+        """
+        (ctx, warning), _ = await asyncio.gather(
+            asyncio.to_thread(self._fetch_context, subject_name, topic), self.llm.prepare())
+        if not ctx:
+            raise QuizGenerationError(warning or f"{subject_name} 과목의 자료가 없습니다. PDF를 업로드한 후 다시 시도하세요.")
+        prompt = self._build_prompt(subject_name, n, difficulty, ctx)
+        try:
+            raw = (await self.llm.acomplete(prompt, **QUIZ_LLM_OPTIONS)).content.strip()
+        except Exception as e:
+            raise QuizGenerationError(f"LLM 호출 실패: {str(e)}. API 키나 네트워크를 확인하세요.")
+        data = self._safe_parse_json(raw, report=False)
+        if not data:
+            raise QuizGenerationError("퀴즈 파싱 실패.", raw)
+        warnings: List[str] = []
+        quizzes = self._build_quizzes(data, subject_name,
+                                      warn=lambda *parts: warnings.append(" ".join(str(p) for p in parts)))
+        return QuizBatch(quizzes, warnings)
 
 # ===== 링크 기반 퀴즈 생성 =====
 def generate_quiz_from_link(url: str, n: int = 3):
+    from utils.web_tools import fetch_link_content
+
     content = fetch_link_content(url)
     if content.startswith("오류 발생"):
         st.error("링크 크롤링 실패.")
@@ -204,7 +248,7 @@ def generate_quiz_from_link(url: str, n: int = 3):
 {content}
 """
     try:
-        raw = llm.invoke(prompt).content.strip()
+        raw = get_gateway().complete(prompt, **QUIZ_LLM_OPTIONS).content.strip()
     except Exception as e:
         st.error(f"LLM 호출 실패: {str(e)}. API 키나 네트워크를 확인하세요.")
         return []
@@ -217,40 +261,4 @@ def generate_quiz_from_link(url: str, n: int = 3):
         st.code(raw)
         return []
 
-    valid_quizzes = []
-    for q in data:
-        try:
-            if not isinstance(q, dict):
-                st.write(f"⚠️ 문제 형식이 딕셔너리가 아님: {q}")
-                continue
-            q_type = q.get("type", "").lower()
-            question = str(q.get("question", "")).strip()
-            explanation = q.get("explanation") or "해설이 제공되지 않았습니다."
-            options = generator._normalize_options(q.get("options", []))
-            correct_answer = q.get("correct_answer")
-
-            # 객관식
-            if q_type == "multiple" and len(options) >= 2:
-                if isinstance(correct_answer, str) and correct_answer in options:
-                    correct_answer = options.index(correct_answer)
-                if isinstance(correct_answer, (int, float)) and 0 <= int(correct_answer) < len(options):
-                    valid_quizzes.append(
-                        Quiz(type=q_type, question=question, options=options,
-                             correct_answer=correct_answer, explanation=explanation, subject="링크퀴즈")
-                    )
-            # 주관식
-            elif q_type == "short" and isinstance(correct_answer, str):
-                valid_quizzes.append(
-                    Quiz(type=q_type, question=question, options=[],
-                         correct_answer=correct_answer, explanation=explanation, subject="링크퀴즈")
-                )
-            # OX
-            elif q_type == "ox" and [opt.upper() for opt in options] == ["O", "X"] and correct_answer in [0, 1]:
-                valid_quizzes.append(
-                    Quiz(type=q_type, question=question, options=options,
-                         correct_answer=correct_answer, explanation=explanation, subject="링크퀴즈")
-                )
-        except Exception as e:
-            st.write(f"⚠️ 문제 검증 중 오류: {e}, 문제={q}")
-
-    return valid_quizzes
+    return generator._build_quizzes(data, "링크퀴즈")
@@ -0,0 +1,55 @@
+import os
+import hashlib
+from typing import Dict, List, Union
+from config import Config
+
+# ===========================
+# 과목 폴더를 디스크에서 바로 읽는 가벼운 함수 (LangChain·FAISS를 import하지 않음)
+# 앱 첫 화면(과목 목록/문서 수)과 업로드 해시 계산은 이것만 쓰고, 색인 관리자(vector_store)는
+# 처음 검색/업로드할 때 불러옴
+# ===========================
+
+# 색인이 있는 과목의 표시: 세그먼트 포인터(SubjectIndex.STATE_FILE) 또는 이전 형식의 단일 색인
+INDEX_FILES = ("segments.json", "index.faiss")
+
+
+def content_hash(data: Union[bytes, str]) -> str:
+    """파일 바이트 또는 청크 텍스트의 SHA-256 해시"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def subject_path(subject_name: str) -> str:
+    # 한글/특수문자 → 안전한 폴더명으로 변환
+    # safe_name = re.sub(r'[^a-zA-Z0-9_-]', '_', subject_name)
+    # return os.path.join(Config.FAISS_BASE_PATH, safe_name)
+    return os.path.join(Config.FAISS_BASE_PATH, subject_name)
+
+
+def list_subjects() -> List[str]:
+    if not os.path.exists(Config.FAISS_BASE_PATH):
+        return []
+    return [
+        d for d in os.listdir(Config.FAISS_BASE_PATH)
+        # "."으로 시작하는 폴더는 과목이 아님 (락 파일 폴더 .locks 등)
+        if d.strip() and not d.startswith(".") and os.path.isdir(os.path.join(Config.FAISS_BASE_PATH, d))
+    ]
+
+
+def has_index(subject_name: str) -> bool:
+    path = subject_path(subject_name)
+    return any(os.path.exists(os.path.join(path, fn)) for fn in INDEX_FILES)
+
+
+def subject_info(subject_name: str, loaded: bool = False) -> Dict:
+    """과목 상태와 PDF 파일 수 (색인 로드 없이 디스크 상태만으로 판단, loaded는 이미 메모리에 올린 과목)"""
+    meta_file = os.path.join(subject_path(subject_name), "pdf_files.txt")
+    pdf_file_count = 0
+    if os.path.exists(meta_file):
+        with open(meta_file, "r", encoding="utf-8") as f:
+            pdf_file_count = len([line.strip() for line in f if line.strip()])
+    return {
+        "status": "활성화됨" if loaded or has_index(subject_name) else "초기화되지 않음",
+        "문서 수": pdf_file_count  # ✅ PDF 파일 수만 표시
+    }
@@ -0,0 +1,962 @@
+import os, shutil
+import json
+import hashlib
+import threading
+import copy
+import mmap
+import random
+import uuid
+from contextlib import contextmanager
+from typing import Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
+from config import Config
+from utils.filelock import FileLock
+
+
+def chunk_key(text: str) -> str:
+    """청크 텍스트의 SHA-256 (manifest의 청크 해시와 같은 값). 파일 삭제 시 벡터 행을 찾는 키"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def build_ann_index(vectors: np.ndarray, index_type: str) -> faiss.Index:
+    """근사 최근접 색인 생성 (L2 거리 그대로라 다른 세그먼트의 정확 검색 점수와 합칠 수 있음)"""
+    n, d = vectors.shape
+    if index_type == "ivf":
+        nlist = max(1, min(int(4 * np.sqrt(n)), n // 39))
+        index = faiss.index_factory(d, f"IVF{nlist},Flat", faiss.METRIC_L2)
+        train = vectors if n <= nlist * 256 else vectors[np.random.choice(n, nlist * 256, replace=False)]
+        index.train(np.ascontiguousarray(train))
+    else:
+        index = faiss.IndexHNSWFlat(d, 32)
+        index.hnsw.efConstruction = 80
+    for start in range(0, n, 65536):
+        index.add(np.ascontiguousarray(vectors[start:start + 65536]))
+    _set_search_params(index)
+    return index
+
+
+def _set_search_params(index: faiss.Index):
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = Config.ANN_HNSW_EF_SEARCH
+    else:
+        faiss.extract_index_ivf(index).nprobe = Config.ANN_IVF_NPROBE
+
+
+COMPRESSION_MODES = ("none", "fp16", "int8", "pq")
+
+
+def build_codes(vectors: np.ndarray, mode: str) -> Optional[faiss.Index]:
+    """압축 벡터 색인 생성 (fp16/int8 스칼라 양자화 또는 PQ). 학습 데이터가 부족하면 None (정확 검색 유지)"""
+    n, d = vectors.shape
+    if mode == "fp16":
+        key = "SQfp16"
+    elif mode == "int8":
+        key = "SQ8"
+    elif mode == "pq":
+        # PQ 코드북(256개 중심) 학습에 충분한 벡터(faiss 권장 39배)가 없으면 압축하지 않음
+        if n < 256 * 39:
+            return None
+        m = next(m for m in range(max(1, d // 8), 0, -1) if d % m == 0)
+        key = f"PQ{m}x8"
+    else:
+        return None
+    index = faiss.index_factory(d, key, faiss.METRIC_L2)
+    if not index.is_trained:
+        train = vectors if n <= 65536 else vectors[np.sort(np.random.choice(n, 65536, replace=False))]
+        index.train(np.ascontiguousarray(train))
+    for start in range(0, n, 65536):
+        index.add(np.ascontiguousarray(vectors[start:start + 65536]))
+    return index
+
+
+def rerank_search(codes: faiss.Index, vectors: np.ndarray, queries: np.ndarray, k: int):
+    """압축 색인으로 k * RERANK_FACTOR 후보를 뽑고, 후보 행만 원본 벡터(메모리 매핑)에서 읽어 정확한 L2로 재정렬"""
+    n = vectors.shape[0]
+    _, candidates = codes.search(queries, min(n, k * Config.RERANK_FACTOR))
+    distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+    ids = np.full((len(queries), k), -1, dtype=np.int64)
+    for row, cand in enumerate(candidates):
+        cand = np.sort(cand[cand >= 0])  # 디스크 순서대로 읽도록 정렬
+        exact = ((np.asarray(vectors[cand]) - queries[row]) ** 2).sum(axis=1)
+        top = np.argsort(exact)[:k]
+        distances[row, :len(top)] = exact[top]
+        ids[row, :len(top)] = cand[top]
+    return distances, ids
+
+
+def measure_recall(search, vectors: np.ndarray, k: int = 10, n_queries: int = None) -> float:
+    """정확 검색(faiss.knn) 대비 recall@k. search(queries, k) -> (D, I)
+
+    질의는 임의 벡터 두 개의 중점으로 만들어 실제 질문처럼 점 사이에 둠"""
+    n = vectors.shape[0]
+    n_queries = n_queries or Config.ANN_RECALL_SAMPLES
+    a = np.random.randint(0, n, n_queries)
+    b = np.random.randint(0, n, n_queries)
+    queries = ((np.asarray(vectors[a]) + np.asarray(vectors[b])) / 2).astype(np.float32)
+    k = min(k, n)
+    _, exact = faiss.knn(queries, vectors, k)
+    _, approx = search(queries, k)
+    found = sum(len(set(e) & set(r)) for e, r in zip(exact.tolist(), approx.tolist()))
+    return found / float(exact.size)
+
+
+def search_live(seg, queries: np.ndarray, k: int) -> List[List[Tuple[float, int]]]:
+    """세그먼트에서 tombstone 행을 뺀 질의별 상위 k개 [(거리, 행)]
+
+    삭제 행 수만큼 더 가져오지 않고 k의 두 배만 가져온 뒤, k개가 안 남은 질의만 4배씩 늘려 다시 검색
+    (삭제 행이 많아도 모든 질의가 그만큼 더 가져오는 비용을 내지 않음). k + 삭제 행 수가 상한
+    """
+    deleted = seg.deleted
+    bound = min(len(seg), k + len(deleted))  # 정확 검색은 이만큼 가져오면 항상 k개가 남음
+    fetch = min(bound, k * 2 if deleted else k)
+    rows: List[List[Tuple[float, int]]] = [[] for _ in range(len(queries))]
+    todo = list(range(len(queries)))
+    while todo:
+        distances, ids = seg.search(queries[todo], fetch)
+        short = []
+        for q, row_d, row_i in zip(todo, distances, ids):
+            live = [(float(dist), int(i)) for dist, i in zip(row_d, row_i) if i >= 0 and int(i) not in deleted]
+            if len(live) < k and fetch < bound:
+                short.append(q)
+            else:
+                rows[q] = live[:k]
+        todo, fetch = short, min(bound, fetch * 4)
+    return rows
+
+
+class Segment:
+    """디스크의 읽기 전용 세그먼트 (pickle 없음)
+
+    - vectors.npy: float32 벡터 (메모리 매핑, 여러 워커 프로세스가 OS 페이지 캐시를 공유)
+    - chunks.jsonl: 청크 텍스트/메타데이터 한 줄씩
+    - offsets.npy: chunks.jsonl의 바이트 오프셋 (n+1개) → 검색된 청크만 읽음
+    - keys.npy: 행별 청크 해시 (파일 삭제 시 지울 행을 찾음)
+    세그먼트 파일은 바뀌지 않고, 삭제된 행(deleted)은 segments.json에 tombstone으로 기록.
+    검색은 락 없이 진행되므로 속성은 제자리에서 고치지 않고 새 객체로 교체함 (deleted는 frozenset)
+    나중에 붙는 ANN 색인(ann.json/ann.faiss)과 압축 코드(codes.json/codes.faiss)는 index_stamp로 바뀜을 확인해
+    다른 프로세스가 만든 것도 refresh에서 다시 읽음
+    """
+
+    INDEX_INFO_FILES = ("ann.json", "codes.json")
+
+    def __init__(self, path: str):
+        self.path = path
+        # 색인 파일을 읽기 전에 기록 (읽는 도중 바뀌면 다음 refresh에서 다시 읽음)
+        self.index_stamp = self.read_index_stamp()
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self._file = open(os.path.join(path, "chunks.jsonl"), "rb")
+        self._chunks = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.ann: Optional[faiss.Index] = None
+        self.ann_info: Optional[dict] = None
+        self.codes: Optional[faiss.Index] = None
+        self.codes_info: Optional[dict] = None
+        self.deleted: FrozenSet[int] = frozenset()
+        self._keys: Optional[np.ndarray] = None
+        self._sorted_keys: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        if os.path.exists(os.path.join(path, "codes.json")):
+            with open(os.path.join(path, "codes.json"), "r", encoding="utf-8") as f:
+                self.codes_info = json.load(f)
+            self.codes = faiss.read_index(os.path.join(path, "codes.faiss"))
+        info_path = os.path.join(path, "ann.json")
+        if os.path.exists(info_path):
+            with open(info_path, "r", encoding="utf-8") as f:
+                self.ann_info = json.load(f)
+            if self.ann_info.get("accepted"):
+                self.ann = faiss.read_index(os.path.join(path, "ann.faiss"))
+                _set_search_params(self.ann)
+
+    def read_index_stamp(self) -> Tuple:
+        """ann.json/codes.json의 (mtime, 크기). 없으면 None"""
+        stamps = []
+        for fn in self.INDEX_INFO_FILES:
+            try:
+                st = os.stat(os.path.join(self.path, fn))
+                stamps.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    @staticmethod
+    def _replace_file(path: str, write):
+        """같은 폴더의 고유한 임시 파일에 쓴 뒤 이름을 바꿈 (여러 프로세스가 같은 세그먼트에 써도 임시 파일이 겹치지 않음)"""
+        tmp_path = f"{path}.tmp_{uuid.uuid4().hex}"
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @classmethod
+    def _write_json(cls, path: str, info: dict):
+        def write(tmp_path):
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(info, f)
+        cls._replace_file(path, write)
+
+    @staticmethod
+    def write(path: str, vectors: np.ndarray, docs: List[Document], compression: str = "none"):
+        """임시 폴더에 쓴 뒤 이름을 바꿔, 반쯤 쓰인 세그먼트가 보이지 않게 함"""
+        tmp_path = f"{path}.tmp_{uuid.uuid4().hex}"
+        os.makedirs(tmp_path)
+        offsets = [0]
+        with open(os.path.join(tmp_path, "chunks.jsonl"), "wb") as f:
+            for d in docs:
+                line = json.dumps({"text": d.page_content, "metadata": d.metadata}, ensure_ascii=False)
+                data = line.encode("utf-8") + b"\n"
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        np.save(os.path.join(tmp_path, "vectors.npy"), np.ascontiguousarray(vectors, dtype=np.float32))
+        np.save(os.path.join(tmp_path, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        np.save(os.path.join(tmp_path, "keys.npy"), np.asarray([chunk_key(d.page_content) for d in docs], dtype="S64"))
+        Segment.write_codes(tmp_path, vectors, compression)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def write_codes(path: str, vectors: np.ndarray, mode: str) -> Optional[dict]:
+        """압축 색인(codes.faiss)과 정보(codes.json) 저장. 압축하지 않으면 기존 파일 제거 후 None"""
+        codes = build_codes(np.asarray(vectors, dtype=np.float32), mode)
+        if codes is None:
+            for fn in ("codes.json", "codes.faiss"):
+                if os.path.exists(os.path.join(path, fn)):
+                    os.remove(os.path.join(path, fn))
+            return None
+        Segment._replace_file(os.path.join(path, "codes.faiss"), lambda tmp_path: faiss.write_index(codes, tmp_path))
+        info = {"mode": mode, "bytes": os.path.getsize(os.path.join(path, "codes.faiss"))}
+        Segment._write_json(os.path.join(path, "codes.json"), info)
+        return {**info, "index": codes}
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def keys(self) -> np.ndarray:
+        if self._keys is None:
+            key_path = os.path.join(self.path, "keys.npy")
+            if os.path.exists(key_path):
+                self._keys = np.load(key_path, mmap_mode="r")
+            else:
+                # keys.npy 도입 이전 세그먼트는 청크 텍스트로 한 번 계산
+                self._keys = np.asarray([chunk_key(self.document(i).page_content) for i in range(len(self))],
+                                        dtype="S64")
+        return self._keys
+
+    def sorted_keys(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(정렬한 청크 해시, 각 해시의 행 번호). 세그먼트는 불변이므로 한 번만 정렬해 두고 이진 탐색에 사용"""
+        if self._sorted_keys is None:
+            keys = np.asarray(self.keys)
+            order = np.argsort(keys, kind="stable")
+            self._sorted_keys = (keys[order], order)
+        return self._sorted_keys
+
+    def with_deleted(self, deleted: FrozenSet[int]) -> "Segment":
+        """tombstone만 다른 새 객체 (파일 매핑과 색인은 공유). 발행된 스냅샷의 세그먼트는 고치지 않고 이것으로 교체"""
+        if deleted == self.deleted:
+            return self
+        seg = copy.copy(self)
+        seg.deleted = frozenset(deleted)
+        return seg
+
+    def live_vectors(self) -> np.ndarray:
+        if not self.deleted:
+            return self.vectors
+        return np.delete(np.asarray(self.vectors), sorted(self.deleted), axis=0)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, len(self))
+        # 압축/ANN 색인은 다른 스레드가 교체할 수 있어 한 번만 읽음
+        codes, ann = self.codes, self.ann
+        if codes is not None:
+            return rerank_search(codes, self.vectors, queries, k)
+        if ann is not None:
+            return ann.search(queries, k)
+        return faiss.knn(queries, self.vectors, k)
+
+    def attach_codes(self, info: Optional[dict]):
+        codes = info.pop("index") if info else None
+        # 정보를 먼저 바꿔 codes가 있는데 codes_info가 없는 순간이 없도록 함
+        if codes is not None:
+            self.codes_info = info
+            self.codes = codes
+        else:
+            self.codes = None
+            self.codes_info = info
+        self.index_stamp = self.read_index_stamp()
+
+    def build_ann(self, index_type: str) -> dict:
+        """ANN 색인을 만들고 recall 검사를 통과할 때만 ann.faiss로 저장. 결과는 ann.json에 기록해 재시도하지 않음
+        (과목 병합 락 compaction() 안에서 호출, 교체는 SubjectIndex.attach_ann에서)"""
+        index = build_ann_index(self.vectors, index_type)
+        recall = measure_recall(index.search, self.vectors)
+        info = {"type": index_type, "ntotal": len(self), "recall": round(recall, 4),
+                "accepted": recall >= Config.ANN_MIN_RECALL}
+        if info["accepted"]:
+            self._replace_file(os.path.join(self.path, "ann.faiss"), lambda tmp_path: faiss.write_index(index, tmp_path))
+        self._write_json(os.path.join(self.path, "ann.json"), info)
+        info["index"] = index if info["accepted"] else None
+        return info
+
+    def attach_ann(self, info: dict):
+        ann = info.pop("index")
+        self.ann_info = info
+        self.ann = ann
+        self.index_stamp = self.read_index_stamp()
+
+    def document(self, i: int) -> Document:
+        raw = json.loads(self._chunks[int(self.offsets[i]):int(self.offsets[i + 1])])
+        return Document(page_content=raw["text"], metadata=raw["metadata"])
+
+    def documents(self) -> Iterator[Document]:
+        for i in range(len(self)):
+            if i not in self.deleted:
+                yield self.document(i)
+
+    def resident_bytes(self) -> int:
+        # 검색이 건드리는 벡터(정확 검색), 압축 코드(원본은 재정렬 후보 행만 읽음) 또는 ANN 색인을 상주 메모리로 봄
+        codes_info = self.codes_info
+        if self.codes is not None and codes_info:
+            return codes_info["bytes"] + self.offsets.nbytes
+        if self.ann is not None:
+            return self.vectors.nbytes + len(self) * 64 * 4 + self.offsets.nbytes
+        return self.vectors.nbytes + self.offsets.nbytes
+
+
+
+class MemorySegment:
+    """적재 중인(아직 flush 전) 세그먼트. 추가 즉시 검색 가능 (적재 작업마다 하나)
+
+    검색 중인 스레드가 보는 객체는 바뀌지 않도록, 추가할 때마다 새 MemorySegment를 만들어 교체함.
+    적재 작업이 INGEST_FLUSH_ROWS마다 세그먼트로 기록하고 비우므로 복사하는 양은 그 크기를 넘지 않음
+    """
+
+    deleted: FrozenSet[int] = frozenset()  # flush 전에는 삭제하지 않으므로 항상 비어 있음
+
+    def __init__(self, vectors: np.ndarray = None, docs: List[Document] = None):
+        self.vectors = vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+        self.docs: List[Document] = docs or []
+
+    def extended(self, vectors: np.ndarray, docs: List[Document]) -> "MemorySegment":
+        if not self.docs:
+            return MemorySegment(vectors, list(docs))
+        return MemorySegment(np.vstack([self.vectors, vectors]), self.docs + list(docs))
+
+    def without_keys(self, keys: FrozenSet[str]) -> "MemorySegment":
+        """청크 해시가 keys에 있는 행을 뺀 사본 (그 사이 다른 적재가 먼저 기록한 청크)"""
+        rows = [i for i, d in enumerate(self.docs) if chunk_key(d.page_content) not in keys]
+        if len(rows) == len(self.docs):
+            return self
+        return MemorySegment(self.vectors[rows], [self.docs[i] for i in rows])
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return faiss.knn(queries, self.vectors, min(k, len(self)))
+
+    def document(self, i: int) -> Document:
+        return self.docs[i]
+
+    def documents(self) -> Iterator[Document]:
+        return iter(self.docs)
+
+    def resident_bytes(self) -> int:
+        return self.vectors.nbytes + sum(len(d.page_content.encode("utf-8")) for d in self.docs)
+
+
+class Snapshot(NamedTuple):
+    """검색 한 번이 통째로 읽는 과목 상태 (버전, 디스크 세그먼트, 적재 작업별 tail). 쓰기는 새 Snapshot으로 교체"""
+    version: int
+    segments: Tuple[Tuple[str, Segment], ...]
+    tails: Tuple[Tuple[str, MemorySegment], ...]
+
+
+class SubjectIndex:
+    """과목 하나의 세그먼트 색인
+
+    새 문서는 작은 append-only 세그먼트(segments/seg_xxxxxx)로 저장하고, 검색은 모든 세그먼트 결과를 합침.
+    크기가 비슷한 세그먼트가 쌓이면 compaction으로 그것들만 병합 (단계별 병합, _merge_plan). 세그먼트 목록은
+    segments.json에 원자적으로 기록.
+    파일 삭제는 행 단위 tombstone으로 처리하고 (검색에서 제외), 실제 제거는 다음 compaction에서.
+
+    segments.json은 버전이 붙은 스냅샷 포인터: 쓰기는 과목 파일 락(.locks/<과목>.write.lock) 안에서 디스크의 최신 버전을
+    먼저 반영한 뒤 새 버전을 기록하므로 여러 프로세스가 써도 서로 덮어쓰지 않음. 검색은 락 없이 현재 Snapshot을
+    끝까지 사용하고, 다른 프로세스가 올린 새 버전은 refresh()에서 넘어감.
+    generation은 과목을 새로 만들 때마다 바뀌는 id: 다른 프로세스가 과목을 지우고 다시 만들면 버전 번호가
+    낮아져도 세대가 달라지므로 디스크 상태를 그대로 따름 (지워진 세그먼트를 가리키는 버전을 기록하지 않음).
+    """
+
+    STATE_FILE = "segments.json"
+    SEGMENT_DIR = "segments"
+    LOCK_DIR = ".locks"  # 과목 폴더들의 상위 폴더 아래
+
+    def __init__(self, path: str, embed: Embeddings, compression: str = None):
+        self.path = path
+        self.embed = embed
+        self.snapshot = Snapshot(0, (), ())
+        self.generation: Optional[str] = None  # 아직 디스크에 기록하지 않은 새 과목은 None
+        self.next_seq = 0
+        # 벡터 압축 방식 (none/fp16/int8/pq). 새 과목은 설정 기본값을 따름
+        self.compression = compression or Config.DEFAULT_COMPRESSION
+        self._state_stamp = None  # 마지막으로 반영한 segments.json의 (mtime, 크기)
+        self._swap_lock = threading.Lock()  # 스냅샷 교체 순간만 보호 (검색은 잡지 않음)
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def segments(self) -> Tuple[Tuple[str, Segment], ...]:
+        return self.snapshot.segments
+
+    def tail(self, stage: str = "") -> Optional[MemorySegment]:
+        return dict(self.snapshot.tails).get(stage)
+
+    @property
+    def version(self) -> int:
+        return self.snapshot.version
+
+    @property
+    def revision(self) -> Tuple:
+        """내용이 바뀔 때마다 달라지는 값 (세대, 버전, segments.json 기록 시각/크기, tail 행 수).
+        과목을 지우고 다시 만들어 버전 번호가 같아져도 세대가 달라 겹치지 않음"""
+        snapshot = self.snapshot
+        return self.generation, snapshot.version, self._state_stamp, sum(len(t) for _, t in snapshot.tails)
+
+    # ----- 디스크 -----
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return (os.path.exists(os.path.join(path, cls.STATE_FILE))
+                or os.path.exists(os.path.join(path, "index.faiss")))
+
+    @classmethod
+    def _lock_path(cls, path: str, kind: str) -> str:
+        """과목 폴더 밖의 락 파일 (<상위 폴더>/.locks/<과목>.<kind>.lock)
+
+        과목 폴더 안에 두면 락만 잡아도 빈 과목 폴더가 생기고, 과목을 지울 때 잡고 있는 락 파일까지 지워져
+        기다리던 프로세스와 새로 잡는 프로세스가 서로 다른 파일을 잠그게 됨
+        """
+        parent, name = os.path.split(os.path.normpath(path))
+        lock_dir = os.path.join(parent, cls.LOCK_DIR)
+        os.makedirs(lock_dir, exist_ok=True)
+        return os.path.join(lock_dir, f"{name}.{kind}.lock")
+
+    @classmethod
+    def lock(cls, path: str) -> FileLock:
+        """과목 쓰기용 프로세스 간 락"""
+        return FileLock.for_path(cls._lock_path(path, "write"))
+
+    @classmethod
+    def load(cls, path: str, embed: Embeddings) -> "SubjectIndex":
+        state_path = os.path.join(path, cls.STATE_FILE)
+        if not os.path.exists(state_path) or cls._has_pickle_segments(path):
+            # 이전 형식(단일 index.faiss / pickle 세그먼트)은 락을 잡고 한 번만 변환
+            with cls.lock(path):
+                if not os.path.exists(state_path):
+                    cls._migrate_legacy(path, embed)
+                for name in cls._read_state(path)["segments"]:
+                    seg_path = cls._segment_path(path, name)
+                    if not os.path.exists(os.path.join(seg_path, "vectors.npy")):
+                        cls._convert_pickle_segment(seg_path, seg_path, embed)
+        index = cls(path, embed)
+        index.refresh(force=True)
+        return index
+
+    @classmethod
+    def _has_pickle_segments(cls, path: str) -> bool:
+        return any(not os.path.exists(os.path.join(cls._segment_path(path, name), "vectors.npy"))
+                   for name in cls._read_state(path)["segments"])
+
+    @classmethod
+    def _migrate_legacy(cls, path: str, embed: Embeddings):
+        # 기존 단일 index.faiss/index.pkl 과목을 첫 세그먼트로 변환
+        name = "seg_000000"
+        os.makedirs(os.path.join(path, cls.SEGMENT_DIR), exist_ok=True)
+        cls._convert_pickle_segment(path, cls._segment_path(path, name), embed)
+        cls._write_state(path, [name], 1, version=1, generation=uuid.uuid4().hex)
+
+    @staticmethod
+    def _convert_pickle_segment(src: str, dst: str, embed: Embeddings):
+        """LangChain FAISS(index.faiss + index.pkl) 형식을 한 번만 읽어 새 형식으로 저장 (pickle은 여기서만 사용)"""
+        from langchain_community.vectorstores import FAISS
+
+        store = FAISS.load_local(src, embed, allow_dangerous_deserialization=True)
+        vectors = store.index.reconstruct_n(0, store.index.ntotal)
+        docs = [store.docstore.search(store.index_to_docstore_id[i]) for i in range(store.index.ntotal)]
+        tmp_dst = dst + ".converted"
+        Segment.write(tmp_dst, vectors, docs)
+        for fn in ("index.faiss", "index.pkl"):
+            os.remove(os.path.join(src, fn))
+        if src == dst:
+            for fn in os.listdir(tmp_dst):
+                os.replace(os.path.join(tmp_dst, fn), os.path.join(dst, fn))
+            os.rmdir(tmp_dst)
+        else:
+            os.replace(tmp_dst, dst)
+
+    @classmethod
+    def _segment_path(cls, path: str, name: str) -> str:
+        return os.path.join(path, cls.SEGMENT_DIR, name)
+
+    @classmethod
+    def _read_state(cls, path: str) -> dict:
+        with open(os.path.join(path, cls.STATE_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @classmethod
+    def _write_state(cls, path: str, names: List[str], next_seq: int, compression: str = "none",
+                     deleted: Dict[str, List[int]] = None, version: int = 0, generation: str = None):
+        os.makedirs(path, exist_ok=True)
+        tmp_path = os.path.join(path, cls.STATE_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"generation": generation, "version": version, "segments": names, "next_seq": next_seq,
+                       "compression": compression, "deleted": deleted or {}}, f)
+        os.replace(tmp_path, os.path.join(path, cls.STATE_FILE))
+
+    def _state_file_stamp(self):
+        try:
+            st = os.stat(os.path.join(self.path, self.STATE_FILE))
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def refresh(self, force: bool = False) -> bool:
+        """segments.json이 바뀌었으면 (다른 프로세스의 쓰기) 새 버전으로 스냅샷 교체
+
+        같은 세대의 세그먼트 객체는 재사용하므로 새 세그먼트(와 ANN 색인/압축 코드가 바뀐 세그먼트)만 열림. force가 아니면 다른 스레드가 갱신 중일 때
+        기다리지 않고 현재 스냅샷을 그대로 씀 (검색이 막히지 않도록). 한 번 읽었던 segments.json이 사라졌으면
+        (과목 삭제) 빈 상태로 돌아감.
+        """
+        stamp = self._state_file_stamp()
+        if stamp is None and self._state_stamp is not None:
+            with self._swap_lock:
+                self.generation = None
+                self.next_seq = 0
+                self.snapshot = Snapshot(0, (), self.snapshot.tails)
+            self._state_stamp = None
+            return True
+        if stamp is None or (not force and stamp == self._state_stamp):
+            return False
+        if not self._refresh_lock.acquire(blocking=force):
+            return False
+        try:
+            state = self._read_state(self.path)
+            version = state.get("version", 0)
+            generation = state.get("generation")
+            same_generation = generation == self.generation
+            changed = force or version != self.version or not same_generation
+            if changed:
+                # 세대가 다르면 이름이 같은 세그먼트도 다른 내용이므로 재사용하지 않음
+                known = dict(self.segments) if same_generation else {}
+                deleted = state.get("deleted", {})
+                segments = []
+                for name in state["segments"]:
+                    seg = known.get(name)
+                    if seg is None or seg.index_stamp != seg.read_index_stamp():
+                        # 새 세그먼트, 또는 다른 프로세스가 ANN 색인/압축 코드를 새로 만든 세그먼트
+                        seg = Segment(self._segment_path(self.path, name))
+                    segments.append((name, seg.with_deleted(frozenset(deleted.get(name, ())))))
+                with self._swap_lock:
+                    # 그 사이 이 프로세스가 같은 세대에서 더 새 버전을 기록했으면 되돌리지 않음
+                    if generation != self.generation or version >= self.version:
+                        self.generation = generation
+                        self.next_seq = state["next_seq"]
+                        self.compression = state.get("compression", "none")
+                        self.snapshot = Snapshot(version, tuple(segments), self.snapshot.tails)
+            self._state_stamp = stamp
+            return changed
+        finally:
+            self._refresh_lock.release()
+
+    @contextmanager
+    def _write_transaction(self):
+        """쓰기 작업: 과목 파일 락 → 디스크 최신 버전(세대 포함) 반영 → (변경 후 _commit으로 새 버전 기록)
+
+        이 객체가 읽었던 과목이 그 사이 삭제됐으면 되살리지 않고 FileNotFoundError
+        """
+        with self.lock(self.path):
+            seen = self._state_stamp is not None
+            self.refresh(force=True)
+            if seen and self._state_stamp is None:
+                raise FileNotFoundError(f"과목 색인이 삭제되었습니다: {self.path}")
+            yield
+
+    def _commit(self, segments: List[Tuple[str, Segment]], flushed: str = None):
+        """새 버전을 segments.json에 원자적으로 기록한 뒤 스냅샷 교체 (_write_transaction 안에서 호출)
+
+        적재 중인 tail은 그대로 두고, flushed로 지정한 적재 작업의 tail만 (세그먼트로 기록됐으므로) 뺌
+        """
+        on_disk = self._read_state(self.path).get("generation") if self._state_file_stamp() else self.generation
+        if on_disk != self.generation:
+            raise RuntimeError(f"과목 색인 세대가 바뀌어 기록하지 않습니다: {self.path}")
+        if self.generation is None:
+            self.generation = uuid.uuid4().hex
+        version = self.version + 1
+        deleted = {name: sorted(seg.deleted) for name, seg in segments if seg.deleted}
+        self._write_state(self.path, [name for name, _ in segments], self.next_seq, self.compression, deleted,
+                          version, self.generation)
+        with self._swap_lock:
+            tails = tuple((stage, t) for stage, t in self.snapshot.tails if stage != flushed)
+            self.snapshot = Snapshot(version, tuple(segments), tails)
+        self._state_stamp = self._state_file_stamp()
+
+    # ----- 쓰기 -----
+    def add_embeddings(self, pairs: List[Tuple[str, List[float]]], metadatas: List[dict], stage: str = ""):
+        """적재 작업(stage)의 tail 세그먼트에 추가 (메모리에서 바로 검색 가능, flush 전까지 디스크에는 쓰지 않음)
+
+        동시에 진행되는 적재는 stage를 다르게 주면 각자의 tail에 쌓이고, 각자 자기 분량만 flush함
+        """
+        vectors = np.asarray([v for _, v in pairs], dtype=np.float32)
+        docs = [Document(page_content=t, metadata=m) for (t, _), m in zip(pairs, metadatas)]
+        with self._swap_lock:
+            tails = dict(self.snapshot.tails)
+            tails[stage] = (tails.get(stage) or MemorySegment()).extended(vectors, docs)
+            self.snapshot = self.snapshot._replace(tails=tuple(tails.items()))
+
+    def flush(self, stage: str = "", skip_keys: Iterable[str] = ()) -> Optional[str]:
+        """stage의 tail을 새 세그먼트로 저장하고 새 버전으로 교체. 쓰는 양은 이번에 추가한 분량뿐
+
+        skip_keys: 기록하지 않을 청크 해시 (적재하는 동안 다른 작업이 먼저 기록한 청크)
+        """
+        tail = self.tail(stage)
+        if tail is None:
+            return None
+        with self._write_transaction():
+            tail = self.tail(stage).without_keys(frozenset(skip_keys))
+            if not len(tail):
+                self.discard_tail(stage)
+                return None
+            name = f"seg_{self.next_seq:06d}"
+            seg_path = self._segment_path(self.path, name)
+            Segment.write(seg_path, tail.vectors, tail.docs, self.compression)
+            self.next_seq += 1
+            # 저장 후에는 메모리 사본 대신 메모리 매핑된 세그먼트를 사용
+            self._commit(list(self.segments) + [(name, Segment(seg_path))], flushed=stage)
+        return name
+
+    def discard_tail(self, stage: str = ""):
+        """flush하지 않은 적재분을 버림 (적재 실패 시, 디스크에 없는 청크가 검색에 남지 않도록)"""
+        with self._swap_lock:
+            tails = tuple((s, t) for s, t in self.snapshot.tails if s != stage)
+            self.snapshot = self.snapshot._replace(tails=tails)
+
+    def deleted_count(self) -> int:
+        return sum(len(seg.deleted) for _, seg in self.segments)
+
+    @staticmethod
+    def _tier(rows: int) -> int:
+        """병합 단계: COMPACT_MIN_SEGMENT_ROWS보다 작으면 0, 이후 COMPACT_TIER_RATIO배마다 한 단계씩"""
+        tier, size = 0, Config.COMPACT_MIN_SEGMENT_ROWS
+        while rows >= size:
+            tier += 1
+            size *= Config.COMPACT_TIER_RATIO
+        return tier
+
+    def _merge_plan(self) -> List[Tuple[str, Segment]]:
+        """이번에 병합할 세그먼트 (크기가 비슷한 세그먼트끼리만 합쳐 큰 세그먼트를 매번 다시 쓰지 않음)
+
+        1. 같은 단계에 COMPACT_MERGE_FACTOR개 이상 모인 가장 낮은 단계
+        2. tombstone 비율이 MAX_DELETED_RATIO를 넘은 세그먼트가 있는 가장 낮은 단계의 그 세그먼트들 (지운 행 제거)
+        3. 세그먼트 수가 MAX_SEGMENTS를 넘으면 가장 작은 것부터 개수를 맞출 만큼
+        """
+        segments = list(self.segments)
+        tiers: Dict[int, List[Tuple[str, Segment]]] = {}
+        for name, seg in segments:
+            tiers.setdefault(self._tier(len(seg) - len(seg.deleted)), []).append((name, seg))
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= Config.COMPACT_MERGE_FACTOR:
+                return tiers[tier]
+        for tier in sorted(tiers):
+            heavy = [(name, seg) for name, seg in tiers[tier]
+                     if len(seg) and len(seg.deleted) / len(seg) > Config.MAX_DELETED_RATIO]
+            if heavy:
+                return heavy
+        if len(segments) > Config.MAX_SEGMENTS:
+            chosen = {name for name, seg in sorted(segments, key=lambda s: len(s[1]) - len(s[1].deleted))
+                      [:len(segments) - Config.MAX_SEGMENTS + 1]}
+            return [(name, seg) for name, seg in segments if name in chosen]
+        return []
+
+    def needs_compaction(self) -> bool:
+        return bool(self._merge_plan())
+
+    @contextmanager
+    def compaction(self):
+        """병합 작업용 프로세스 간 락 (병합은 한 번에 하나씩). 잡은 뒤 중단된 병합이 남긴 임시 폴더부터 정리"""
+        with FileLock.for_path(self._lock_path(self.path, "compact")):
+            self._remove_leftovers()
+            yield
+
+    def _remove_leftovers(self):
+        """중단된 병합(.compact_*)과 세그먼트 기록(*.tmp_*)이 남긴 임시 폴더, 세그먼트 안의 임시 파일 삭제
+
+        병합 락과 쓰기 락을 모두 잡은 상태이므로 진행 중인 병합/기록의 폴더는 없음
+        """
+        seg_dir = os.path.join(self.path, self.SEGMENT_DIR)
+        with self.lock(self.path):
+            try:
+                names = os.listdir(seg_dir)
+            except FileNotFoundError:
+                return
+            for name in names:
+                if name.startswith(".compact_") or ".tmp_" in name:
+                    shutil.rmtree(os.path.join(seg_dir, name), ignore_errors=True)
+                elif os.path.isdir(os.path.join(seg_dir, name)):
+                    # 중단된 ANN 색인/압축 코드 기록의 임시 파일
+                    for fn in os.listdir(os.path.join(seg_dir, name)):
+                        if ".tmp_" in fn:
+                            os.remove(os.path.join(seg_dir, name, fn))
+
+    def build_compacted(self, full: bool = False) -> Optional[Tuple[List[Tuple[str, Segment, FrozenSet[int]]],
+                                                                    Optional[str]]]:
+        """병합 정책(_merge_plan)이 고른 세그먼트를 병합한 새 세그먼트를 임시 폴더에 생성. full이면 전부 병합
+        (세그먼트는 불변이므로 쓰기 락 불필요, compaction() 안에서 호출)
+
+        tombstone 행은 이때 실제로 빠짐 (남은 행이 없으면 임시 폴더 없이 None). 병합 중에 생긴 tombstone은
+        commit_compacted에서 옮겨 줌
+        """
+        plan = list(self.segments) if full else self._merge_plan()
+        snapshot = [(name, seg, seg.deleted) for name, seg in plan]
+        if len(snapshot) < 2 and not any(deleted for _, _, deleted in snapshot):
+            return None
+        docs = [seg.document(i) for _, seg, deleted in snapshot for i in range(len(seg)) if i not in deleted]
+        if not docs:
+            return snapshot, None
+        vectors = np.concatenate([np.asarray(seg.live_vectors()) for _, seg, _ in snapshot])
+        tmp_dir = os.path.join(self.path, self.SEGMENT_DIR, f".compact_{uuid.uuid4().hex}")
+        Segment.write(tmp_dir, vectors, docs, self.compression)
+        return snapshot, tmp_dir
+
+    def commit_compacted(self, snapshot: List[Tuple[str, Segment, FrozenSet[int]]], tmp_dir: Optional[str]) -> bool:
+        """병합 결과로 병합한 세그먼트들을 교체하고 옛 세그먼트 삭제 (새 세그먼트는 첫 세그먼트 자리에)
+
+        병합하는 동안 다른 프로세스가 같은 세그먼트를 병합/삭제했으면 결과를 버리고 False
+        """
+        replaced = [name for name, _, _ in snapshot]
+        with self._write_transaction():
+            current = dict(self.segments)
+            if any(current.get(name) is not seg for name, seg, _ in snapshot):
+                if tmp_dir:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                return False
+            merged_segments = []
+            if tmp_dir:
+                name = f"seg_{self.next_seq:06d}"
+                seg_path = self._segment_path(self.path, name)
+                os.replace(tmp_dir, seg_path)
+                self.next_seq += 1
+                merged = Segment(seg_path)
+                # 병합하는 동안 삭제된 행을 새 세그먼트의 행 번호로 옮김
+                moved, base = set(), 0
+                for _, seg, dropped in snapshot:
+                    dropped_rows = np.asarray(sorted(dropped), dtype=np.int64)
+                    for row in seg.deleted - dropped:
+                        moved.add(base + row - int(np.searchsorted(dropped_rows, row)))
+                    base += len(seg) - len(dropped)
+                merged_segments.append((name, merged.with_deleted(frozenset(moved))))
+            # 병합하지 않은 세그먼트와 병합하는 동안 새로 추가된 세그먼트는 그대로 유지
+            segments = list(self.segments)
+            first = next(i for i, (n, _) in enumerate(segments) if n in replaced)
+            rest = [s for s in segments if s[0] not in replaced]
+            self._commit(rest[:first] + merged_segments + rest[first:])
+        # 옛 세그먼트를 쓰던 검색은 자기 스냅샷으로 끝까지 진행 (매핑은 파일 삭제 후에도 유효, GC가 정리)
+        for old in replaced:
+            shutil.rmtree(self._segment_path(self.path, old), ignore_errors=True)
+        return True
+
+    # ----- 읽기 -----
+    @staticmethod
+    def _snapshot_segments(snapshot: Snapshot) -> list:
+        return [seg for _, seg in snapshot.segments] + [tail for _, tail in snapshot.tails]
+
+    def _all_segments(self) -> list:
+        return self._snapshot_segments(self.snapshot)
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vectors([embedding], k)[0]
+
+    def similarity_search_with_score_by_vectors(self, embeddings: List[List[float]],
+                                                k: int = 4) -> List[List[Tuple[Document, float]]]:
+        """여러 질의를 세그먼트마다 한 번의 FAISS 호출로 검색. 결과는 질의 순서대로"""
+        return [[(doc, dist) for doc, dist, _ in row] for row in self.search_hits_by_vectors(embeddings, k)]
+
+    def search_hits_by_vectors(self, embeddings: List[List[float]],
+                               k: int = 4) -> List[List[Tuple[Document, float, np.ndarray]]]:
+        """similarity_search_with_score_by_vectors와 같되 각 결과에 색인에 저장된 청크 벡터를 붙임 (MMR용)"""
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        hits = [[] for _ in range(len(queries))]
+        if not len(queries):
+            return hits
+        # 시작 시점의 스냅샷 하나만 사용 (도중에 적재/병합이 끝나도 결과가 섞이지 않음)
+        for seg in self._all_segments():
+            if not len(seg):
+                continue
+            for q, live in enumerate(search_live(seg, queries, k)):
+                hits[q].extend((dist, seg, i) for dist, i in live)
+        # L2 거리이므로 작을수록 가까움. 최종 k개만 청크 텍스트를 읽음
+        results = []
+        for row in hits:
+            row.sort(key=lambda x: x[0])
+            results.append([(seg.document(i), dist, np.array(seg.vectors[i], dtype=np.float32))
+                            for dist, seg, i in row[:k]])
+        return results
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        embedding = self.embed.embed_query(query)
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def documents(self) -> Iterator[Document]:
+        for seg in self._all_segments():
+            yield from seg.documents()
+
+    def indexed_keys(self, keys: Iterable[str]) -> Set[str]:
+        """keys 중 디스크 세그먼트에 (tombstone이 아닌 행으로) 이미 있는 청크 해시. 적재 중인 tail은 보지 않음
+
+        세그먼트마다 정렬해 둔 keys.npy를 이진 탐색하므로 비용은 과목 크기가 아니라 찾는 키 수에 비례
+        """
+        wanted = np.asarray(sorted(set(keys)), dtype="S64")
+        found: Set[str] = set()
+        if not len(wanted):
+            return found
+        for _, seg in self.segments:
+            sorted_keys, rows = seg.sorted_keys()
+            lo = np.searchsorted(sorted_keys, wanted, side="left")
+            hi = np.searchsorted(sorted_keys, wanted, side="right")
+            for key, start, end in zip(wanted, lo, hi):
+                if any(int(row) not in seg.deleted for row in rows[start:end]):
+                    found.add(key.decode())
+        return found
+
+    # ----- 파일 삭제 -----
+    def _find_keys(self, keys: Iterable[str]) -> List[Tuple[str, List[int]]]:
+        """청크 해시에 해당하는 (세그먼트, 행 번호) 목록"""
+        wanted = np.asarray(sorted(keys), dtype="S64")
+        found = []
+        if not len(wanted):
+            return found
+        for name, seg in self.segments:
+            rows = [int(i) for i in np.nonzero(np.isin(seg.keys, wanted))[0] if int(i) not in seg.deleted]
+            if rows:
+                found.append((name, rows))
+        return found
+
+    def remove_keys(self, keys: Iterable[str]) -> int:
+        """청크 해시에 해당하는 행을 tombstone으로 기록하고 새 버전으로 교체. 모든 행이 지워진 세그먼트는 바로 제거"""
+        keys = list(keys)
+        with self._write_transaction():
+            # 락 안에서 최신 버전 기준으로 행을 찾음 (다른 프로세스가 병합했을 수 있음)
+            found = dict(self._find_keys(keys))
+            if not found:
+                return 0
+            # 새 tombstone은 새 세그먼트 객체에만 붙여 새 스냅샷과 함께 발행 (지금 검색 중인 스냅샷은 그대로)
+            segments = [(name, seg.with_deleted(seg.deleted | frozenset(found.get(name, ()))))
+                        for name, seg in self.segments]
+            removed = sum(len(rows) for rows in found.values())
+            emptied = [name for name, seg in segments if seg.deleted and len(seg.deleted) >= len(seg)]
+            self._commit([(name, seg) for name, seg in segments if name not in emptied])
+        for name in emptied:
+            shutil.rmtree(self._segment_path(self.path, name), ignore_errors=True)
+        return removed
+
+    def ann_candidates(self) -> List[Tuple[str, Segment]]:
+        """ANN 색인을 아직 시도하지 않은, 임계값 이상 크기의 세그먼트 (압축 모드에서는 압축 코드 검색을 사용)"""
+        if self.compression != "none":
+            return []
+        return [(name, seg) for name, seg in self.segments
+                if len(seg) >= Config.ANN_THRESHOLD and seg.ann_info is None]
+
+    def build_ann(self, index_type: str) -> List[Tuple[str, dict]]:
+        """ANN 후보 세그먼트마다 색인을 학습해 세그먼트 폴더에 기록 (compaction() 안에서 호출, 교체는 attach_ann)"""
+        return [(name, seg.build_ann(index_type)) for name, seg in self.ann_candidates()]
+
+    def attach_ann(self, built: List[Tuple[str, dict]]):
+        """만든 ANN 색인을 붙이고 새 버전을 기록 (다른 프로세스는 refresh에서 ann.json이 바뀐 세그먼트를 다시 읽음)"""
+        with self._write_transaction():
+            segments = dict(self.segments)
+            for name, info in built:
+                if name in segments:  # 그 사이 병합으로 없어진 세그먼트는 건너뜀
+                    segments[name].attach_ann(info)
+            self._commit(list(self.segments))
+
+    def index_report(self) -> List[dict]:
+        report = []
+        for name, seg in self.segments:
+            codes_info, ann_info = seg.codes_info, seg.ann_info
+            if seg.codes is not None and codes_info:
+                kind, recall = codes_info["mode"], None
+            elif seg.ann is not None and ann_info:
+                kind, recall = ann_info["type"], ann_info.get("recall")
+            else:
+                kind, recall = "flat", None
+            report.append({"segment": name, "vectors": len(seg), "deleted": len(seg.deleted), "index": kind,
+                           "recall": recall,
+                           "resident_mb": round(seg.resident_bytes() / (1024 * 1024), 3)})
+        return report
+
+    def build_compression(self, mode: str) -> Dict[str, Optional[dict]]:
+        """모든 세그먼트의 압축 코드를 (각 세그먼트 폴더에) 생성 (compaction() 안에서 호출, 교체는 attach_compression)"""
+        if mode not in COMPRESSION_MODES:
+            raise ValueError(f"지원하지 않는 압축 방식입니다: {mode} ({', '.join(COMPRESSION_MODES)})")
+        return {name: Segment.write_codes(seg.path, seg.vectors, mode) for name, seg in self.segments}
+
+    def attach_compression(self, mode: str, built: Dict[str, Optional[dict]]):
+        """압축 코드를 붙이고 새 버전을 기록. 코드를 만드는 사이 새로 기록된 세그먼트는 락 안에서 마저 만듦"""
+        with self._write_transaction():
+            for name, seg in self.segments:
+                info = built[name] if name in built else Segment.write_codes(seg.path, seg.vectors, mode)
+                seg.attach_codes(info)
+            self.compression = mode
+            self._commit(list(self.segments))
+
+    def compression_report(self, k: int = 10) -> List[dict]:
+        """압축 방식별 메모리 사용량과 recall@k(재정렬 전/후)를 가장 큰 세그먼트로 측정"""
+        segments = [seg for _, seg in self.segments if len(seg)]
+        if not segments:
+            return []
+        seg = max(segments, key=len)
+        vectors = seg.vectors
+        total = self.ntotal
+        report = []
+        for mode in COMPRESSION_MODES:
+            codes = build_codes(np.asarray(vectors), mode)
+            if mode != "none" and codes is None:
+                continue
+            if codes is None:
+                bytes_per_vector = vectors.shape[1] * 4
+                raw = reranked = 1.0
+            else:
+                bytes_per_vector = codes.sa_code_size()
+                raw = measure_recall(codes.search, vectors, k)
+                reranked = measure_recall(lambda q, kk: rerank_search(codes, vectors, q, kk), vectors, k)
+            report.append({
+                "mode": mode,
+                "bytes_per_vector": bytes_per_vector,
+                "subject_mb": round(bytes_per_vector * total / (1024 * 1024), 3),
+                f"recall@{k}": round(raw, 4),
+                f"recall@{k}_reranked": round(reranked, 4),
+            })
+        return report
+
+    def sample(self, k: int) -> List[Document]:
+        """전체 청크를 읽지 않고 무작위 위치의 청크 k개만 읽음"""
+        segments = [seg for seg in self._all_segments() if len(seg)]
+        total = sum(len(seg) for seg in segments)
+        # tombstone 행은 건너뛰므로 그만큼 더 뽑음
+        picks = random.sample(range(total), min(k + sum(len(seg.deleted) for seg in segments), total))
+        docs = []
+        for pos in sorted(picks):
+            for seg in segments:
+                if pos < len(seg):
+                    if pos not in seg.deleted:
+                        docs.append(seg.document(pos))
+                    break
+                pos -= len(seg)
+        random.shuffle(docs)
+        return docs[:k]
+
+    @property
+    def ntotal(self) -> int:
+        return sum(len(seg) - len(seg.deleted) for seg in self._all_segments())
+
+    def estimate_bytes(self) -> int:
+        return sum(seg.resident_bytes() for seg in self._all_segments())
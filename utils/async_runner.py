@@ -0,0 +1,26 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Optional
+
+# 프로세스 전체가 공유하는 이벤트 루프 (데몬 스레드 하나에서 계속 실행)
+# - 여러 세션의 LLM 호출이 이 루프 하나에서 동시에 진행됨 (요청마다 스레드를 잡아두지 않음)
+# - OpenAI/Anthropic 비동기 클라이언트의 연결 풀은 만든 루프에 묶이므로, 호출마다 asyncio.run으로
+#   새 루프를 만들지 않고 항상 같은 루프에서 실행
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="async-runner", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run_async(coro: Awaitable, timeout: Optional[float] = None) -> Any:
+    """동기 코드(Streamlit 스크립트 등)에서 코루틴을 공유 루프에 맡기고 결과를 기다림"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
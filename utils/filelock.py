@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+from typing import Dict
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """여러 프로세스(Streamlit 워커, 관리 CLI 등) 사이의 배타적 파일 락
+
+    같은 경로의 락은 프로세스 안에서 하나의 객체를 공유하고, 같은 스레드는 중첩해서 잡을 수 있음.
+    락 파일의 폴더는 만들지 않음 (없는 과목 폴더가 락 때문에 생기지 않도록 호출자가 준비).
+    """
+
+    _registry: Dict[str, "FileLock"] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    @classmethod
+    def for_path(cls, path: str) -> "FileLock":
+        path = os.path.abspath(path)
+        with cls._registry_lock:
+            if path not in cls._registry:
+                cls._registry[path] = cls(path)
+            return cls._registry[path]
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self._file = open(self.path, "a+b")
+                if fcntl:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+                else:
+                    self._lock_windows()
+            except BaseException:
+                if self._file:
+                    self._file.close()
+                    self._file = None
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def _lock_windows(self):
+        # LK_LOCK은 10초 뒤 포기하므로, 긴 적재가 끝날 때까지 계속 재시도
+        while True:
+            self._file.seek(0)
+            try:
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                time.sleep(0.1)
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
@@ -0,0 +1,35 @@
+import multiprocessing
+import threading
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+from PyPDF2 import PdfReader
+
+# ===========================
+# PDF 페이지 텍스트 병렬 추출 워커
+# spawn 워커는 작업 함수가 있는 모듈을 import하므로, LangChain 등을 불러오는 pdf_processor와 분리해
+# PyPDF2만 읽는 가벼운 모듈에 둠. 풀은 프로세스에 하나만 만들어 여러 파일이 함께 씀
+# ===========================
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def extract_page_range(data: bytes, start: int, end: int) -> List[Tuple[int, str]]:
+    """워커 프로세스에서 [start, end) 페이지 텍스트 추출 (페이지 번호는 1부터)"""
+    reader = PdfReader(BytesIO(data))
+    return [(i + 1, reader.pages[i].extract_text() or "") for i in range(start, end)]
+
+
+def get_extract_pool(workers: int) -> ProcessPoolExecutor:
+    """추출 워커 풀 (처음 큰 PDF가 들어올 때 만들고 이후 파일들이 재사용)"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # 스트림릿 서버의 스레드(임베딩 풀 등)를 fork로 복제하지 않도록 spawn 사용
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
@@ -1,97 +1,770 @@
 import os, shutil
 import re
-from typing import List, Dict
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+import numpy as np
 from langchain.docstore.document import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
 from config import Config
+from embeddings import build_embeddings
+from subject_index import SubjectIndex
+from subject_catalog import content_hash, list_subjects, subject_info, subject_path
+
+
+class SubjectManifest:
+    """과목별 manifest.jsonl: 파일 내용 해시 → {"name", "aliases", "chunks", "chunk_hashes"}
+
+    추가/별칭/삭제를 한 줄씩 덧붙이는 로그라 올릴 때마다 전체를 다시 쓰지 않음 (불러올 때 재생).
+    지운 기록이 쌓이면 저장할 때 현재 상태로 한 번 다시 씀. 이미 색인한 청크인지는 색인의 keys.npy로
+    판단하므로 (SubjectIndex.indexed_keys) 과목 전체의 청크 해시 목록은 따로 저장하지 않음.
+    """
+
+    FILE_NAME = "manifest.jsonl"
+    LEGACY_FILE_NAME = "manifest.json"  # 전체를 매번 다시 쓰던 이전 형식 (다음 저장 때 변환)
+
+    def __init__(self, subject_path: str):
+        self.path = os.path.join(subject_path, self.FILE_NAME)
+        self.legacy_path = os.path.join(subject_path, self.LEGACY_FILE_NAME)
+        self.files: Dict[str, Dict] = {}
+        self._pending: List[Dict] = []  # 아직 저장하지 않은 기록
+        self._records = 0  # 로그의 줄 수
+        self._rewrite = False  # 다음 저장 때 로그를 현재 상태로 다시 씀
+        if os.path.exists(self.path):
+            self._replay()
+        elif os.path.exists(self.legacy_path):
+            with open(self.legacy_path, "r", encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+            self._rewrite = True
+        self.stamp = self.file_stamp(self.path)
+
+    @staticmethod
+    def file_stamp(path: str) -> Optional[Tuple[int, int]]:
+        """(mtime, 크기): 다른 프로세스가 기록을 덧붙였는지 확인하는 데 사용"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _replay(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 덧붙이다 중단된 마지막 줄: 건너뛰고 다음 저장 때 로그를 다시 씀
+                    self._rewrite = True
+                    continue
+                self._records += 1
+                if "add" in record:
+                    self.files[record["add"]] = {k: v for k, v in record.items() if k != "add"}
+                elif "alias" in record and record["alias"] in self.files:
+                    self._add_name(self.files[record["alias"]], record["name"])
+                elif "remove" in record:
+                    self.files.pop(record["remove"], None)
+
+    def has_file(self, file_hash: str) -> bool:
+        return file_hash in self.files
+
+    def add_file(self, file_hash: str, file_name: str, chunk_count: int, chunk_hashes: List[str] = None):
+        # chunk_hashes: 파일을 지울 때 어떤 벡터를 빼야 하는지 알기 위한 청크 해시 목록
+        self.files[file_hash] = {"name": file_name, "chunks": chunk_count, "chunk_hashes": chunk_hashes or []}
+        self._pending.append({"add": file_hash, **self.files[file_hash]})
+
+    def add_alias(self, file_hash: str, file_name: str):
+        """같은 내용을 다른 이름으로 올린 경우 그 이름을 파일 항목에 추가 (삭제할 때 함께 지움)"""
+        if self._add_name(self.files[file_hash], file_name):
+            self._pending.append({"alias": file_hash, "name": file_name})
+
+    def remove(self, file_hash: str) -> Dict:
+        self._pending.append({"remove": file_hash})
+        return self.files.pop(file_hash)
+
+    @classmethod
+    def _add_name(cls, info: Dict, file_name: str) -> bool:
+        if not file_name or file_name in cls.names(info):
+            return False
+        info["aliases"] = info.get("aliases", []) + [file_name]
+        return True
+
+    @staticmethod
+    def names(info: Dict) -> List[str]:
+        return [n for n in [info.get("name", "")] + info.get("aliases", []) if n]
+
+    def file_names(self) -> List[str]:
+        return list(dict.fromkeys(n for info in self.files.values() for n in self.names(info)))
+
+    def save(self):
+        """새 기록만 덧붙임 (호출자는 과목 파일 락을 잡고 있어야 함). 로그가 현재 파일 수보다 많이 길어졌으면 다시 씀"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self._rewrite or self._records + len(self._pending) > 2 * len(self.files) + 64:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for file_hash, info in self.files.items():
+                    f.write(json.dumps({"add": file_hash, **info}, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+            if os.path.exists(self.legacy_path):
+                os.remove(self.legacy_path)
+            self._records = len(self.files)
+        elif self._pending:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in self._pending)
+            self._records += len(self._pending)
+        self._pending = []
+        self._rewrite = False
+        self.stamp = self.file_stamp(self.path)
+
+
+class SearchHits(NamedTuple):
+    """관련도 순 검색 결과와 색인에 저장된 청크 벡터(행 순서 동일), 질의 벡터"""
+
+    docs: List[Document]
+    vectors: List[np.ndarray]
+    query_vector: Optional[List[float]]
+
+    @classmethod
+    def from_hits(cls, hits: List[Tuple[Document, float, np.ndarray]], query_vector: List[float]) -> "SearchHits":
+        return cls([doc for doc, _, _ in hits], [vector for _, _, vector in hits], query_vector)
+
+
+class SubjectRetriever(BaseRetriever):
+    """매 질의마다 관리자를 통해 과목 색인을 찾는 리트리버 (캐시에서 내려간 색인을 붙잡지 않음)"""
+
+    vs_manager: Any
+    subject_name: str
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.vs_manager.search(self.subject_name, query, k=self.k)
+
+
+class FederatedRetriever(BaseRetriever):
+    """여러 과목을 한 번에 검색하는 리트리버 (subjects가 None이면 전체 과목)"""
+
+    vs_manager: Any
+    subjects: Optional[List[str]] = None
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return [doc for doc, _ in self.vs_manager.search_all(query, k=self.k, subjects=self.subjects)]
+
 
 class MultiSubjectVectorStoreManager:
+    """과목별 세그먼트 색인(SubjectIndex) 관리자. 프로세스당 하나를 여러 세션이 공유하므로 모든 공개 메서드는 스레드 안전
+
+    - 검색은 락 없이 과목 색인의 현재 스냅샷을 사용 (적재/병합은 새 스냅샷으로 교체하므로 검색이 기다리지 않음)
+    - 과목별 로드 락: 같은 과목을 한 번만 로드 (로드하는 동안만 잡으므로 적재 중에도 검색이 기다리지 않음)
+    - 과목별 RLock(쓰기 mutex): manifest 변경과 색인 기록(flush/commit) 순간만 직렬화 (PDF 추출·임베딩은 밖에서)
+    - 과목 파일 락: 다른 프로세스의 기록과 직렬화
+    - _cache_lock: LRU 딕셔너리와 통계 보호
+    """
+
     def __init__(self):
-        # ✅ HuggingFace 임베딩 모델 사용 (예: all-MiniLM-L6-v2)
-        self.embed = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
-        )
-        self.stores: Dict[str, FAISS] = {}
-        self.load_all_subjects()
+        # ✅ HuggingFace 임베딩 모델 사용 (예: all-MiniLM-L6-v2), 디스크 캐시로 재임베딩 방지
+        # 모델 로드는 무거워서 첫 검색/업로드 때 함 (과목 목록만 보는 첫 화면은 모델 없이 그림)
+        self._embed = None
+        self._embed_lock = threading.Lock()
+        # 과목 색인은 처음 사용할 때 로드하고, 메모리 한도를 넘으면 오래 안 쓴 과목부터 내림 (LRU)
+        self.stores: "OrderedDict[str, SubjectIndex]" = OrderedDict()
+        self.store_bytes: Dict[str, int] = {}
+        self.manifests: Dict[str, SubjectManifest] = {}
+        self.max_cache_bytes = Config.SUBJECT_CACHE_MAX_MB * 1024 * 1024
+        self.cache_stats = {"loads": 0, "load_seconds": 0.0, "evictions": 0, "last_load_seconds": {}, "evicted": []}
+        self._cache_lock = threading.RLock()
+        self._subject_mutexes: Dict[str, threading.RLock] = {}
+        self._load_mutexes: Dict[str, threading.RLock] = {}
+        self._pinned: Dict[str, int] = {}  # 적재 중인 과목은 축출 금지
+        self._compacting: set = set()
+        self._search_pool = ThreadPoolExecutor(max_workers=Config.SEARCH_FANOUT_WORKERS,
+                                               thread_name_prefix="subject-search")
+
+    @property
+    def embed(self):
+        if self._embed is None:
+            with self._embed_lock:
+                if self._embed is None:
+                    self._embed = build_embeddings()
+        return self._embed
 
     def get_subject_path(self, subject_name: str) -> str:
-        # 한글/특수문자 → 안전한 폴더명으로 변환
-        # safe_name = re.sub(r'[^a-zA-Z0-9_-]', '_', subject_name)
-        # return os.path.join(Config.FAISS_BASE_PATH, safe_name)
-        
-        return os.path.join(Config.FAISS_BASE_PATH, subject_name)
+        return subject_path(subject_name)
+
 
+    def _subject_file_lock(self, subject_name: str):
+        return SubjectIndex.lock(self.get_subject_path(subject_name))
+
+    def _subject_mutex(self, subject_name: str) -> threading.RLock:
+        with self._cache_lock:
+            return self._subject_mutexes.setdefault(subject_name, threading.RLock())
+
+    def _load_mutex(self, subject_name: str) -> threading.RLock:
+        with self._cache_lock:
+            return self._load_mutexes.setdefault(subject_name, threading.RLock())
+
+    @contextmanager
+    def _pin(self, subject_name: str):
+        # 작업 중인 과목 객체가 축출 후 다시 로드되어 둘로 갈라지지 않도록 고정
+        with self._cache_lock:
+            self._pinned[subject_name] = self._pinned.get(subject_name, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cache_lock:
+                self._pinned[subject_name] -= 1
+
+    def _has_index(self, subject_name: str) -> bool:
+        return SubjectIndex.exists(self.get_subject_path(subject_name))
 
     def load_all_subjects(self):
-        if not os.path.exists(Config.FAISS_BASE_PATH):
-            return
-        for subject_dir in os.listdir(Config.FAISS_BASE_PATH):
-            subject_path = self.get_subject_path(subject_dir)
-            if os.path.exists(subject_path):
-                try:
-                    self.stores[subject_dir] = FAISS.load_local(
-                        subject_path, self.embed, allow_dangerous_deserialization=True
-                    )
-                except Exception as e:
-                    print(f"과목 {subject_dir} 로드 실패: {e}")
-
-    def create_or_update_subject(self, subject_name: str, docs: List[Document], file_name: str = None):
-        subject_path = self.get_subject_path(subject_name)
-        if subject_name in self.stores:
-            new_store = FAISS.from_documents(docs, self.embed)
-            self.stores[subject_name].merge_from(new_store)
-        else:
-            self.stores[subject_name] = FAISS.from_documents(docs, self.embed)
+        """모든 과목을 미리 로드 (메모리 한도를 넘는 과목은 LRU 규칙대로 다시 내려감)"""
+        for subject_name in self.get_subjects():
+            self.get_store(subject_name)
+
+    def _load_subject(self, subject_name: str) -> Optional[SubjectIndex]:
+        if not self._has_index(subject_name):
+            return None
+        start = time.perf_counter()
+        try:
+            store = SubjectIndex.load(self.get_subject_path(subject_name), self.embed)
+        except Exception as e:
+            print(f"과목 {subject_name} 로드 실패: {e}")
+            return None
+        elapsed = time.perf_counter() - start
+        with self._cache_lock:
+            self.cache_stats["loads"] += 1
+            self.cache_stats["load_seconds"] += elapsed
+            self.cache_stats["last_load_seconds"][subject_name] = round(elapsed, 4)
+        return store
+
+    def _cache_store(self, subject_name: str, store: SubjectIndex, size_bytes: int = None):
+        if size_bytes is None:
+            size_bytes = store.estimate_bytes()
+        with self._cache_lock:
+            self.stores[subject_name] = store
+            self.stores.move_to_end(subject_name)
+            self.store_bytes[subject_name] = size_bytes
+            self._evict(keep=subject_name)
+
+    def _evict(self, keep: str):
+        # 축출된 색인을 쓰던 검색은 자기 참조로 끝까지 안전하게 진행됨
+        while sum(self.store_bytes.values()) > self.max_cache_bytes:
+            victim = next((name for name in self.stores if name != keep and not self._pinned.get(name)), None)
+            if victim is None:
+                break
+            del self.stores[victim]
+            self.store_bytes.pop(victim, None)
+            self.cache_stats["evictions"] += 1
+            self.cache_stats["evicted"] = (self.cache_stats["evicted"] + [victim])[-20:]
+
+    def get_cache_stats(self) -> Dict:
+        """로드/축출 횟수와 시간, 현재 상주 과목과 추정 메모리(MB)"""
+        with self._cache_lock:
+            return {
+                **self.cache_stats,
+                "last_load_seconds": dict(self.cache_stats["last_load_seconds"]),
+                "resident": list(self.stores.keys()),
+                "resident_mb": round(sum(self.store_bytes.values()) / (1024 * 1024), 2),
+                "max_mb": Config.SUBJECT_CACHE_MAX_MB,
+            }
+
+    def _get_manifest(self, subject_name: str) -> SubjectManifest:
+        # 호출자는 과목 mutex를 잡고 있어야 함. 다른 프로세스가 manifest에 기록을 덧붙였으면 다시 읽음
+        manifest = self.manifests.get(subject_name)
+        if manifest is None or manifest.stamp != SubjectManifest.file_stamp(manifest.path):
+            manifest = self.manifests[subject_name] = SubjectManifest(self.get_subject_path(subject_name))
+        return manifest
+
+    def _indexed_chunks(self, subject_name: str, hashes: List[str]) -> Set[str]:
+        """hashes 중 과목 색인(디스크 세그먼트)에 이미 있는 청크 해시"""
+        if not self._has_index(subject_name) and subject_name not in self.stores:
+            return set()
+        store = self.get_store(subject_name)
+        return store.indexed_keys(hashes) if store else set()
+
+    def create_or_update_subject(self, subject_name: str, docs: List[Document], file_name: str = None,
+                                 file_hash: str = None) -> Dict:
+        return self.add_document_batches(subject_name, [docs], file_name=file_name, file_hash=file_hash)
+
+    def add_document_batches(self, subject_name: str, batches: Iterable[List[Document]], file_name: str = None,
+                             file_hash: str = None) -> Dict:
+        """청크 배치를 받는 즉시 임베딩해 색인에 추가 (배치마다 바로 검색 가능). 저장은 마지막에 한 번
+
+        이미 색인한 파일(내용 해시 기준)은 배치를 읽지 않고 건너뛰며, 이미 있는 청크는 다시 임베딩하지 않음.
+        반환값: {"added": 새로 추가한 청크 수, "reused": 재사용한 청크 수, "duplicate_file": 동일 파일 여부}
+        """
+        results = self.ingest_files(subject_name, [(file_name, file_hash, batches)],
+                                    batch_size=Config.EMBED_BATCH_SIZE)
+        return results[0]
+
+    def ingest_files(self, subject_name: str, files: Iterable[Tuple[Optional[str], Optional[str], Iterable[List[Document]]]],
+                     batch_size: int = None) -> List[Dict]:
+        """여러 파일의 청크를 큰 배치로 모아 임베딩하고, 색인/manifest/파일 목록은 마지막에 한 번만 저장
+
+        files: (파일명, 파일 해시, 청크 배치 iterable) 목록. 파일별 통계를 같은 순서로 반환
+        PDF 추출과 임베딩은 과목 락 없이 이 적재 작업의 tail에 쌓고 (배치마다 바로 검색 가능), 과목 mutex와
+        파일 락은 마지막 기록 순간에만 잡음. 그 사이 다른 적재가 먼저 기록한 청크는 기록하지 않고 재사용으로 셈
+        """
+        with self._pin(subject_name):
+            return self._ingest_files(subject_name, files, batch_size)
+
+    def _ingest_files(self, subject_name: str, files, batch_size: int = None) -> List[Dict]:
+        batch_size = batch_size or Config.BULK_EMBED_BATCH_SIZE
+        if Config.EMBED_WORKERS > 1:
+            # 워커 프로세스마다 모델 배치 하나씩 돌아가도록 한 번에 모으는 양을 늘림
+            batch_size = max(batch_size, Config.EMBED_WORKERS * Config.EMBED_MODEL_BATCH_SIZE)
+        with self._subject_mutex(subject_name):
+            manifest = self._get_manifest(subject_name)  # 중복 판정용 (기록 직전에 다시 확인)
+        stage = uuid.uuid4().hex
+        store = None
+        results, file_names = [], []
+        pending: List[Document] = []
+        # tail은 INGEST_FLUSH_ROWS마다 세그먼트로 기록하지만 manifest에는 모든 기록이 끝난 뒤에만 반영
+        # (도중에 실패하면 먼저 기록한 청크를 다시 지워 manifest에 없는 청크가 남지 않음)
+        new_chunks: Dict[str, int] = {}  # 청크 해시 → 그 청크를 추가한 파일의 results 위치
+        flushed: Set[str] = set()  # 이번 적재가 이미 세그먼트로 기록한 청크 해시
+        new_files: Dict[str, Dict] = {}
+        aliases: List[Tuple[str, str]] = []  # (파일 해시, 이름): 이미 있는 내용을 다른 이름으로 올린 경우
 
+        try:
+            for file_name, file_hash, batches in files:
+                known = manifest.files.get(file_hash) or new_files.get(file_hash) if file_hash else None
+                if known:
+                    results.append({"added": 0, "reused": known["chunks"], "duplicate_file": True})
+                    aliases.append((file_hash, file_name))
+                    continue
+
+                added = reused = 0
+                chunk_hashes = []
+                for batch in batches:
+                    hashes = [content_hash(d.page_content) for d in batch]
+                    indexed = self._indexed_chunks(subject_name, hashes)
+                    for d, h in zip(batch, hashes):
+                        chunk_hashes.append(h)
+                        if h in indexed or h in new_chunks:
+                            reused += 1
+                            continue
+                        new_chunks[h] = len(results)
+                        pending.append(d)
+                        added += 1
+                    if len(pending) >= batch_size:
+                        store = self._embed_and_add(subject_name, pending, stage)
+                        pending = []
+                        if len(store.tail(stage) or ()) >= Config.INGEST_FLUSH_ROWS:
+                            self._flush_stage(subject_name, store, stage, new_chunks, results, flushed)
+                if added or reused:
+                    if file_hash:
+                        new_files[file_hash] = {"name": file_name or "", "chunks": added + reused,
+                                                "chunk_hashes": list(dict.fromkeys(chunk_hashes))}
+                    elif file_name:
+                        file_names.append(file_name)  # 해시 없이 올린 파일은 이름만 기록
+                results.append({"added": added, "reused": reused, "duplicate_file": False})
+
+            if pending:
+                store = self._embed_and_add(subject_name, pending, stage)
+
+            with self._subject_mutex(subject_name), self._subject_file_lock(subject_name):
+                manifest = self._get_manifest(subject_name)
+                if store is not None:
+                    self._flush_stage(subject_name, store, stage, new_chunks, results, flushed)
+                for file_hash, entry in new_files.items():
+                    if manifest.has_file(file_hash):
+                        aliases.append((file_hash, entry["name"]))  # 그 사이 다른 적재가 같은 파일을 기록함
+                    else:
+                        manifest.add_file(file_hash, entry["name"], entry["chunks"], entry["chunk_hashes"])
+                for file_hash, file_name in aliases:
+                    manifest.add_alias(file_hash, file_name)
+                if new_files or aliases or file_names:
+                    manifest.save()
+                    self._write_file_names(self.get_subject_path(subject_name), manifest, added=file_names)
+        except Exception:
+            # 기록하지 못한 tail은 버리고, manifest는 다음 사용 때 디스크에서 다시 읽음
+            if store is not None:
+                store.discard_tail(stage)
+            with self._subject_mutex(subject_name):
+                self.manifests.pop(subject_name, None)
+            if flushed:
+                self._rollback_flushed(subject_name, store, flushed)
+            raise
+
+        if store is not None and (store.needs_compaction() or store.ntotal >= Config.ANN_THRESHOLD):
+            self._optimize_in_background(subject_name)
+        return results
+
+    def _flush_stage(self, subject_name: str, store: SubjectIndex, stage: str, new_chunks: Dict[str, int],
+                     results: List[Dict], flushed: Set[str]):
+        """적재 작업의 tail을 새 세그먼트로 기록 (과목 mutex와 파일 락 안에서)
+
+        락 안에서 최신 버전을 반영한 뒤, 그 사이 다른 적재가 먼저 기록한 청크는 빼고 재사용으로 셈
+        """
+        with self._subject_mutex(subject_name), self._subject_file_lock(subject_name):
+            tail = store.tail(stage)
+            if tail is None:
+                return
+            keys = {content_hash(d.page_content) for d in tail.documents()}
+            store.refresh(force=True)
+            raced = store.indexed_keys(keys)
+            # ✅ 이번에 추가한 분량만 새 세그먼트로 기록 (기존 색인은 다시 쓰지 않음)
+            store.flush(stage, skip_keys=raced)
+            for h in raced:
+                results[new_chunks[h]]["added"] -= 1
+                results[new_chunks[h]]["reused"] += 1
+            flushed.update(keys - raced)
+
+    def _rollback_flushed(self, subject_name: str, store: SubjectIndex, flushed: Set[str]):
+        """실패한 적재가 먼저 기록한 청크 중 manifest의 어느 파일도 쓰지 않는 것을 지움 (그 사이 다른 적재가 재사용한 청크는 남김)"""
+        try:
+            with self._subject_mutex(subject_name), self._subject_file_lock(subject_name):
+                manifest = self._get_manifest(subject_name)
+                still_used = set()
+                for info in manifest.files.values():
+                    still_used.update(info.get("chunk_hashes") or ())
+                store.remove_keys(flushed - still_used)
+                self._cache_store(subject_name, store)
+        except Exception as e:
+            print(f"실패한 적재의 청크를 지우지 못했습니다 ({subject_name}): {e}")
+
+    def get_subject_files(self, subject_name: str) -> List[Dict]:
+        """과목에 등록된 파일 목록 [{"hash", "name", "names"(같은 내용으로 올린 모든 이름), "chunks"}]"""
+        with self._subject_mutex(subject_name):
+            manifest = self._get_manifest(subject_name)
+            return [{"hash": h, "name": info.get("name", ""), "names": manifest.names(info),
+                     "chunks": info.get("chunks", 0)}
+                    for h, info in manifest.files.items()]
+
+    def remove_file(self, subject_name: str, file_name: str = None, file_hash: str = None) -> Dict:
+        """과목에서 파일 하나의 청크만 제거 (전체 재색인 없음). 다른 파일과 공유하는 청크는 남김
+
+        같은 내용을 여러 이름으로 올렸으면 그 이름들도 모두 지움 (이름으로 찾을 때는 별칭도 비교).
+
+        벡터는 tombstone으로 즉시 검색에서 빠지고, 삭제 비율이 커지면 백그라운드 병합에서 실제로 제거됨.
+        반환값: {"found": 파일 존재 여부, "removed": 제거한 청크 수, "shared": 다른 파일이 써서 남긴 청크 수}
+        """
+        if not self._has_index(subject_name) and subject_name not in self.stores:
+            return {"found": False, "removed": 0, "shared": 0}
+        with self._subject_mutex(subject_name), self._subject_file_lock(subject_name), self._pin(subject_name):
+            manifest = self._get_manifest(subject_name)
+            hashes = [h for h, info in manifest.files.items()
+                      if h == file_hash or (file_hash is None and file_name in manifest.names(info))]
+            if not hashes and not file_name:
+                return {"found": False, "removed": 0, "shared": 0}
+            store = self.get_store(subject_name)
+            infos = [manifest.remove(h) for h in hashes]
+            names = {n for info in infos for n in manifest.names(info)} | ({file_name} if file_name else set())
+            targets = set()
+            for info in infos:
+                targets.update(info.get("chunk_hashes") or ())
+            # 청크 해시를 기록하기 전에 올린 파일(또는 manifest에 없는 파일)은 청크 메타데이터의 출처로 찾음
+            legacy_names = {info.get("name") for info in infos if not info.get("chunk_hashes")}
+            if not hashes:
+                legacy_names.add(file_name)
+            if store and legacy_names:
+                targets.update(content_hash(d.page_content) for d in store.documents()
+                               if d.metadata.get("source") in legacy_names)
+            if not hashes and not targets:
+                return {"found": False, "removed": 0, "shared": 0}
+            still_used = set()
+            for info in manifest.files.values():
+                still_used.update(info.get("chunk_hashes") or ())
+            shared = targets & still_used
+            targets -= still_used
+
+            removed = 0
+            if store and targets:
+                removed = store.remove_keys(targets)
+                self._cache_store(subject_name, store)
+                if store.needs_compaction():
+                    self._optimize_in_background(subject_name)
+            manifest.save()
+            self._write_file_names(self.get_subject_path(subject_name), manifest, removed=names)
+            return {"found": True, "removed": removed, "shared": len(shared)}
+
+    def _embed_and_add(self, subject_name: str, docs: List[Document], stage: str = "") -> SubjectIndex:
+        texts = [d.page_content for d in docs]
+        metadatas = [d.metadata for d in docs]
+        # 임베딩은 락 밖에서 계산하고, 색인에는 스냅샷 교체로 추가 (검색은 기다리지 않음)
+        pairs = list(zip(texts, self.embed.embed_documents(texts)))
+        store = self._get_or_create_store(subject_name)
+        store.add_embeddings(pairs, metadatas=metadatas, stage=stage)
+        # 전체를 다시 세지 않고 추가분만 반영
+        added_bytes = len(pairs) * len(pairs[0][1]) * 4 + sum(len(t.encode("utf-8")) for t in texts)
+        with self._cache_lock:
+            base_bytes = self.store_bytes.get(subject_name, 0)
+        self._cache_store(subject_name, store, base_bytes + added_bytes)
+        return store
+
+    def _get_or_create_store(self, subject_name: str) -> SubjectIndex:
+        store = self.get_store(subject_name)
+        if store is None:
+            # 새 과목: 동시에 적재하는 작업들이 같은 색인 객체에 tail을 쌓도록 로드 락 안에서 한 번만 만듦
+            with self._load_mutex(subject_name):
+                store = self._cached(subject_name)
+                if store is None:
+                    store = SubjectIndex(self.get_subject_path(subject_name), self.embed)
+                    self._cache_store(subject_name, store, 0)
+        return store
+
+    def _optimize_in_background(self, subject_name: str):
+        with self._cache_lock:
+            if subject_name in self._compacting:
+                return
+            self._compacting.add(subject_name)
+        threading.Thread(target=self._optimize_worker, args=(subject_name,), daemon=True).start()
+
+    def _optimize_worker(self, subject_name: str):
+        try:
+            self.optimize_subject(subject_name)
+        except Exception as e:
+            print(f"과목 {subject_name} 색인 최적화 실패: {e}")
+        finally:
+            with self._cache_lock:
+                self._compacting.discard(subject_name)
+
+    def optimize_subject(self, subject_name: str) -> List[dict]:
+        """필요하면 세그먼트를 병합하고, 임계값을 넘은 세그먼트는 ANN 색인으로 전환 (recall 검사 통과 시)"""
+        with self._pin(subject_name):
+            store = self.get_store(subject_name)
+            if not store:
+                return []
+            largest = max((len(seg) for _, seg in store.segments), default=0)
+            if store.ntotal >= Config.ANN_THRESHOLD > largest and len(store.segments) > 1:
+                # 과목 전체는 임계값을 넘었지만 세그먼트가 쪼개져 있으면 한 번만 전부 합쳐서 한 번에 학습
+                self.compact_subject(subject_name, full=True)
+            # 단계별 병합: 한 번 병합해 윗단계가 다시 가득 차면 이어서 병합
+            while store.needs_compaction() and self.compact_subject(subject_name):
+                pass
+            if store.ann_candidates():
+                # 학습과 기록은 병합 락 안에서 (다른 프로세스와 같은 세그먼트에 동시에 쓰지 않음)
+                with store.compaction():
+                    store.refresh()
+                    built = store.build_ann(Config.ANN_INDEX_TYPE)
+                    if built:
+                        with self._subject_mutex(subject_name):
+                            store.attach_ann(built)
+                for _, info in built:
+                    print(f"과목 {subject_name} ANN 색인 {info['type']}: recall={info['recall']} "
+                          f"({'전환' if info['accepted'] else '정확 검색 유지'})")
+            self._cache_store(subject_name, store)
+            return store.index_report()
+
+    def compact_subject(self, subject_name: str, full: bool = False) -> bool:
+        """병합 정책이 고른 크기가 비슷한 세그먼트들을 병합 (full이면 전부 하나로)
+
+        병합 중에도 검색/적재는 계속 가능하고 교체 순간에만 잠깐 막힘. 병합은 과목 병합 락으로 프로세스 간에
+        한 번에 하나씩이며, 락을 잡을 때 중단된 병합이 남긴 임시 폴더를 정리함
+        """
+        with self._pin(subject_name):
+            store = self.get_store(subject_name)
+            if not store:
+                return False
+            with store.compaction():
+                store.refresh()
+                built = store.build_compacted(full)
+                if not built:
+                    return False
+                with self._subject_mutex(subject_name):
+                    return store.commit_compacted(*built)
+
+    def set_compression(self, subject_name: str, mode: str) -> List[dict]:
+        """과목 벡터 저장 방식을 변경 (none/fp16/int8/pq). 코드 생성 중에도 검색은 계속 가능"""
+        with self._pin(subject_name):
+            store = self.get_store(subject_name)
+            if not store:
+                return []
+            # 코드 생성은 병합 락 안에서 (병합이나 다른 프로세스의 압축 변경과 겹치지 않음)
+            with store.compaction():
+                store.refresh()
+                built = store.build_compression(mode)
+                with self._subject_mutex(subject_name):
+                    store.attach_compression(mode, built)
+            self._cache_store(subject_name, store)
+            return store.index_report()
+
+    def compression_report(self, subject_name: str) -> List[dict]:
+        """압축 방식별 메모리와 recall 비교표"""
+        store = self.get_store(subject_name)
+        if not store:
+            return []
+        return store.compression_report()
+
+    def get_index_report(self, subject_name: str) -> List[dict]:
+        """세그먼트별 크기와 색인 종류(flat/hnsw/ivf), recall"""
+        store = self.get_store(subject_name)
+        return store.index_report() if store else []
+
+    def _write_file_names(self, subject_path: str, manifest: SubjectManifest, added: List[str] = (),
+                          removed: Iterable[str] = ()):
+        """pdf_files.txt를 manifest 기준으로 다시 씀 (호출자는 과목 mutex와 파일 락을 잡고 있어야 함)
+
+        manifest에 없는 이름(파일 해시 없이 올렸거나 manifest 도입 전에 올린 파일)은 removed가 아니면 유지
+        """
+        meta_file = os.path.join(subject_path, "pdf_files.txt")
+        existing_files = []
+        if os.path.exists(meta_file):
+            with open(meta_file, "r", encoding="utf-8") as f:
+                existing_files = [line.strip() for line in f if line.strip()]
+        known = manifest.file_names()
+        removed = set(removed)
+        names = [n for n in dict.fromkeys(existing_files + list(added) + known)
+                 if n in known or n not in removed]
+        if names == existing_files:
+            return
         os.makedirs(subject_path, exist_ok=True)
-        self.stores[subject_name].save_local(subject_path)
-
-        # ✅ PDF 파일명 기록 (중복 방지)
-        if file_name:
-            meta_file = os.path.join(subject_path, "pdf_files.txt")
-            existing_files = []
-            if os.path.exists(meta_file):
-                with open(meta_file, "r", encoding="utf-8") as f:
-                    existing_files = [line.strip() for line in f if line.strip()]
-            if file_name not in existing_files:
-                with open(meta_file, "a", encoding="utf-8") as f:
-                    f.write(file_name + "\n")
+        tmp_path = meta_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(n + "\n" for n in names)
+        os.replace(tmp_path, meta_file)
 
     def get_subjects(self):
-        if not os.path.exists(Config.FAISS_BASE_PATH):
-            return []
-        return [
-            d for d in os.listdir(Config.FAISS_BASE_PATH)
-            if d.strip() and os.path.isdir(os.path.join(Config.FAISS_BASE_PATH, d))
-        ]
+        return list_subjects()
+
+    def _cached(self, subject_name: str) -> Optional[SubjectIndex]:
+        with self._cache_lock:
+            store = self.stores.get(subject_name)
+            if store is not None:
+                self.stores.move_to_end(subject_name)
+            return store
 
-    def get_store(self, subject_name: str) -> FAISS:
-        return self.stores.get(subject_name)
+    def get_store(self, subject_name: str) -> Optional[SubjectIndex]:
+        store = self._cached(subject_name)
+        if store is not None:
+            # 다른 프로세스가 새 버전을 기록했으면 넘어감 (갱신 중이면 기다리지 않고 현재 스냅샷 사용)
+            store.refresh()
+            return store
+        # 같은 과목을 여러 세션이 동시에 로드하지 않도록 로드 락 안에서 다시 확인 (적재 중인 쓰기 mutex와 별개)
+        with self._load_mutex(subject_name):
+            store = self._cached(subject_name)
+            if store is None:
+                store = self._load_subject(subject_name)
+                if store is not None:
+                    self._cache_store(subject_name, store)
+                    if store.ann_candidates():
+                        self._optimize_in_background(subject_name)
+        return store
+
+    def get_index_revision(self, subject_name: str) -> Optional[Tuple]:
+        """과목 색인 내용이 바뀌면(적재, 파일 삭제, 병합, 재생성) 달라지는 값. 색인이 없으면 None"""
+        if not self._has_index(subject_name) and subject_name not in self.stores:
+            return None
+        store = self.get_store(subject_name)
+        return store.revision if store else None
 
     def search(self, subject_name: str, query: str, k=4):
-        store = self.stores.get(subject_name)
-        return store.similarity_search(query, k=k) if store else []
+        return [doc for doc, _ in self.search_with_scores(subject_name, query, k)]
+
+    def search_with_scores(self, subject_name: str, query: str, k=4) -> List[Tuple[Document, float]]:
+        if not self._has_index(subject_name) and subject_name not in self.stores:
+            return []
+        # 질의 임베딩은 락 밖에서 계산
+        return [(doc, dist) for doc, dist, _ in self._search_vector(subject_name, self.embed.embed_query(query), k)]
+
+    def search_hits(self, subject_name: str, query: str, k=4) -> SearchHits:
+        """search와 같되 색인에 저장된 청크 벡터와 질의 벡터를 함께 반환 (context MMR이 다시 임베딩하지 않음)"""
+        if not self._has_index(subject_name) and subject_name not in self.stores:
+            return SearchHits([], [], None)
+        embedding = self.embed.embed_query(query)
+        return SearchHits.from_hits(self._search_vector(subject_name, embedding, k), embedding)
+
+    def _search_vector(self, subject_name: str, embedding: List[float],
+                       k: int) -> List[Tuple[Document, float, np.ndarray]]:
+        store = self.get_store(subject_name)
+        if not store:
+            return []
+        return store.search_hits_by_vectors([embedding], k)[0]
+
+    def search_many(self, subject_name: str, queries: List[str], k=4) -> List[List[Document]]:
+        return [[doc for doc, _ in hits] for hits in self.search_many_with_scores(subject_name, queries, k)]
+
+    def search_many_with_scores(self, subject_name: str, queries: List[str],
+                                k=4) -> List[List[Tuple[Document, float]]]:
+        """여러 질의를 한 번의 배치 임베딩과 세그먼트별 한 번의 FAISS 검색으로 처리. 결과는 질의 순서대로"""
+        queries = list(queries)
+        if not queries or (not self._has_index(subject_name) and subject_name not in self.stores):
+            return [[] for _ in queries]
+        embed_queries = getattr(self.embed, "embed_queries", self.embed.embed_documents)
+        embeddings = embed_queries(queries)
+        store = self.get_store(subject_name)
+        if not store:
+            return [[] for _ in queries]
+        return store.similarity_search_with_score_by_vectors(embeddings, k)
+
+    def search_all(self, query: str, k=4, subjects: Optional[List[str]] = None) -> List[Tuple[Document, float]]:
+        """여러 과목 통합 검색: 질의는 한 번만 임베딩하고 과목별 검색은 스레드로 병렬 실행 (FAISS는 GIL 해제)
+
+        결과는 L2 거리 순 상위 k개이며 각 문서의 metadata["subject"]에 출처 과목을 기록
+        """
+        return [(doc, dist) for doc, dist, _ in self._search_all_vector(self.embed.embed_query(query), k, subjects)]
+
+    def search_all_hits(self, query: str, k=4, subjects: Optional[List[str]] = None) -> SearchHits:
+        """search_all과 같되 저장된 청크 벡터와 질의 벡터를 함께 반환"""
+        embedding = self.embed.embed_query(query)
+        return SearchHits.from_hits(self._search_all_vector(embedding, k, subjects), embedding)
+
+    def _search_all_vector(self, embedding: List[float], k: int,
+                           subjects: Optional[List[str]]) -> List[Tuple[Document, float, np.ndarray]]:
+        subjects = [s for s in (subjects if subjects is not None else self.get_subjects()) if s.strip()]
+        if not subjects:
+            return []
+        futures = {s: self._search_pool.submit(self._search_vector, s, embedding, k) for s in subjects}
+        merged = []
+        for subject_name, future in futures.items():
+            try:
+                hits = future.result()
+            except Exception as e:
+                print(f"과목 {subject_name} 검색 실패: {e}")
+                continue
+            merged.extend(
+                (Document(page_content=doc.page_content, metadata={**doc.metadata, "subject": subject_name}),
+                 score, vector)
+                for doc, score, vector in hits
+            )
+        merged.sort(key=lambda x: x[1])
+        return merged[:k]
+
+    def get_federated_retriever(self, subjects: Optional[List[str]] = None, k=4):
+        return FederatedRetriever(vs_manager=self, subjects=subjects, k=k)
+
+    def sample_documents(self, subject_name: str, k: int) -> List[Document]:
+        """과목 청크 중 k개를 무작위로 선택"""
+        store = self.get_store(subject_name)
+        if not store:
+            return []
+        return store.sample(k)
 
     def get_retriever(self, subject_name: str, k=4):
-        store = self.stores.get(subject_name)
-        return store.as_retriever(search_kwargs={"k": k}) if store else None
+        if not self._has_index(subject_name) and subject_name not in self.stores:
+            return None
+        return SubjectRetriever(vs_manager=self, subject_name=subject_name, k=k)
 
     def delete_subject(self, subject_name: str):
-        if subject_name in self.stores:
-            del self.stores[subject_name]
+        with self._subject_mutex(subject_name), self._subject_file_lock(subject_name):
+            self.manifests.pop(subject_name, None)
+            with self._cache_lock:
+                self.store_bytes.pop(subject_name, None)
+                self.stores.pop(subject_name, None)
             subject_path = self.get_subject_path(subject_name)
             if os.path.exists(subject_path):
                 shutil.rmtree(subject_path)
 
     def get_subject_info(self, subject_name: str):
-        store = self.stores.get(subject_name)
-        meta_file = os.path.join(self.get_subject_path(subject_name), "pdf_files.txt")
-        pdf_file_count = 0
-        if os.path.exists(meta_file):
-            with open(meta_file, "r", encoding="utf-8") as f:
-                pdf_file_count = len([line.strip() for line in f if line.strip()])
-        return {
-            "status": "활성화됨" if store else "초기화되지 않음",
-            "문서 수": pdf_file_count  # ✅ PDF 파일 수만 표시
-        }
+        return subject_info(subject_name, loaded=subject_name in self.stores)
+
+
+_shared_manager: Optional[MultiSubjectVectorStoreManager] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_manager() -> MultiSubjectVectorStoreManager:
+    """프로세스 전체에서 하나만 만드는 공유 관리자 (임베딩 모델과 과목 색인을 모든 세션이 공유)"""
+    global _shared_manager
+    if _shared_manager is None:
+        with _shared_lock:
+            if _shared_manager is None:
+                _shared_manager = MultiSubjectVectorStoreManager()
+    return _shared_manager